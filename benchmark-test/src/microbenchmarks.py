@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmarks of the hot python functions of the service and the indexer,
+run on synthetic data sized like production (--scale 1 gives 200000 works).
+
+Timings are stored relative to a fixed calibration workload, so a baseline
+recorded on one machine can be checked on another of a different speed.
+
+    python3 benchmark-test/src/microbenchmarks.py --save-baseline
+    python3 benchmark-test/src/microbenchmarks.py --check --threshold 0.25
+
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from simple_search.solr import indexer
+from simple_search.solr.search import build_result, create_bf, parse_options, parse_pid_to_type_map
+from simple_search.synonym_list import Synonyms
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "microbenchmarks-baseline.json")
+
+WORKS = 200000
+LANGUAGES = ["dan", "eng", "ger", "swe", "nor", "fre", "mul"]
+TYPES = ["Bog", "Ebog", "Lydbog (net)", "Lydbog (cd-mp3)", "Film (dvd)", "Musik (cd)", "Tidsskriftsartikel"]
+COLLECTIONS = ["870970-basis", "870970-katalog", "870971-avis", "870971-tsart", "150015-ereol"]
+OPTION_SETS = [{}, {"include-smartsearch": True}, {"include-smartsearch": True, "include-synonyms": True},
+               {"include-phonetic-creator": True, "include-curatedsearch": True}]
+
+
+class Fixtures():
+    """ Deterministic synthetic data shaped like the production data """
+    def __init__(self, scale=1.0, seed=42):
+        rnd = random.Random(seed)
+        self.random = rnd
+        words = [f"ord{i}" for i in range(50000)]
+        creators = [f"{rnd.choice(words)} {rnd.choice(words)}" for _ in range(40000)]
+        subjects = [f"emne{i}" for i in range(20000)]
+        self.subjects = subjects
+
+        n_works = max(1, int(WORKS * scale))
+        self.pid2work = {}
+        self.docs = {}
+        for w in range(n_works):
+            work = f"work-of:870970-basis:{w:08d}"
+            # Most works have one or two manifestations, a few have many
+            for p in range(min(1 + int(rnd.expovariate(1.5)), 20)):
+                pid = f"{rnd.choice(COLLECTIONS)}:{w:08d}{p:02d}"
+                self.pid2work[pid] = work
+                self.docs[pid] = {"title": [" ".join(rnd.choices(words, k=rnd.randint(1, 6)))],
+                                  "title_alternative": [rnd.choice(words)],
+                                  "creator": rnd.sample(creators, rnd.randint(1, 2)),
+                                  "creator_sort": [rnd.choice(creators)],
+                                  "contributor": rnd.sample(creators, rnd.randint(0, 3)),
+                                  "aut": [rnd.choice(creators)],
+                                  "work_type": ["literature"],
+                                  "language": [rnd.choice(LANGUAGES)],
+                                  "subject_dbc": rnd.sample(subjects, rnd.randint(0, 5)),
+                                  "series": [rnd.choice(words)] if rnd.random() < 0.2 else [],
+                                  "year": [str(rnd.randint(1950, 2023))],
+                                  "collection": [pid.split(":")[0]],
+                                  "type": [rnd.choice(TYPES)]}
+        works = sorted(set(self.pid2work.values()))
+        self.work_to_holdings = {w: rnd.randint(1, 5000) for w in works if rnd.random() < 0.7}
+        self.popularity = {pid: rnd.randint(1, 10000) for pid in self.pid2work if rnd.random() < 0.5}
+        self.popularity_file = "".join(f"{count} {pid}\n" for pid, count in self.popularity.items()).encode("utf8")
+
+        # Documents as returned by solr, 10 to a search
+        self.solr_docs = []
+        pids = list(self.pid2work)
+        for i in range(10000):
+            doc_pids = rnd.sample(pids, min(len(pids), 1 + int(rnd.expovariate(0.5))))
+            types = [rnd.choice(TYPES) for _ in doc_pids]
+            self.solr_docs.append({"pids": doc_pids,
+                                   "title": rnd.choice(words),
+                                   "language": [rnd.choice(LANGUAGES)],
+                                   "creator": [rnd.choice(creators)],
+                                   "workid": self.pid2work[doc_pids[0]],
+                                   "pid_to_type_map": [f"{p}:::{p.split(':')[0]}:::{t}" for p, t in zip(doc_pids, types)]})
+        self.searches = [self.solr_docs[i: i + 10] for i in range(0, len(self.solr_docs), 10)]
+        self.workid_lists = [rnd.sample(works, min(len(works), 3)) for _ in range(10000)]
+        self.options = [rnd.choice(OPTION_SETS) for _ in range(10000)]
+
+        fd, self.synonym_file = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "w") as fp:
+            for _ in range(30000):
+                fp.write(",".join(rnd.sample(subjects, rnd.randint(2, 4))) + "\n")
+
+    def close(self):
+        os.remove(self.synonym_file)
+
+
+def benchmarks(fixtures):
+    """ Returns name -> function to time """
+    synonyms = Synonyms(fixtures.synonym_file)
+    read_popularity_counts = getattr(indexer, "__read_popularity_counts")
+    return {
+        "parse_pid_to_type_map": lambda: [parse_pid_to_type_map(doc["pid_to_type_map"]) for doc in fixtures.solr_docs],
+        "create_bf": lambda: [create_bf(workids) for workids in fixtures.workid_lists],
+        "parse_options": lambda: [parse_options(options) for options in fixtures.options],
+        "build_result": lambda: [build_result(docs, ["pids", "title", "language"], True, False) for docs in fixtures.searches],
+        "build_result_debug": lambda: [build_result(docs, ["pids", "title", "language"], True, True) for docs in fixtures.searches],
+        "map_work_to_metadata": lambda: indexer.map_work_to_metadata(fixtures.docs, fixtures.pid2work),
+        "make_solr_documents": lambda: list(indexer.build_solr_documents(fixtures.pid2work, fixtures.docs, fixtures.work_to_holdings,
+                                                                         fixtures.popularity, synonyms)),
+        "synonyms_init": lambda: Synonyms(fixtures.synonym_file),
+        "read_popularity_counts": lambda: read_popularity_counts(io.BytesIO(fixtures.popularity_file)),
+    }
+
+
+def calibration():
+    """ Fixed pure python workload the benchmark timings are expressed relative to """
+    d = {}
+    for i in range(300000):
+        d[f"key{i % 5000}"] = d.get(f"key{i % 5000}", 0) + i
+    return sorted(d.items())
+
+
+def measure(function, repeat, min_time=0.5):
+    """
+    Returns the time of one call of function in seconds, as the fastest of
+    repeat runs. Fast functions are called several times in each run, so a
+    run takes at least min_time
+    """
+    loops = 1
+    while True:
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed * 2 >= min_time else 10
+    timings = [elapsed]
+    for _ in range(repeat - 1):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) / loops
+
+
+def run(scale, repeat, only=None):
+    calibration_seconds = measure(calibration, max(repeat, 5))
+    fixtures = Fixtures(scale)
+    try:
+        results = {}
+        for name, function in benchmarks(fixtures).items():
+            if only and name not in only:
+                continue
+            seconds = measure(function, repeat)
+            results[name] = {"seconds": seconds, "relative": seconds / calibration_seconds}
+            print(f"{name:<28} {seconds * 1000:10.2f} ms  {results[name]['relative']:10.2f} x calibration", flush=True)
+    finally:
+        fixtures.close()
+    return {"scale": scale, "calibration_seconds": calibration_seconds, "python": sys.version.split()[0], "results": results}
+
+
+def check(current, baseline, threshold):
+    """ Returns the names of the benchmarks slower than baseline by more than threshold """
+    if current["scale"] != baseline["scale"]:
+        raise ValueError(f"baseline was recorded with scale {baseline['scale']}, not {current['scale']}")
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["relative"] / baseline["results"][name]["relative"]
+        status = "SLOWER" if ratio > 1 + threshold else "ok"
+        print(f"{name:<28} {ratio:6.2f} x baseline  {status}")
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(description="Runs the microbenchmarks and compares them to a stored baseline")
+    parser.add_argument("--scale", type=float, default=1.0, help=f"size of the synthetic data. 1 gives {WORKS} works")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark. The fastest counts")
+    parser.add_argument("--only", action="append", help="benchmark to run. May be repeated")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail if a benchmark is slower than the baseline by more than the threshold")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, as a fraction of the baseline")
+    parser.add_argument("-o", "--output", help="file to write the results to as json")
+    return parser.parse_args()
+
+
+def main():
+    args = setup_args()
+    current = run(args.scale, args.repeat, args.only)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(current, fp, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as fp:
+            json.dump(current, fp, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}. Record one with --save-baseline on the machine the check runs on")
+            sys.exit(2)
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        regressions = check(current, baseline, args.threshold)
+        if regressions:
+            print(f"Slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,4 +2,4 @@
 
 set -xe
 
-simple-search-service --port 5000  --smart-search search2works.json --curated-search curated-searches.jsonl $SOLR_URL
+simple-search-service --port 5000 --workers ${WORKERS:-1} --smart-search search2works.bin --curated-search curated-searches.jsonl ${HEAD_SNAPSHOT:+--head-snapshot $HEAD_SNAPSHOT} ${SOLR_HEDGE:+--solr-hedge} $SOLR_URL
@@ -9,7 +9,7 @@ setup(name="simple-search",
     description="",
     provides=["simple_search"],
     install_requires=["booklens", "dbc-pyutils", "joblib", "mobus", "numpy",
-        "pandas", "tornado", "tqdm", "plotnine", "rrflow", "requests", "grequests"],
+        "pandas", "pycurl", "tornado", "tqdm", "plotnine", "rrflow", "requests", "orjson"],
     include_package_data=True,
     entry_points=
         {"console_scripts": [
@@ -19,6 +19,11 @@ setup(name="simple-search",
             "pid-list-generator = simple_search.solr.pid_fetcher:main",
             "generate-work-to-holdings-map = simple_search.solr.indexer:generate_work_to_holdings_map",
             "generate-synonym-list = simple_search.synonym_list:cli",
+            "generate-smartsearch-store = simple_search.smartsearch_store:convert",
+            "build-head-snapshot = simple_search.head_snapshot:main",
+            "simple-search-loadtest = simple_search.loadtest:main",
+            "fake-solr = simple_search.solr.fake_solr:main",
+            "solr-cassette = simple_search.solr.cassette:main",
             "evaluate-search = simple_search.evaluation:main",
         ]}
     )
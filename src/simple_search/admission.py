@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.admission` -- admission control for solr calls
+
+=========
+admission
+=========
+
+Bounds the number of concurrent solr calls. Calls beyond the limit wait in
+a short queue, and are rejected when the queue is full or the wait is too
+long, so overload is answered with fast errors instead of ever growing
+latency for every request.
+
+"""
+import asyncio
+import time
+
+from simple_search.metrics import Counter, Gauge
+
+QUEUE_DEPTH = Gauge("simple_search_admission_queue_depth",
+                    "Number of solr calls waiting for admission")
+IN_FLIGHT = Gauge("simple_search_admission_in_flight",
+                  "Number of admitted solr calls in flight")
+REJECTED = Counter("simple_search_admission_rejected_total",
+                   "Solr calls rejected by admission control", ["reason"])
+DEADLINE_MISSES = Counter("simple_search_deadline_misses_total",
+                          "Searches which did not complete within their deadline", ["reason"])
+
+
+class Overloaded(Exception):
+    """ Raised when a call is not admitted """
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when a call can not complete within its deadline """
+
+
+class AdmissionControl():
+    """
+    Concurrency limit with a bounded wait queue. Use as
+
+        async with admission.slot(deadline):
+            ...
+    """
+    def __init__(self, max_concurrency=50, max_queue=100, queue_timeout=0.1, clock=time.monotonic):
+        """
+        :param max_concurrency:
+            max number of admitted calls in flight
+        :param max_queue:
+            max number of calls waiting for admission. Calls arriving when
+            the queue is full are rejected immediately
+        :param queue_timeout:
+            max time in seconds a call waits for admission
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def slot(self, deadline=None):
+        """
+        Returns an async context manager holding an admission slot
+
+        :param deadline:
+            clock time after which the call is pointless. Waiting for
+            admission never extends beyond it
+        """
+        return _Slot(self, deadline)
+
+    async def acquire(self, deadline=None):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full")
+            timeout = self.queue_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - self.clock())
+            self.waiting += 1
+            QUEUE_DEPTH.set(self.waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                self._reject("queue_timeout")
+            finally:
+                self.waiting -= 1
+                QUEUE_DEPTH.set(self.waiting)
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+        IN_FLIGHT.set(self.in_flight)
+
+    def release(self):
+        self.in_flight -= 1
+        IN_FLIGHT.set(self.in_flight)
+        self._semaphore.release()
+
+    def _reject(self, reason):
+        self.rejected += 1
+        REJECTED.inc(reason=reason)
+        raise Overloaded(f"search capacity exceeded ({reason.replace('_', ' ')})")
+
+    def stats(self):
+        return {"max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected}
+
+
+class _Slot():
+    def __init__(self, admission, deadline):
+        self.admission = admission
+        self.deadline = deadline
+
+    async def __aenter__(self):
+        await self.admission.acquire(self.deadline)
+
+    async def __aexit__(self, *exc_info):
+        self.admission.release()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.cache` -- bounded in-process caches
+
+=====
+cache
+=====
+
+Least-recently-used cache with time-to-live eviction and hit/miss counters.
+
+"""
+from collections import OrderedDict
+import time
+
+_MISSING = object()
+
+
+class LRUCache():
+    """
+    Bounded mapping evicting the least recently used entry when full,
+    and entries older than ttl seconds on lookup
+    """
+    def __init__(self, maxsize=10000, ttl=300, clock=time.monotonic):
+        """
+        Initializes cache
+
+        :param maxsize:
+            max number of entries. A maxsize of 0 disables the cache
+        :param ttl:
+            time to live in seconds for each entry
+        :param clock:
+            function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, *, count=True):
+        entry = self._data.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > self.clock():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            del self._data[key]
+            self.evictions += 1
+        if count:
+            self.misses += 1
+        return default
+
+    def put(self, key, value, ttl=None):
+        """ Stores value under key. ttl overrides the default time to live for this entry """
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0}
+
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.covers` -- cached cover url lookup
+
+======
+covers
+======
+
+Looks up cover urls for many pids in one upstream call. Lookups run in a
+thread pool, off the IOLoop, and both found and missing covers are cached.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import logging
+
+from tornado.ioloop import IOLoop
+
+from simple_search.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class CoverLookup():
+    """
+    Cover url lookup with an LRU cache in front of a CoverUrls client
+    """
+    def __init__(self, cover_func, cache_size=100000, ttl=86400, negative_ttl=3600, max_workers=4):
+        """
+        Initializes lookup
+
+        :param cover_func:
+            function called as cover_func(pids, fields=['coverUrlFull']), e.g. a dbc_pyutils.CoverUrls client
+        :param cache_size:
+            max number of cached pids
+        :param ttl:
+            time to live in seconds for a found cover url
+        :param negative_ttl:
+            time to live in seconds for a pid without a cover
+        :param max_workers:
+            max number of concurrent upstream lookups
+        """
+        self.cover_func = cover_func
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        self.negative_ttl = negative_ttl
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    async def urls(self, pids):
+        """ Returns a dict mapping each of pids with a cover to its cover url """
+        result = {}
+        missing = []
+        for pid in dict.fromkeys(pids):
+            url = self.cache.get(pid)
+            if url is None:
+                missing.append(pid)
+            else:
+                result[pid] = url
+        if missing:
+            cover_info = await IOLoop.current().run_in_executor(self.executor,
+                partial(self.cover_func, missing, fields=['coverUrlFull']))
+            for pid in missing:
+                url = cover_info.get(pid, {}).get('coverUrlFull', [''])[0]
+                # Missing covers are cached as '' for a shorter time
+                self.cache.put(pid, url, ttl=None if url else self.negative_ttl)
+                result[pid] = url
+        return {pid: url for pid, url in result.items() if url}
+
+    def status(self):
+        return self.cache.stats()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.head_snapshot` -- precomputed results of head queries
+
+=============
+head_snapshot
+=============
+
+Runs the most frequent queries through the searcher for the common option
+sets, and writes the results to a snapshot file. The service loads the
+snapshot at startup (--head-snapshot). Once a solr replica is found to
+have the index version the snapshot was built on, the service answers
+those queries from memory until the index of that replica changes.
+
+"""
+import argparse
+import asyncio
+from collections import Counter
+import datetime
+import json
+import logging
+
+from simple_search.smartsearch import load_content
+from simple_search.solr.search import Searcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTION_SETS = [{}, {"include-smartsearch": True}]
+
+
+def smartsearch_head_queries(smartsearch_content_path, n):
+    """ Returns the n queries with the most clicks in the smartsearch content """
+    content = load_content(smartsearch_content_path)
+    counts = Counter({query: sum(count for _, count in hits) for query, hits in content.items()})
+    return [query for query, _ in counts.most_common(n)]
+
+
+def request_file_queries(path):
+    """ Returns the (query, options) pairs of a file with a json search request on each line """
+    requests = []
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                request = json.loads(line)
+                requests.append((request["q"].strip(), request.get("options", {})))
+    return requests
+
+
+async def build_snapshot(searcher, requests, rows=10, max_concurrency=8):
+    """
+    Searches each (query, options) pair in requests and returns the snapshot content
+
+    :param searcher:
+        Searcher to run the queries through
+    """
+    await searcher.refresh_index_version()
+    batch = [{"q": q, "options": options, "rows": rows} for q, options in requests]
+    results = await searcher.search_batch(batch, max_concurrency)
+    entries = []
+    for request, result in zip(batch, results):
+        if "error" in result:
+            logger.warning(f"Leaving out {request}: {result['error']}")
+            continue
+        entries.append(dict(request, start=0, debug=False, result=result["result"]))
+    return {"index_version": searcher.index_version,
+            "created": datetime.datetime.now().isoformat(),
+            "entries": entries}
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(description="Builds a snapshot of results for the most frequent queries")
+    parser.add_argument("solr_url", metavar="solr-url")
+    parser.add_argument("outfile", help="path of the snapshot to write")
+    parser.add_argument("--smart-search", dest="smart_search", help="file with smartsearch model content. Its most clicked queries are included")
+    parser.add_argument("--curated-search", dest="curated_search", help="file with curated search content")
+    parser.add_argument("-n", "--num-queries", dest="num_queries", type=int, default=1000,
+        help="number of head queries taken from the smartsearch content")
+    parser.add_argument("-r", "--requests-file", dest="requests_files", action="append", default=[],
+        help="file with a json search request on each line, e.g. from benchmark-test/request-examples. May be repeated")
+    parser.add_argument("--option-sets", dest="option_sets", type=json.loads, default=DEFAULT_OPTION_SETS,
+        help="json list of option objects each smartsearch head query is searched with")
+    parser.add_argument("--rows", type=int, default=10)
+    return parser.parse_args()
+
+
+def main():
+    args = setup_args()
+    logging.basicConfig(format="%(asctime)s : %(levelname)s : %(message)s", level=logging.INFO)
+    requests = []
+    if args.smart_search:
+        for query in smartsearch_head_queries(args.smart_search, args.num_queries):
+            requests += [(query, options) for options in args.option_sets]
+    for path in args.requests_files:
+        requests += request_file_queries(path)
+    # Searches are keyed on the query and the parsed options, so duplicates are dropped on that
+    unique = {}
+    for query, options in requests:
+        unique.setdefault((query, json.dumps(options, sort_keys=True)), (query, options))
+    requests = list(unique.values())
+
+    searcher = Searcher(args.solr_url, args.smart_search, args.curated_search, cache_size=0)
+    snapshot = asyncio.run(build_snapshot(searcher, requests, args.rows))
+    with open(args.outfile, "w") as fp:
+        json.dump(snapshot, fp)
+    logger.info(f"Wrote {len(snapshot['entries'])} results for index version {snapshot['index_version']} to {args.outfile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.loadtest` -- open-loop load generator
+
+========
+loadtest
+========
+
+Replays a file of search requests against the service at a fixed arrival
+rate, independent of how fast the service answers (open loop), and reports
+throughput and latency percentiles. Latency is measured from the time each
+request was scheduled to be sent, so queueing in the client is included.
+
+Optionally starts the service against a local fake solr with tunable
+latency, to measure the overhead and scaling of the service itself.
+
+"""
+import argparse
+import asyncio
+from collections import Counter
+import contextlib
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99, "p999": 99.9}
+
+
+def read_requests(path):
+    """ Returns the requests of a file with a json search request on each line """
+    with open(path) as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def percentile(ordered, p):
+    """ Returns the p'th percentile (nearest rank) of a sorted list """
+    if not ordered:
+        return None
+    # Rounded first, so float error does not push an exact rank to the next one
+    rank = math.ceil(round(p / 100 * len(ordered), 6)) - 1
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def summarize(latencies, statuses, elapsed, rate):
+    """
+    Returns the results of a run
+
+    :param latencies:
+        latencies in seconds of the successful requests
+    :param statuses:
+        Counter of response status codes, 599 for requests which got no response
+    :param elapsed:
+        wall time of the run in seconds
+    :param rate:
+        offered arrival rate in requests per second
+    """
+    ordered = sorted(latencies)
+    total = sum(statuses.values())
+    summary = {"requests": total,
+               "ok": len(ordered),
+               "errors": total - len(ordered),
+               "statuses": {str(status): count for status, count in sorted(statuses.items())},
+               "offered_rate": rate,
+               "throughput": len(ordered) / elapsed if elapsed > 0 else 0.0,
+               "elapsed": elapsed,
+               "latency": {"mean": sum(ordered) / len(ordered) if ordered else None,
+                           "max": ordered[-1] if ordered else None}}
+    for name, p in PERCENTILES.items():
+        summary["latency"][name] = percentile(ordered, p)
+    return summary
+
+
+def make_http_request(url, request, method, timeout):
+    if method == "get":
+        params = {"q": request["q"]}
+        for key in ["rows", "debug"]:
+            if key in request:
+                params[key] = str(request[key])
+        return HTTPRequest(url + "?" + urllib.parse.urlencode(params), request_timeout=timeout)
+    return HTTPRequest(url, method="POST", body=json.dumps(request),
+                       headers={"Content-Type": "application/json"}, request_timeout=timeout)
+
+
+async def run_load(url, requests, rate, num_requests, method="post", timeout=10.0, poisson=False, max_connections=1000, seed=None):
+    """
+    Sends num_requests requests, cycling through requests, at rate requests
+    per second and returns the summary of the run
+
+    :param poisson:
+        if set, arrivals are a poisson process with the given rate. Otherwise evenly spaced
+    """
+    client = AsyncHTTPClient(force_instance=True, max_clients=max_connections)
+    arrivals = random.Random(seed)
+    latencies = []
+    statuses = Counter()
+
+    async def send(http_request, scheduled):
+        response = await client.fetch(http_request, raise_error=False)
+        statuses[response.code] += 1
+        if response.code == 200:
+            latencies.append(time.monotonic() - scheduled)
+
+    tasks = []
+    start = time.monotonic()
+    scheduled = start
+    for i in range(num_requests):
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(make_http_request(url, requests[i % len(requests)], method, timeout), scheduled)))
+        scheduled += arrivals.expovariate(rate) if poisson else 1 / rate
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+    client.close()
+    return summarize(latencies, statuses, elapsed, rate)
+
+
+def wait_until_ready(url, timeout=120):
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > end:
+                raise RuntimeError(f"{url} did not become ready within {timeout} seconds")
+            time.sleep(0.2)
+
+
+@contextlib.contextmanager
+def local_service(args):
+    """ Starts a fake solr and the service using it. Yields the search url of the service """
+    processes = []
+    try:
+        solr_url = f"http://localhost:{args.fake_solr_port}/solr/simple-search"
+        processes.append(subprocess.Popen([sys.executable, "-m", "simple_search.solr.fake_solr",
+                                           "--port", str(args.fake_solr_port),
+                                           "--latency", str(args.solr_latency),
+                                           "--jitter", str(args.solr_jitter)]))
+        wait_until_ready(solr_url + "/admin/ping")
+        service = shutil.which("simple-search-service")
+        if service is None:
+            raise RuntimeError("simple-search-service is not installed")
+        env = dict(os.environ)
+        # The service requires these to start, but does not need them to search
+        env.setdefault("AUTHKEYMAP", "{}")
+        env.setdefault("OPEN_PLATFORM_CLIENT_ID", "")
+        env.setdefault("OPEN_PLATFORM_CLIENT_SECRET", "")
+        processes.append(subprocess.Popen([service, solr_url, "--port", str(args.service_port),
+                                           "--workers", str(args.workers)] + shlex.split(args.service_args), env=env))
+        wait_until_ready(f"http://localhost:{args.service_port}/config")
+        yield f"http://localhost:{args.service_port}/search"
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+
+def format_summary(summary):
+    lines = [f"requests: {summary['requests']}  ok: {summary['ok']}  errors: {summary['errors']}  statuses: {summary['statuses']}",
+             f"offered rate: {summary['offered_rate']:.1f}/s  throughput: {summary['throughput']:.1f}/s  elapsed: {summary['elapsed']:.2f}s"]
+    latency = summary["latency"]
+    if latency["mean"] is not None:
+        lines.append("latency (ms): " + "  ".join(f"{name}: {value * 1000:.1f}" for name, value in latency.items()))
+    return "\n".join(lines)
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(description="Replays search requests against the service at a fixed arrival rate")
+    parser.add_argument("requests_file", metavar="requests-file",
+        help="file with a json search request on each line, e.g. benchmark-test/request-examples/simple-search-requests-1000.json")
+    parser.add_argument("-u", "--url", default="http://localhost:5000/search", help="search url of the service")
+    parser.add_argument("-r", "--rate", type=float, default=100, help="arrival rate in requests per second")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="duration of the run in seconds")
+    parser.add_argument("-m", "--method", choices=["post", "get"], default="post")
+    parser.add_argument("--poisson", action="store_true", help="poisson arrivals instead of evenly spaced")
+    parser.add_argument("--timeout", type=float, default=10.0, help="request timeout in seconds")
+    parser.add_argument("--max-connections", dest="max_connections", type=int, default=1000)
+    parser.add_argument("--seed", type=int, help="seed of the poisson arrivals")
+    parser.add_argument("-o", "--output", help="file to write the results to as json")
+    local = parser.add_argument_group("local service", "start the service against a fake solr and load test it")
+    local.add_argument("--local", action="store_true", help="start a fake solr and the service, and ignore --url")
+    local.add_argument("--solr-latency", dest="solr_latency", type=float, default=0.01, help="median latency of the fake solr in seconds")
+    local.add_argument("--solr-jitter", dest="solr_jitter", type=float, default=0.0, help="sigma of the lognormal fake solr latency")
+    local.add_argument("--workers", type=int, default=1, help="number of service worker processes")
+    local.add_argument("--service-args", dest="service_args", default="", help="additional arguments for simple-search-service")
+    local.add_argument("--service-port", dest="service_port", type=int, default=5055)
+    local.add_argument("--fake-solr-port", dest="fake_solr_port", type=int, default=8985)
+    return parser.parse_args()
+
+
+def main():
+    args = setup_args()
+    logging.basicConfig(format="%(asctime)s : %(levelname)s : %(message)s", level=logging.INFO)
+    requests = read_requests(args.requests_file)
+    num_requests = max(1, int(args.rate * args.duration))
+    with contextlib.ExitStack() as stack:
+        url = stack.enter_context(local_service(args)) if args.local else args.url
+        logger.info(f"Sending {num_requests} requests to {url} at {args.rate}/s")
+        summary = asyncio.run(run_load(url, requests, args.rate, num_requests, args.method, args.timeout,
+                                       args.poisson, args.max_connections, args.seed))
+    print(format_summary(summary))
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        config["url"] = url
+        with open(args.output, "w") as fp:
+            json.dump({"created": datetime.datetime.now().isoformat(), "config": config, "results": summary}, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.metrics` -- latency histograms and counters
+
+=======
+metrics
+=======
+
+Minimal metric types rendered in the prometheus text exposition format.
+Metrics are registered in the module level REGISTRY when created.
+
+Each worker process keeps its own metrics. When the service runs with
+several workers, a :class:`MultiProcessCollector` in each worker writes its
+metrics to a directory shared by the workers, and the worker answering a
+scrape reports the metrics of all of them: counters and histograms summed
+over the workers, including workers which have exited, so they never go
+backwards, and gauges of the live workers with a worker label.
+
+"""
+import bisect
+import glob
+import json
+import math
+import os
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        """ Returns all registered metrics in the prometheus text format """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """ Returns the values of all registered metrics as json serializable dicts by name """
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    content = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + content + "}"
+
+
+def _snapshot_labels(key):
+    # Label values are rendered as strings, so they are stored as strings
+    return [[name, str(value)] for name, value in key]
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter():
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames),
+                "values": [[_snapshot_labels(key), value] for key, value in self.values.items()]}
+
+    def merge(self, values, extra_labels=()):
+        """ Adds the values of a snapshot to this metric """
+        for labels, value in values:
+            key = tuple(map(tuple, labels)) + tuple(extra_labels)
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram():
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> [bucket counts, sum]
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, **labels):
+        entry = self.values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames), "buckets": list(self.buckets[:-1]),
+                "values": [[_snapshot_labels(key), entry] for key, entry in self.values.items()]}
+
+    def merge(self, values):
+        """ Adds the values of a snapshot to this metric """
+        for labels, (counts, total) in values:
+            key = tuple(map(tuple, labels))
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0]
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+
+    def render(self):
+        lines = []
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class StageTimer():
+    """
+    Records the time spent in consecutive stages of a request in a
+    histogram with a stage label. Each call to lap observes the time since
+    the previous lap, or since the timer was created. The time of each stage
+    is also kept in laps
+    """
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.laps = {}
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.histogram.observe(elapsed, stage=stage, **self.labels)
+        self.laps[stage] = self.laps.get(stage, 0) + elapsed
+        self.last = now
+        return elapsed
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+class MultiProcessCollector():
+    """
+    Shares the metrics of a worker process with the other workers through
+    a directory, in a json file named after the process id
+    """
+    def __init__(self, directory, worker, registry=REGISTRY):
+        """
+        :param directory:
+            directory shared by the workers. Empty it before starting the workers
+        :param worker:
+            stable id of the worker, such as tornado.process.task_id(). Used as the worker label of gauges
+        """
+        self.directory = directory
+        self.worker = worker
+        self.registry = registry
+        self.path = os.path.join(directory, f"{os.getpid()}.json")
+
+    def dump(self):
+        """ Writes the current metrics of this process to the directory """
+        data = {"pid": os.getpid(), "worker": self.worker, "metrics": self.registry.snapshot()}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as fp:
+            json.dump(data, fp)
+        # Replaced atomically, so readers never see a partly written file
+        os.replace(temp_path, self.path)
+
+    def render(self):
+        """ Returns the metrics of all the workers in the prometheus text format """
+        self.dump()
+        merged = Registry()
+        metrics = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json"))):
+            try:
+                with open(path) as fp:
+                    data = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(data["pid"])
+            for name, snapshot in data["metrics"].items():
+                metric = metrics.get(name)
+                if metric is None:
+                    metric = metrics[name] = _metric_from_snapshot(name, snapshot, merged)
+                if snapshot["type"] == "gauge":
+                    # The value of an exited worker is no longer current
+                    if alive:
+                        metric.merge(snapshot["values"], [("worker", str(data["worker"]))])
+                else:
+                    metric.merge(snapshot["values"])
+        return merged.render()
+
+
+def _metric_from_snapshot(name, snapshot, registry):
+    if snapshot["type"] == "histogram":
+        return Histogram(name, snapshot["help"], snapshot["labelnames"], snapshot["buckets"], registry=registry)
+    if snapshot["type"] == "gauge":
+        return Gauge(name, snapshot["help"], snapshot["labelnames"] + ["worker"], registry=registry)
+    return Counter(name, snapshot["help"], snapshot["labelnames"], registry=registry)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.payload` -- precomputed static responses
+
+=======
+payload
+=======
+
+Responses which do not change while the service runs (pages, config and
+static assets) are built once at startup together with their strong
+ETag and gzip compressed body, and served without file I/O or template
+rendering.
+
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+import tornado.web
+from dbc_pyutils import BaseHandler
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """
+    Returns whether the value of an Accept-Encoding header accepts encoding.
+    Codings with q=0, such as "gzip;q=0", are not accepted. A coding which is
+    not listed is accepted if * is
+    """
+    qvalues = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        qvalue = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[name.strip().lower()] = qvalue
+    return qvalues.get(encoding, qvalues.get("*", 0.0)) > 0
+
+
+class Payload():
+    """ Response body with precomputed ETags and gzip variant """
+    def __init__(self, body, content_type):
+        """
+        :param body:
+            response body as bytes or str
+        :param content_type:
+            value of the Content-Type header
+        """
+        self.body = body.encode("utf8") if isinstance(body, str) else body
+        self.content_type = content_type
+        digest = hashlib.sha1(self.body).hexdigest()
+        # The gzip variant is another representation and needs its own strong ETag
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+
+    @classmethod
+    def from_file(cls, path, content_type=None):
+        if content_type is None:
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, "rb") as fp:
+            return cls(fp.read(), content_type)
+
+    @classmethod
+    def from_directory(cls, path):
+        """ Returns a dict mapping the relative path of each file below path to its payload """
+        payloads = {}
+        for root, _, filenames in os.walk(path):
+            for filename in filenames:
+                full_path = os.path.join(root, filename)
+                payloads[os.path.relpath(full_path, path).replace(os.sep, "/")] = cls.from_file(full_path)
+        return payloads
+
+
+class PayloadHandler(BaseHandler):
+    """ Serves a payload with ETag/304 handling and gzip when accepted """
+    def initialize(self, payload):
+        self.payload = payload
+
+    def get(self):
+        self.write_payload(self.payload)
+
+    def head(self):
+        self.write_payload(self.payload, include_body=False)
+
+    def accepts_gzip(self):
+        return accepts_encoding(self.request.headers.get("Accept-Encoding", ""), "gzip")
+
+    def compute_etag(self):
+        return self.payload.gzip_etag if self.accepts_gzip() else self.payload.etag
+
+    def write_payload(self, payload, include_body=True):
+        self.payload = payload
+        self.set_header("Vary", "Accept-Encoding")
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.set_header("Content-Type", payload.content_type)
+        body = payload.body
+        if self.accepts_gzip():
+            self.set_header("Content-Encoding", "gzip")
+            body = payload.gzip_body
+        if include_body:
+            self.write(body)
+        else:
+            self.set_header("Content-Length", len(body))
+
+
+class StaticPayloadHandler(PayloadHandler):
+    """ Serves the payloads of a directory, see Payload.from_directory """
+    def initialize(self, payloads):
+        self.payloads = payloads
+
+    def get(self, path):
+        self.write_payload(self.lookup(path))
+
+    def head(self, path):
+        self.write_payload(self.lookup(path), include_body=False)
+
+    def lookup(self, path):
+        if path not in self.payloads:
+            raise tornado.web.HTTPError(404)
+        return self.payloads[path]
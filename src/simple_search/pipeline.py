@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.pipeline` -- bounded producer/consumer pipelines
+
+========
+pipeline
+========
+
+Runs a consumer on the items of an iterable from worker threads while the
+iterable is still producing them. A bounded queue between the two gives
+backpressure: a producer running ahead of the consumers blocks instead of
+buffering, so memory stays constant, and the wall time approaches the time
+of the slower stage rather than the sum of both.
+
+"""
+from collections import namedtuple
+import queue
+import threading
+import time
+
+# Number of items consumed, and the seconds the producer spent waiting for
+# the consumers and the consumers (summed) spent waiting for the producer
+PipelineStats = namedtuple('PipelineStats', 'items producer_wait consumer_wait')
+
+# Tells a worker there are no more items
+_DONE = object()
+
+
+def run_pipeline(items, consume, num_workers=1, max_pending=None):
+    """
+    Calls consume on each item of items from num_workers threads, while
+    items is iterated in the calling thread. Stops at the first error of a
+    consumer and raises it once the workers have finished. Returns PipelineStats
+
+    :param max_pending:
+        max number of produced items waiting for a worker. Defaults to twice num_workers
+    """
+    pending = queue.Queue(maxsize=max_pending or 2 * num_workers)
+    errors = []
+    lock = threading.Lock()
+    counts = {"items": 0, "consumer_wait": 0.0}
+
+    def work():
+        consumed, waited = 0, 0.0
+        while True:
+            start = time.perf_counter()
+            item = pending.get()
+            waited += time.perf_counter() - start
+            if item is _DONE:
+                break
+            # After an error the remaining items are only drained, so the producer is not blocked
+            if errors:
+                continue
+            try:
+                consume(item)
+                consumed += 1
+            except Exception as e:
+                errors.append(e)
+        with lock:
+            counts["items"] += consumed
+            counts["consumer_wait"] += waited
+
+    workers = [threading.Thread(target=work, name=f"pipeline-{i}", daemon=True) for i in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    producer_wait = 0.0
+    try:
+        for item in items:
+            if errors:
+                break
+            start = time.perf_counter()
+            pending.put(item)
+            producer_wait += time.perf_counter() - start
+    finally:
+        for _ in workers:
+            pending.put(_DONE)
+        for worker in workers:
+            worker.join()
+    if errors:
+        raise errors[0]
+    return PipelineStats(counts["items"], producer_wait, counts["consumer_wait"])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.profiling` -- profiling of requests
+
+=========
+profiling
+=========
+
+Two ways to see where the python time of the service goes:
+
+* A single request can be run under cProfile, and a summary of the
+  functions it spent the most time in returned with the response.
+* A fraction of the requests can be sampled with a lightweight stack
+  sampler. The samples of all of them are combined in the collapsed stack
+  format read by flamegraph.pl, speedscope and similar tools. With several
+  worker processes, :class:`SharedStackSamples` combines the samples of
+  all the workers.
+
+Both profile the whole process while active, so work done for other
+requests in the meantime is included.
+
+"""
+from collections import Counter
+import cProfile
+import glob
+import json
+import os
+import pstats
+import signal
+
+
+class ProfilerBusy(Exception):
+    """ Raised when a profile is requested while another is running """
+
+
+class RequestProfiler():
+    """ Runs one request at a time under cProfile """
+    def __init__(self):
+        self.profile = None
+
+    def start(self):
+        if self.profile is not None:
+            raise ProfilerBusy("another request is being profiled")
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self, limit=25):
+        """ Stops profiling and returns the summary of the profile """
+        profile, self.profile = self.profile, None
+        profile.disable()
+        return profile_summary(profile, limit)
+
+
+def profile_summary(profile, limit=25):
+    """ Returns the limit functions of profile with the highest cumulative time """
+    stats = pstats.Stats(profile)
+    entries = []
+    for (filename, line, name), (primitive_calls, calls, total, cumulative, _) in stats.stats.items():
+        entries.append({"function": f"{name} ({filename}:{line})",
+                        "calls": calls,
+                        "total": round(total, 6),
+                        "cumulative": round(cumulative, 6)})
+    entries.sort(key=lambda e: e["cumulative"], reverse=True)
+    return {"total": round(stats.total_tt, 6), "functions": entries[:limit]}
+
+
+class StackSampler():
+    """
+    Samples the python stack at a fixed interval of cpu time while started,
+    and counts the collapsed stacks. Starts and stops nest, so the sampler
+    runs while any sampled request is in flight. Must be used from the main
+    thread, as it relies on SIGPROF
+    """
+    def __init__(self, interval=0.005):
+        """
+        :param interval:
+            cpu time in seconds between samples
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._active = 0
+
+    def start(self):
+        if self._active == 0:
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._active += 1
+
+    def stop(self):
+        self._active -= 1
+        if self._active == 0:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """ Returns the samples in the collapsed stack format, one 'frame;frame;... count' line per stack """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def clear(self):
+        self.stacks.clear()
+        self.samples = 0
+
+
+class SharedStackSamples():
+    """
+    Shares the stack samples of a worker process with the other workers
+    through a directory, in a file named after the process id, so the worker
+    answering a request can return the samples of all of them. Has the
+    collapsed and clear methods of StackSampler
+    """
+    # Samples of each worker when the samples were last cleared, which are left out
+    BASELINE = "stacks-baseline"
+
+    def __init__(self, directory, sampler):
+        """
+        :param directory:
+            directory shared by the workers. Empty it before starting the workers
+        :param sampler:
+            StackSampler of this worker
+        """
+        self.directory = directory
+        self.sampler = sampler
+        self.path = os.path.join(directory, f"{os.getpid()}.stacks")
+
+    def dump(self):
+        """ Writes the samples of this process to the directory """
+        _write_json(self.path, self.sampler.stacks)
+
+    def worker_stacks(self):
+        """ Returns the samples of each worker by file name """
+        self.dump()
+        stacks = {}
+        for path in glob.glob(os.path.join(self.directory, "*.stacks")):
+            try:
+                with open(path) as fp:
+                    stacks[os.path.basename(path)] = Counter(json.load(fp))
+            except (OSError, ValueError):
+                continue
+        return stacks
+
+    def combined(self):
+        """ Returns the samples of all the workers taken since the samples were last cleared """
+        try:
+            with open(os.path.join(self.directory, self.BASELINE)) as fp:
+                baseline = json.load(fp)
+        except (OSError, ValueError):
+            baseline = {}
+        combined = Counter()
+        for name, stacks in self.worker_stacks().items():
+            stacks.subtract(baseline.get(name, {}))
+            # Unary + keeps the positive counts only
+            combined.update(+stacks)
+        return combined
+
+    def collapsed(self):
+        """ Returns the samples of all the workers in the collapsed stack format """
+        return "".join(f"{stack} {count}\n" for stack, count in self.combined().most_common())
+
+    def clear(self):
+        """ Leaves out the samples taken so far by any worker """
+        _write_json(os.path.join(self.directory, self.BASELINE), self.worker_stacks())
+
+
+def _write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as fp:
+        json.dump(data, fp)
+    # Replaced atomically, so readers never see a partly written file
+    os.replace(temp_path, path)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.querylog` -- structured log of searches
+
+========
+querylog
+========
+
+Searches are logged as json records, one per line. A sample of all searches
+goes to the query log, and searches slower than a threshold always go to a
+separate slow query log together with the solr parameters they were sent
+with, so they can be replayed against solr.
+
+Records are handed to a background thread, which serializes and writes them
+in batches, so logging costs the request little more than a queue put. When
+the writer falls behind, records are dropped rather than buffered without
+bound. Each batch is written with a single append, so several worker
+processes can share the log files.
+
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+
+from simple_search.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_RECORDS = Counter("simple_search_query_log_records_total",
+                            "Records written to the query logs", ["log"])
+QUERY_LOG_DROPPED = Counter("simple_search_query_log_dropped_total",
+                            "Records dropped because the query log writer fell behind")
+
+# Marks the end of the records for the writer thread
+_STOP = object()
+
+
+class QueryLog():
+    """ Sampled query log and slow query log, written by a background thread """
+    def __init__(self, path=None, sample_rate=1.0, slow_path=None, slow_threshold=1.0, max_pending=10000, batch_size=1000):
+        """
+        :param path:
+            file the sampled searches are appended to. None disables the query log
+        :param sample_rate:
+            fraction of the searches written to the query log
+        :param slow_path:
+            file the slow searches are appended to. None disables the slow query log
+        :param slow_threshold:
+            latency in seconds from which a search is slow
+        :param max_pending:
+            max number of records waiting for the writer. Records beyond it are dropped
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_path = slow_path
+        self.slow_threshold = slow_threshold
+        self.batch_size = batch_size
+        self.random = random.random
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def start(self):
+        """ Starts the writer thread. Call after forking worker processes """
+        self._thread = threading.Thread(target=self._write_records, name="query-log", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """ Writes the pending records and stops the writer thread """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def log(self, record, solr_params=None):
+        """
+        Logs a search, if it is sampled or slow
+
+        :param record:
+            json serializable dict describing the search. Must hold its latency in seconds
+        :param solr_params:
+            parameters the search was sent to solr with, added to slow query records
+        """
+        if self.slow_path is not None and record["latency"] >= self.slow_threshold:
+            self._put((self.slow_path, dict(record, solr_params=solr_params)))
+        if self.path is not None and (self.sample_rate >= 1 or self.random() < self.sample_rate):
+            self._put((self.path, record))
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            QUERY_LOG_DROPPED.inc()
+
+    def _write_records(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = {}
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                    continue
+                path, record = item
+                lines.setdefault(path, []).append(json.dumps(record, ensure_ascii=False, default=str))
+            for path, records in lines.items():
+                try:
+                    write_lines(path, records)
+                    QUERY_LOG_RECORDS.inc(len(records), log="slow" if path == self.slow_path else "sampled")
+                except OSError as e:
+                    logger.error(f"Could not write {len(records)} records to {path}: {e}")
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "dropped": self.dropped}
+
+
+def write_lines(path, lines):
+    """ Appends lines to path with a single write, so appends from several processes do not interleave """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, ("\n".join(lines) + "\n").encode("utf8"))
+    finally:
+        os.close(fd)
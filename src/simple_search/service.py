@@ -1,25 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
+import gc
 import json
 import logging
 import os
+import random
+import tempfile
+import time
 
 import tornado
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
+import tornado.template
 from tornado.ioloop import IOLoop
+from tornado.ioloop import PeriodicCallback
 
 from pkg_resources import resource_filename
 
 from dbc_pyutils import BaseHandler
 from dbc_pyutils import StatusHandler
 from dbc_pyutils import build_info
-from dbc_pyutils import Statistics
 from dbc_pyutils import CoverUrls
 import rrflow.utils
 
-from .solr.search import Searcher
+from .admission import DeadlineExceeded, Overloaded
+from .covers import CoverLookup
+from .metrics import Histogram, MultiProcessCollector, REGISTRY
+from .payload import Payload, PayloadHandler, StaticPayloadHandler, accepts_encoding
+from .profiling import ProfilerBusy, RequestProfiler, SharedStackSamples, StackSampler
+from .querylog import QueryLog
+from .solr.search import InvalidSearchParameter, Searcher, SEARCH_STAGE_SECONDS
 
-STATS = {"search": Statistics(name="search")}
+REQUEST_SECONDS = Histogram("simple_search_request_seconds", "Total time of handled requests", ["handler"])
 
 logger = rrflow.utils.setup_logging()
 
@@ -27,45 +41,137 @@ AUTHKEYMAP = json.loads(os.environ["AUTHKEYMAP"])
 
 def setup_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("solr_url", metavar="solr-url")
+    parser.add_argument("solr_url", metavar="solr-url", nargs="+",
+        help="url of the solr collection. Several urls of replicas of the collection can be given")
     parser.add_argument("--smart-search", dest="smart_search", help="file with smartsearch model content")
     parser.add_argument("--curated-search", dest="curated_search", help="file with curated search content")
-    parser.add_argument("-p", "--port", default=5000)
+    parser.add_argument("-p", "--port", type=int, default=5000)
+    parser.add_argument("-w", "--workers", type=int, default=1,
+        help="number of worker processes sharing the listening socket. 0 starts one per cpu")
+    parser.add_argument("--metrics-dir", dest="metrics_dir",
+        help="directory the workers share their metrics, stack samples and forced reloads through, emptied at startup. Defaults to a temporary directory")
+    parser.add_argument("--metrics-interval", dest="metrics_interval", type=float, default=5,
+        help="interval in seconds between each worker writing its metrics and stack samples to --metrics-dir")
+    parser.add_argument("--solr-timeout", dest="solr_timeout", type=float, default=10.0,
+        help="timeout in seconds for each solr request")
+    parser.add_argument("--solr-max-connections", dest="solr_max_connections", type=int, default=50,
+        help="max number of concurrent connections to solr")
+    parser.add_argument("--solr-hedge", dest="solr_hedge", action="store_true",
+        help="send searches not answered within the p95 latency of their replica to a second replica as well")
+    parser.add_argument("--solr-health-interval", dest="solr_health_interval", type=float, default=5,
+        help="interval in seconds between health checks of the solr replicas")
+    parser.add_argument("--solr-max-concurrency", dest="solr_max_concurrency", type=int,
+        help="max number of concurrent solr searches. Defaults to --solr-max-connections")
+    parser.add_argument("--solr-queue-size", dest="solr_queue_size", type=int, default=100,
+        help="max number of searches waiting for solr. Searches beyond it are answered with 503")
+    parser.add_argument("--solr-queue-timeout", dest="solr_queue_timeout", type=float, default=0.1,
+        help="max time in seconds a search waits for solr before it is answered with 503")
+    parser.add_argument("--deadline", type=float, default=2.0,
+        help="time in seconds a search is given, sent to solr as timeAllowed. 0 disables deadlines")
+    parser.add_argument("--cache-size", dest="cache_size", type=int, default=10000,
+        help="max number of cached search results. 0 disables the cache")
+    parser.add_argument("--cache-ttl", dest="cache_ttl", type=float, default=300,
+        help="time to live in seconds for cached search results")
+    parser.add_argument("--index-version-interval", dest="index_version_interval", type=float, default=10,
+        help="interval in seconds between checks for a new solr index version")
+    parser.add_argument("--head-snapshot", dest="head_snapshot",
+        help="file with precomputed head query results, see build-head-snapshot")
+    parser.add_argument("--batch-concurrency", dest="batch_concurrency", type=int, default=8,
+        help="max number of concurrent solr searches for each batch request")
+    parser.add_argument("--cover-cache-size", dest="cover_cache_size", type=int, default=100000,
+        help="max number of pids in the cover url cache")
+    parser.add_argument("--cover-cache-ttl", dest="cover_cache_ttl", type=float, default=86400,
+        help="time to live in seconds for cached cover urls")
+    parser.add_argument("--profile-sample-rate", dest="profile_sample_rate", type=float, default=0,
+        help="fraction of requests sampled for the flame graph dump on /admin/profile. 0 disables sampling")
+    parser.add_argument("--profile-interval", dest="profile_interval", type=float, default=0.005,
+        help="cpu time in seconds between stack samples of sampled requests")
+    parser.add_argument("--query-log", dest="query_log",
+        help="file sampled searches are logged to as json lines")
+    parser.add_argument("--query-log-sample-rate", dest="query_log_sample_rate", type=float, default=0.01,
+        help="fraction of the searches written to the query log")
+    parser.add_argument("--slow-query-log", dest="slow_query_log",
+        help="file searches slower than --slow-query-threshold are logged to as json lines, with their solr parameters")
+    parser.add_argument("--slow-query-threshold", dest="slow_query_threshold", type=float, default=1.0,
+        help="latency in seconds from which a search is logged to the slow query log")
+    parser.add_argument("--data-watch-interval", dest="data_watch_interval", type=float, default=30,
+        help="interval in seconds between checks for modified smartsearch and curated search files. 0 disables reloading")
     return parser.parse_args()
 
 
 class CoverHandler(BaseHandler):
 
-    def initialize(self):
-        client_id = os.environ['OPEN_PLATFORM_CLIENT_ID']
-        client_secret = os.environ['OPEN_PLATFORM_CLIENT_SECRET']
-        self.cover_func = CoverUrls(client_id, client_secret)
+    def initialize(self, cover_lookup):
+        self.cover_lookup = cover_lookup
 
-    def get(self, pid):
-        cover_info = self.cover_func([pid], fields=['coverUrlFull'])
-        cover = cover_info.get(pid, {}).get('coverUrlFull', [''])[0]
-        result = {'url': cover} if cover else {}
+    async def get(self, pid):
+        covers = await self.cover_lookup.urls([pid])
+        result = {'url': covers[pid]} if pid in covers else {}
         self.write(result)
 
 
-class ConfigHandler(BaseHandler):
+class CoversHandler(BaseHandler):
+    MAX_PIDS = 500
 
-    def get(self):
-        config_filename = 'data/cfg/search_results_tester_config.json'
-        config_path = resource_filename('simple_search', config_filename)
-        queries = []
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-            queries = [query['q'] for query in config['queries']]
-        self.write(json.dumps({'queries': queries}))
+    def initialize(self, cover_lookup):
+        self.cover_lookup = cover_lookup
 
+    async def get(self):
+        await self.write_covers(self.get_arguments('pid'))
 
-class SearchHandler(BaseHandler):
-    def initialize(self, searcher):
+    async def post(self):
+        body = json.loads(self.request.body.decode("utf8"))
+        await self.write_covers(body.get('pids', []))
+
+    async def write_covers(self, pids):
+        if not isinstance(pids, list) or len(pids) > self.MAX_PIDS:
+            self.set_status(400)
+            return self.write({'error': f'pids must be a list of at most {self.MAX_PIDS} pids'})
+        self.write({'covers': await self.cover_lookup.urls(pids)})
+
+
+class SearchStatusHandler(StatusHandler):
+    """ Status handler extended with the runtime counters of the searcher """
+    def initialize(self, searcher, cover_lookup, **kwargs):
+        super().initialize(**kwargs)
         self.searcher = searcher
+        self.cover_lookup = cover_lookup
 
-    def post(self):
-        body = json.loads(self.request.body.decode("utf8"))
+    def write(self, chunk):
+        if isinstance(chunk, dict):
+            chunk = dict(chunk, covers=self.cover_lookup.status(), **self.searcher.status())
+        super().write(chunk)
+
+
+class SearchBaseHandler(BaseHandler):
+
+    def prepare(self):
+        # A fraction of the requests is sampled for the server wide profile
+        sampler = self.settings.get("stack_sampler")
+        self.sampled = sampler is not None and random.random() < self.settings["profile_sample_rate"]
+        if self.sampled:
+            sampler.start()
+
+    def on_finish(self):
+        if self.sampled:
+            self.settings["stack_sampler"].stop()
+        REQUEST_SECONDS.observe(self.request.request_time(), handler=type(self).__name__)
+
+    def check_admin_access(self, access_token):
+        """ Returns whether access_token is valid. Otherwise answers the request with 401 """
+        if access_token in AUTHKEYMAP.values():
+            return True
+        self.set_status(401)
+        self.write({"error": "a valid access-token is required"})
+        return False
+
+    def write_result(self, result):
+        """ Writes result, recording the time spent serializing it """
+        start = time.perf_counter()
+        self.write(result)
+        SEARCH_STAGE_SECONDS.observe(time.perf_counter() - start, stage="serialize")
+
+    def check_access_token(self, body):
         if "access-token" not in body:
             #self.set_status(401)
             #return self.write("No access-token provided")
@@ -76,53 +182,299 @@ class SearchHandler(BaseHandler):
                 #self.set_status(401)
                 #return self.write(f"Unauthorized access token {access_token}")
                 logger.info(f"Unauthorized access token {access_token}")
+
+
+class SearchHandler(SearchBaseHandler):
+    def initialize(self, searcher, deadline, profiler, stream_page_size=500):
+        self.searcher = searcher
+        self.deadline = deadline
+        self.profiler = profiler
+        self.stream_page_size = stream_page_size
+
+    async def post(self):
+        body = json.loads(self.request.body.decode("utf8"))
+        self.check_access_token(body)
         query = body["q"]
         debug = body.get("debug", False)
         start = body.get("start", 0)
         rows = body.get("rows", 10)
         options = body.get("options", {})
-        result = {"result": [doc for doc in self.searcher.search(query,
-            debug, options=options, rows=rows, start=start)]}
-        self.write(result)
+        cursor = body.get("cursor")
+        fields = body.get("fields")
+        stream = body.get("stream", False)
+        profile = body.get("profile", False)
+        explain = body.get("explain", False)
+        if profile and not self.check_admin_access(body.get("access-token")):
+            return
+        await self.respond(query, debug, options, rows, start, cursor, fields, stream, profile, explain)
 
-    def get(self):
+    async def get(self):
         query = self.get_argument('q')
         debug = self.get_argument('debug', 'False')
         debug = True if debug.lower() in {'true', '1'} else False
         rows = int(self.get_argument("rows", "10"))
-        result = {"result": [doc for doc in self.searcher.search(query, debug, rows=rows)]}
-        self.write(result)
+        cursor = self.get_argument("cursor", None)
+        fields = self.get_argument("fields", None)
+        fields = fields.split(",") if fields else None
+        stream = self.get_argument("stream", "False").lower() in {"true", "1"}
+        profile = self.get_argument("profile", "False").lower() in {"true", "1"}
+        explain = self.get_argument("explain", "False").lower() in {"true", "1"}
+        if profile and not self.check_admin_access(self.get_argument("access-token", None)):
+            return
+        await self.respond(query, debug, {}, rows, 0, cursor, fields, stream, profile, explain)
+
+    async def respond(self, query, debug, options, rows, start, cursor, fields, stream, profile=False, explain=False):
+        # Streamed results are not profiled
+        profiling = profile and not stream
+        if profiling:
+            try:
+                self.profiler.start()
+            except ProfilerBusy as e:
+                self.set_status(409)
+                return self.write({"error": str(e)})
+        try:
+            if stream:
+                return await self.write_stream(query, debug, options, rows, fields)
+            page = await self.searcher.search_page(query, debug, options=options, rows=rows, start=start,
+                                                   cursor=cursor, fields=fields, deadline=self.request_deadline(), explain=explain)
+            result = {"result": page.result}
+            if cursor is not None:
+                result["next"] = page.next_cursor
+            if page.partial:
+                result["partial"] = True
+            if page.timing is not None:
+                result["timing"] = page.timing
+            if profiling:
+                profiling = False
+                result["profile"] = self.profiler.stop()
+            self.write_result(result)
+        except InvalidSearchParameter as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+        except Overloaded as e:
+            self.set_status(503)
+            self.set_header("Retry-After", "1")
+            self.write({"error": str(e)})
+        except DeadlineExceeded as e:
+            self.set_status(504)
+            self.write({"error": str(e)})
+        finally:
+            if profiling:
+                self.profiler.stop()
+
+    def request_deadline(self):
+        """ Returns the time.monotonic() time the search must be answered by, counted from the arrival of the request """
+        if not self.deadline:
+            return None
+        return time.monotonic() + self.deadline - self.request.request_time()
 
+    async def write_stream(self, query, debug, options, rows, fields):
+        """ Writes the results as newline delimited json, flushing each page fetched from solr """
+        self.set_header("Content-Type", "application/x-ndjson")
+        async for docs in self.searcher.search_stream(query, debug, options=options, rows=rows, fields=fields,
+                                                       page_size=self.stream_page_size):
+            self.write("".join(json.dumps(doc) + "\n" for doc in docs))
+            await self.flush()
+
+
+class BatchSearchHandler(SearchBaseHandler):
+    MAX_BATCH_SIZE = 1000
+
+    def initialize(self, searcher, max_concurrency):
+        self.searcher = searcher
+        self.max_concurrency = max_concurrency
+
+    async def post(self):
+        body = json.loads(self.request.body.decode("utf8"))
+        self.check_access_token(body)
+        requests = body.get("queries")
+        if not isinstance(requests, list) or not all(isinstance(r, dict) for r in requests):
+            self.set_status(400)
+            return self.write({"error": "queries must be a list of search objects"})
+        if len(requests) > self.MAX_BATCH_SIZE:
+            self.set_status(400)
+            return self.write({"error": f"at most {self.MAX_BATCH_SIZE} queries are allowed in a batch"})
+        results = await self.searcher.search_batch(requests, self.max_concurrency)
+        self.write_result({"results": results})
+
+
+class SuggestHandler(SearchBaseHandler):
+    MAX_SUGGESTIONS = 10
+
+    def initialize(self, searcher):
+        self.searcher = searcher
 
-class DefaultHandler(BaseHandler):
     def get(self):
-        with open(resource_filename("simple_search",
-                                    "data/cfg/search_results_tester_config.json")) as fp:
-            config = json.load(fp)
-            queries = [query["q"] for query in config["queries"]]
-        path = resource_filename("simple_search", "data/html/index.html")
-        self.render(path, queries=queries)
+        prefix = self.get_argument("prefix")
+        try:
+            k = min(int(self.get_argument("k", "10")), self.MAX_SUGGESTIONS)
+        except ValueError:
+            self.set_status(400)
+            return self.write({"error": "k must be an integer"})
+        self.write({"suggestions": self.searcher.suggest(prefix, k)})
+
 
+class ReloadHandler(SearchBaseHandler):
+    """ Reloads the smartsearch and curated search data. Requires a valid access token """
+    def initialize(self, searcher, propagated=True):
+        """
+        :param propagated:
+            whether the reloads reach all the worker processes. Reloads are rejected otherwise
+        """
+        self.searcher = searcher
+        self.propagated = propagated
 
-class APIHandler(BaseHandler):
+    async def post(self):
+        body = json.loads(self.request.body.decode("utf8")) if self.request.body else {}
+        if not self.check_admin_access(body.get("access-token")):
+            return
+        if not self.propagated:
+            self.set_status(409)
+            return self.write({"error": "with several workers, reloads require --data-watch-interval"})
+        if body.get("force", False):
+            reloaded = await self.searcher.force_reload()
+        else:
+            reloaded = await self.searcher.reload_data()
+        self.write({"reloaded": reloaded, "data_versions": self.searcher.data_versions})
+
+
+class ProfileHandler(SearchBaseHandler):
+    """
+    Returns the stack samples of the sampled requests in the collapsed stack
+    format, for flamegraph.pl or speedscope. Requires a valid access token
+    """
     def get(self):
-        path = resource_filename('simple_search', 'data/html/help.html')
-        self.render(path)
+        if not self.check_admin_access(self.get_argument("access-token", None)):
+            return
+        if self.settings.get("stack_sampler") is None:
+            self.set_status(404)
+            return self.write({"error": "request sampling is disabled, see --profile-sample-rate"})
+        # The samples of all the workers when there are several, see SharedStackSamples
+        samples = self.settings.get("shared_stack_samples") or self.settings["stack_sampler"]
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.write(samples.collapsed())
+        if self.get_argument("reset", "False").lower() in {"true", "1"}:
+            samples.clear()
+
+
+class GZipContentEncoding(tornado.web.GZipContentEncoding):
+    """ Gzip negotiation also covering streamed ndjson search results, and honouring q-values such as gzip;q=0 """
+    CONTENT_TYPES = tornado.web.GZipContentEncoding.CONTENT_TYPES | {"application/x-ndjson"}
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._gzipping = accepts_encoding(request.headers.get("Accept-Encoding", ""), "gzip")
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        vary = headers.get("Vary")
+        status_code, headers, chunk = super().transform_first_chunk(status_code, headers, chunk, finishing)
+        # Payload handlers already vary on Accept-Encoding
+        if vary is not None and "accept-encoding" in vary.lower():
+            headers["Vary"] = vary
+        return status_code, headers, chunk
+
+
+class MetricsHandler(BaseHandler):
+    """ Renders the metrics of this process, or of all the workers when collector is given """
+    def initialize(self, collector=None):
+        self.collector = collector
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(self.collector.render() if self.collector is not None else REGISTRY.render())
+
+
+def load_config_queries():
+    with open(resource_filename("simple_search",
+                                "data/cfg/search_results_tester_config.json")) as fp:
+        config = json.load(fp)
+        return [query["q"] for query in config["queries"]]
+
+
+def build_page_payloads():
+    """ Renders the gui, help and config responses once, as they never change while running """
+    queries = load_config_queries()
+    html_path = resource_filename("simple_search", "data/html")
+    loader = tornado.template.Loader(html_path)
+    html_content_type = "text/html; charset=UTF-8"
+    return {"index": Payload(loader.load("index.html").generate(queries=queries), html_content_type),
+            "help": Payload(loader.load("help.html").generate(), html_content_type),
+            "config": Payload(json.dumps({"queries": queries}), "application/json; charset=UTF-8")}
+
+
+def prepare_metrics_dir(metrics_dir):
+    """ Returns the directory the workers share their metrics through, removing the files of earlier runs """
+    if metrics_dir is None:
+        return tempfile.mkdtemp(prefix="simple-search-metrics-")
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith((".json", ".stacks", ".tmp")) or name in {"reloads", SharedStackSamples.BASELINE}:
+            os.remove(os.path.join(metrics_dir, name))
+    return metrics_dir
 
 
 def main():
     args = setup_args()
     info = build_info.get_info("simple_search")
-    searcher = Searcher(args.solr_url, args.smart_search, args.curated_search)
+    query_log = None
+    if args.query_log or args.slow_query_log:
+        query_log = QueryLog(args.query_log, args.query_log_sample_rate, args.slow_query_log, args.slow_query_threshold)
+    searcher = Searcher(args.solr_url, args.smart_search, args.curated_search,
+        solr_timeout=args.solr_timeout, solr_max_clients=args.solr_max_connections,
+        cache_size=args.cache_size, cache_ttl=args.cache_ttl, head_snapshot_file=args.head_snapshot,
+        solr_max_concurrency=args.solr_max_concurrency, solr_queue_size=args.solr_queue_size,
+        solr_queue_timeout=args.solr_queue_timeout, solr_hedge=args.solr_hedge, query_log=query_log)
+    sockets = tornado.netutil.bind_sockets(args.port)
+    stack_sampler = StackSampler(args.profile_interval) if args.profile_sample_rate > 0 else None
+    metrics_collector = None
+    shared_stack_samples = None
+    if args.workers != 1:
+        metrics_dir = prepare_metrics_dir(args.metrics_dir)
+        # The workers poll the file for forced reloads along with the data files
+        searcher.share_reloads(os.path.join(metrics_dir, "reloads"))
+        # The smartsearch and curated search data is loaded before forking. Freezing
+        # it keeps the garbage collector from writing to its pages, so they stay
+        # shared copy-on-write between the workers
+        gc.freeze()
+        tornado.process.fork_processes(args.workers)
+        # A scrape reaches a single worker, which reports the metrics of all of them
+        metrics_collector = MultiProcessCollector(metrics_dir, tornado.process.task_id())
+        metrics_collector.dump()
+        PeriodicCallback(metrics_collector.dump, args.metrics_interval * 1000).start()
+        if stack_sampler is not None:
+            shared_stack_samples = SharedStackSamples(metrics_dir, stack_sampler)
+            PeriodicCallback(shared_stack_samples.dump, args.metrics_interval * 1000).start()
+    cover_lookup = CoverLookup(CoverUrls(os.environ['OPEN_PLATFORM_CLIENT_ID'], os.environ['OPEN_PLATFORM_CLIENT_SECRET']),
+        cache_size=args.cover_cache_size, ttl=args.cover_cache_ttl)
+    if query_log is not None:
+        # Started in each worker, as the writer thread would not survive forking
+        query_log.start()
+    pages = build_page_payloads()
+    static_payloads = Payload.from_directory(os.path.join(resource_filename("simple_search", "data"), "static"))
     tornado_app = tornado.web.Application([
-        ("/", DefaultHandler),
-        ("/config", ConfigHandler),
-        ("/api", APIHandler),
-        ("/cover/(.*)", CoverHandler),
-        ("/search", SearchHandler, {"searcher": searcher}),
-        ("/static/(.*)", tornado.web.StaticFileHandler,
-            {"path": os.path.join(resource_filename("simple_search", "data"), "static")}),
-        ("/status", StatusHandler, {"ab_id": 1, "info": info, "statistics": list(STATS.values())})
-    ])
-    tornado_app.listen(args.port)
+        ("/", PayloadHandler, {"payload": pages["index"]}),
+        ("/config", PayloadHandler, {"payload": pages["config"]}),
+        ("/api", PayloadHandler, {"payload": pages["help"]}),
+        ("/cover/(.*)", CoverHandler, {"cover_lookup": cover_lookup}),
+        ("/covers", CoversHandler, {"cover_lookup": cover_lookup}),
+        ("/search", SearchHandler, {"searcher": searcher, "deadline": args.deadline, "profiler": RequestProfiler()}),
+        ("/search/batch", BatchSearchHandler, {"searcher": searcher, "max_concurrency": args.batch_concurrency}),
+        ("/static/(.*)", StaticPayloadHandler, {"payloads": static_payloads}),
+        ("/suggest", SuggestHandler, {"searcher": searcher}),
+        ("/admin/reload", ReloadHandler, {"searcher": searcher,
+                                          "propagated": args.workers == 1 or args.data_watch_interval > 0}),
+        ("/admin/profile", ProfileHandler),
+        ("/metrics", MetricsHandler, {"collector": metrics_collector}),
+        ("/status", SearchStatusHandler, {"searcher": searcher, "cover_lookup": cover_lookup, "ab_id": 1, "info": info})
+    ], transforms=[GZipContentEncoding],
+        stack_sampler=stack_sampler,
+        shared_stack_samples=shared_stack_samples,
+        profile_sample_rate=args.profile_sample_rate)
+    server = tornado.httpserver.HTTPServer(tornado_app)
+    server.add_sockets(sockets)
+    IOLoop.current().add_callback(searcher.refresh_index_version)
+    PeriodicCallback(searcher.refresh_index_version, args.index_version_interval * 1000).start()
+    PeriodicCallback(searcher.solr.check_health, args.solr_health_interval * 1000).start()
+    if args.data_watch_interval > 0:
+        PeriodicCallback(searcher.watch_data_files, args.data_watch_interval * 1000).start()
     IOLoop.current().start()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.singleflight` -- coalescing of identical in-flight calls
+
+============
+singleflight
+============
+
+Concurrent calls with the same key share the result of a single execution.
+
+"""
+import asyncio
+
+
+class SingleFlight():
+    """
+    Runs at most one call per key at a time. Callers arriving while a
+    call with the same key is in flight wait for, and receive, its result
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    async def do(self, key, coroutine_function, *args, **kwargs):
+        """
+        Awaits coroutine_function(*args, **kwargs), unless a call with
+        the same key is already in flight, in which case its result is awaited
+
+        :param key:
+            hashable key identifying the call
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(coroutine_function(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A cancelled caller must not cancel the call for the other waiters
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {"in_flight": len(self._in_flight),
+                "calls": self.calls,
+                "coalesced": self.coalesced}
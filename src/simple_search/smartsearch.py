@@ -14,14 +14,17 @@ import pandas as pd
 from mobus import lowell_mapping_functions as lmf
 from collections import defaultdict
 from dbc_pyutils import Time
+from simple_search import smartsearch_store
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def parse_file(smartsearch_file='Smartsearch1y.csv', outfile='search2works.json'):
+def parse_file(smartsearch_file='Smartsearch1y.csv', outfile='search2works.json', store_outfile='search2works.bin', top_n=10):
     """
-    Parses datafile and produces datafile to use in smartsearch feature
+    Parses datafile and produces datafile to use in smartsearch feature.
+    The content is written as json to outfile, and in the memory mapped
+    store format, keeping the top_n works of each search, to store_outfile
     """
     df = __read_and_clean_data(smartsearch_file)
     search2pids = {}
@@ -47,6 +50,9 @@ def parse_file(smartsearch_file='Smartsearch1y.csv', outfile='search2works.json'
         logger.info(f'writing content to {outfile}')
         with open(outfile, 'w') as fp:
             json.dump(search2works, fp)
+    if store_outfile:
+        logger.info(f'writing store to {store_outfile}')
+        smartsearch_store.write_store(search2works, store_outfile, top_n)
     return search2works
 
 
@@ -68,6 +74,17 @@ def __pid_mapper(hits, pid2work):
     return hits
 
 
+def load_content(smartsearch_content_path):
+    """
+    Returns the smartsearch content of a json file, or a mapping of a
+    file in the smartsearch_store format
+    """
+    if smartsearch_store.is_store(smartsearch_content_path):
+        return smartsearch_store.SmartSearchStore(smartsearch_content_path)
+    with open(smartsearch_content_path) as fp:
+        return json.load(fp)
+
+
 class SmartSearch:
     """
     Returns result based on clickdata
@@ -80,9 +97,7 @@ class SmartSearch:
     def load(cls, smartsearch_content_path, solr):
         logger.info('Loading smartsearch content')
         with Time('Loaded smartsearch in ', level='info'):
-            with open(smartsearch_content_path) as fp:
-                data = json.load(fp)
-            return cls(data, solr)
+            return cls(load_content(smartsearch_content_path), solr)
 
     def get(self, query, max_n=3):
         data = self.data.get(query, [])[:max_n]
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.smartsearch_store` -- memory mapped smartsearch model
+
+=================
+smartsearch_store
+=================
+
+Compact binary format for the smartsearch query -> works model. The file is
+memory mapped and queried in place, so loading is near-instant and the
+data is shared between processes through the page cache.
+
+Layout (little endian), every section aligned to 8 bytes:
+
+    header          magic, version, number of queries, top_n, number of works
+                    and the offset of each of the sections below
+    query offsets   uint64[queries + 1] into the query blob
+    query blob      utf8 queries, sorted bytewise
+    works           int32[queries * top_n] indices into the work table, -1 padded
+    counts          uint32[queries * top_n] click counts of the works
+    work offsets    uint64[works + 1] into the work blob
+    work blob       utf8 workids
+
+"""
+from array import array
+import argparse
+from collections.abc import Mapping
+import json
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SSWS"
+VERSION = 1
+HEADER = struct.Struct("<4sIIII6Q")
+
+
+def _encode(s):
+    return s.encode("utf8", "surrogatepass")
+
+
+def _decode(b):
+    return b.decode("utf8", "surrogatepass")
+
+
+def _pad(buffer):
+    buffer += b"\0" * (-len(buffer) % 8)
+
+
+def write_store(search2works, path, top_n=10):
+    """
+    Writes smartsearch content to path in the binary store format
+
+    :param search2works:
+        dict mapping queries to lists of [workid, count], sorted by count descending
+    :param top_n:
+        max number of works kept for each query
+    """
+    queries = sorted((_encode(q), hits) for q, hits in search2works.items())
+    query_offsets = array("Q", [0])
+    query_blob = bytearray()
+    works = array("i")
+    counts = array("I")
+    work_index = {}
+    for query, hits in queries:
+        query_blob += query
+        query_offsets.append(len(query_blob))
+        hits = hits[:top_n]
+        for workid, count in hits:
+            works.append(work_index.setdefault(workid, len(work_index)))
+            counts.append(count)
+        works.extend([-1] * (top_n - len(hits)))
+        counts.extend([0] * (top_n - len(hits)))
+    work_offsets = array("Q", [0])
+    work_blob = bytearray()
+    for workid in work_index:
+        work_blob += _encode(workid)
+        work_offsets.append(len(work_blob))
+
+    body = bytearray()
+    positions = []
+    for section in [query_offsets.tobytes(), query_blob, works.tobytes(), counts.tobytes(), work_offsets.tobytes(), work_blob]:
+        positions.append(HEADER.size + len(body))
+        body += section
+        _pad(body)
+    # Running services map the store, so it is replaced rather than overwritten
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(queries), top_n, len(work_index), *positions))
+        fp.write(body)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote smartsearch store with {len(queries)} queries and {len(work_index)} works to {path}")
+
+
+def is_store(path):
+    """ Returns whether path is a file in the binary store format """
+    with open(path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+class SmartSearchStore(Mapping):
+    """
+    Read-only mapping from query to list of [workid, count], backed by a
+    memory mapped store file
+    """
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_queries, self.top_n, self.n_works,
+         query_offsets_pos, self._query_blob_pos, works_pos, counts_pos,
+         work_offsets_pos, self._work_blob_pos) = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a smartsearch store of version {VERSION}")
+        view = memoryview(self._mm)
+        entries = self.n_queries * self.top_n
+        self._query_offsets = view[query_offsets_pos: query_offsets_pos + 8 * (self.n_queries + 1)].cast("Q")
+        self._works = view[works_pos: works_pos + 4 * entries].cast("i")
+        self._counts = view[counts_pos: counts_pos + 4 * entries].cast("I")
+        self._work_offsets = view[work_offsets_pos: work_offsets_pos + 8 * (self.n_works + 1)].cast("Q")
+
+    def __len__(self):
+        return self.n_queries
+
+    def __iter__(self):
+        for i in range(self.n_queries):
+            yield _decode(self._query(i))
+
+    def __getitem__(self, query):
+        i = self.index(query)
+        if i < 0:
+            raise KeyError(query)
+        return self.hits(i)
+
+    def _query(self, i):
+        return self._mm[self._query_blob_pos + self._query_offsets[i]: self._query_blob_pos + self._query_offsets[i + 1]]
+
+    def _workid(self, w):
+        return _decode(self._mm[self._work_blob_pos + self._work_offsets[w]: self._work_blob_pos + self._work_offsets[w + 1]])
+
+    def _bisect(self, encoded):
+        lo, hi = 0, self.n_queries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._query(mid) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index(self, query):
+        """ Returns the position of query in the store, or -1 if not present """
+        if not isinstance(query, str):
+            return -1
+        encoded = _encode(query)
+        i = self._bisect(encoded)
+        if i < self.n_queries and self._query(i) == encoded:
+            return i
+        return -1
+
+    def query(self, i):
+        """ Returns the query at position i """
+        return _decode(self._query(i))
+
+    def hits(self, i):
+        """ Returns the [workid, count] list of the query at position i """
+        start = i * self.top_n
+        return [[self._workid(w), c] for w, c in zip(self._works[start: start + self.top_n], self._counts[start: start + self.top_n]) if w >= 0]
+
+    def total_count(self, i):
+        """ Returns the summed click count of the works stored for the query at position i """
+        start = i * self.top_n
+        return sum(self._counts[start: start + self.top_n])
+
+
+def convert():
+    parser = argparse.ArgumentParser(description="Converts a search2works.json file into the binary smartsearch store format")
+    parser.add_argument("infile", help="search2works json file")
+    parser.add_argument("outfile", help="path of the store to write")
+    parser.add_argument("-n", "--top-n", dest="top_n", type=int, default=10, help="max number of works kept for each query")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s : %(levelname)s : %(message)s", level=logging.INFO)
+    with open(args.infile) as fp:
+        search2works = json.load(fp)
+    write_store(search2works, args.outfile, args.top_n)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.solr.bulk_writer` -- bulk indexing of documents into solr
+
+===========
+bulk_writer
+===========
+
+Posts documents to the update handler of a solr collection in batches from
+several threads, while the documents are still being built (see
+:mod:`simple_search.pipeline`).
+
+* The threads share a pool of keep-alive connections.
+* Batches are encoded with orjson when it is installed, and can be gzip
+  compressed, which requires solr to accept gzip encoded request bodies.
+* Batches failing with a 5xx response, a timeout or a broken connection
+  are retried with exponential backoff.
+* The batch size adapts to the time solr takes to index a batch. It grows
+  while batches are faster than the target time, and shrinks when they are
+  slower or fail.
+
+"""
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from simple_search.pipeline import run_pipeline
+
+try:
+    # Several times faster than the json module for large batches
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableError(Exception):
+    """ Raised for a batch solr failed to index for reasons which may be temporary """
+
+
+def encode_documents(documents):
+    """ Returns documents encoded as json """
+    if orjson is not None:
+        return orjson.dumps(documents, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(documents).encode("utf8")
+
+
+class SolrBulkWriter():
+    """ Indexes documents into solr in adaptively sized batches from several threads """
+    def __init__(self, url, num_threads=10, batch_size=1000, min_batch_size=100, max_batch_size=10000,
+                 target_batch_seconds=1.0, commit_within=None, compress=False, max_retries=5, backoff=0.5,
+                 timeout=120, max_pending_batches=None):
+        """
+        :param url:
+            url of the solr collection
+        :param num_threads:
+            number of threads posting batches
+        :param batch_size:
+            number of documents in the first batches
+        :param target_batch_seconds:
+            time solr should take to index a batch. The batch size is adjusted towards it
+            between min_batch_size and max_batch_size
+        :param commit_within:
+            milliseconds within which solr should commit the posted documents. None leaves it to solr
+        :param compress:
+            gzip the batches. Solr must be configured to accept gzip encoded requests
+        :param max_retries:
+            number of times a failed batch is retried before the indexing fails
+        :param backoff:
+            seconds waited before the first retry. Doubled for each following retry
+        :param timeout:
+            seconds to wait for solr to answer a batch
+        :param max_pending_batches:
+            number of batches built ahead of the threads. Defaults to twice num_threads
+        """
+        self.url = url.rstrip('/')
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_batch_seconds = target_batch_seconds
+        self.commit_within = commit_within
+        self.compress = compress
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_pending_batches = max_pending_batches or 2 * num_threads
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=num_threads))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=num_threads))
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.batches = 0
+        self.retries = 0
+        self.seconds = 0.0
+        logger.info(f'Solr bulk writer initialized url={self.url}, num_threads={self.num_threads}, batch_size={self.batch_size}, '
+                    f'commit_within={self.commit_within}, compress={self.compress}, json={"orjson" if orjson else "json"}')
+
+    def __call__(self, documents):
+        return self.index(documents)
+
+    def index(self, documents):
+        """
+        Indexes documents into solr. Batches are posted while documents is
+        still being iterated, so it can be a generator of any size. Returns
+        the totals of the indexing, see stats
+
+        :param documents:
+            iterable of docs to index
+        """
+        start = time.perf_counter()
+        pipeline = run_pipeline(self._batches(documents), self.post, self.num_threads, self.max_pending_batches)
+        stats = dict(self.stats(), wall_seconds=time.perf_counter() - start)
+        logger.info(f"Indexed {stats['documents']} documents in {stats['batches']} batches, {stats['retries']} retries, "
+                    f"in {stats['wall_seconds']:.1f}s. Building waited {pipeline.producer_wait:.1f}s for the indexer threads, "
+                    f"which waited {pipeline.consumer_wait:.1f}s in total for documents")
+        return stats
+
+    def _batches(self, documents):
+        """ Yields batches of documents, of the batch size current when each batch is started """
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def post(self, documents):
+        """ Posts one batch of documents, retrying temporary failures """
+        body = encode_documents(documents)
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        params = {"commitWithin": self.commit_within} if self.commit_within is not None else None
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self._post(body, headers, params)
+                break
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning(f"Posting a batch of {len(documents)} documents failed: {e}. Retrying in {delay:.1f}s")
+                self._failed()
+                time.sleep(delay)
+        self._posted(len(documents), len(body), time.perf_counter() - start)
+
+    def _post(self, body, headers, params):
+        try:
+            response = self.session.post(self.url + '/update', data=body, headers=headers, params=params, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(str(e)) from e
+        if response.status_code >= 500:
+            raise RetryableError(f"solr answered {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+
+    def _posted(self, documents, size, seconds):
+        """ Records a posted batch, and adjusts the batch size towards the target time """
+        with self._lock:
+            self.documents += documents
+            self.batches += 1
+            self.seconds += seconds
+            # The size this batch should have had to take the target time. The batch size moves
+            # half way towards it, at most halving or doubling, so a single odd batch does not throw it off
+            ideal = documents * self.target_batch_seconds / max(seconds, 1e-3)
+            batch_size = min(2 * self.batch_size, max(self.batch_size // 2, (self.batch_size + ideal) / 2))
+            self.batch_size = min(self.max_batch_size, max(self.min_batch_size, int(batch_size)))
+            batch_size = self.batch_size
+        logger.info(f"Posted {documents} documents ({size / 1024:.0f} kB) in {seconds:.2f}s, "
+                    f"{documents / max(seconds, 1e-3):.0f} documents/s. Batch size is now {batch_size}")
+
+    def _failed(self):
+        """ Records a failed batch. Large batches may be the cause, so the batch size is halved """
+        with self._lock:
+            self.retries += 1
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+
+    def commit(self):
+        """ Commits the posted documents, making them searchable """
+        response = self.session.get(self.url + '/update', params={'commit': 'true'}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+    def stats(self):
+        """ Returns the number of documents, batches and retries posted so far, and the time solr took to index them """
+        with self._lock:
+            return {"documents": self.documents,
+                    "batches": self.batches,
+                    "retries": self.retries,
+                    "seconds": self.seconds,
+                    "batch_size": self.batch_size}
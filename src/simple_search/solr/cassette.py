@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.solr.cassette` -- record and replay of solr traffic
+
+========
+cassette
+========
+
+A recording proxy sits between the service and solr and stores each
+request/response pair in a cassette file, one json entry per line. A
+replay server answers the recorded requests from the cassette, after the
+recorded QTime and optional jitter, so searches can be tested end to end
+without solr or network. Requests which were not recorded are answered
+with 404, so changes to the solr parameters sent by the service show up.
+
+    solr-cassette record http://localhost:8983/solr/simple-search searches.ndjson -p 8984
+    solr-cassette replay searches.ndjson -p 8984 --jitter 0.3
+
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop
+
+logger = logging.getLogger(__name__)
+
+# Parameters which differ between otherwise identical requests
+IGNORED_PARAMS = {"timeAllowed"}
+
+
+def request_key(path, arguments):
+    """
+    Returns the key identifying a request in a cassette
+
+    :param arguments:
+        dict mapping parameter names to lists of values, as str or bytes
+    """
+    params = sorted([name, [v.decode("utf8") if isinstance(v, bytes) else v for v in values]]
+                    for name, values in arguments.items() if name not in IGNORED_PARAMS)
+    return json.dumps([path, params], ensure_ascii=False)
+
+
+class Cassette():
+    """ Recorded solr responses by request """
+    def __init__(self, path=None):
+        """
+        :param path:
+            cassette file. Recorded entries are appended to it
+        """
+        self.path = path
+        self.entries = {}
+
+    @classmethod
+    def load(cls, path):
+        cassette = cls(path)
+        with open(path) as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    cassette.entries[request_key(entry["path"], dict(entry["params"]))] = entry
+        logger.info(f"Loaded {len(cassette.entries)} recorded solr responses from {path}")
+        return cassette
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, arguments):
+        """ Returns the recorded entry of a request, or None """
+        return self.entries.get(request_key(path, arguments))
+
+    def record(self, path, arguments, status, body):
+        """ Stores the response to a request, and appends it to the cassette file """
+        key = request_key(path, arguments)
+        entry = {"path": path, "params": json.loads(key)[1], "status": status}
+        try:
+            entry["response"] = json.loads(body)
+        except ValueError:
+            entry["body"] = body.decode("utf8", "replace")
+        self.entries[key] = entry
+        if self.path:
+            with open(self.path, "a") as fp:
+                fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return entry
+
+
+def entry_qtime(entry):
+    """ Returns the QTime of a recorded response in seconds """
+    return entry.get("response", {}).get("responseHeader", {}).get("QTime", 0) / 1000
+
+
+class RecordingHandler(tornado.web.RequestHandler):
+    """ Forwards requests to solr and records them with their responses """
+    def initialize(self, solr_url, cassette, client):
+        self.solr_url = solr_url.rstrip("/")
+        self.cassette = cassette
+        self.client = client
+
+    async def get(self, path):
+        await self.forward(path)
+
+    async def post(self, path):
+        await self.forward(path)
+
+    async def forward(self, path):
+        url = self.solr_url + path + ("?" + self.request.query if self.request.query else "")
+        headers = {}
+        if "Content-Type" in self.request.headers:
+            headers["Content-Type"] = self.request.headers["Content-Type"]
+        request = HTTPRequest(url, method=self.request.method, headers=headers,
+                              body=self.request.body if self.request.method == "POST" else None)
+        response = await self.client.fetch(request, raise_error=False)
+        if response.code == 599:
+            raise tornado.web.HTTPError(502, f"solr did not respond: {response.error}")
+        self.cassette.record(path, self.request.arguments, response.code, response.body)
+        self.set_status(response.code)
+        self.set_header("Content-Type", response.headers.get("Content-Type", "application/json"))
+        self.write(response.body)
+
+
+class ReplayHandler(tornado.web.RequestHandler):
+    """ Answers recorded requests after their recorded QTime """
+    def initialize(self, cassette, jitter, random):
+        self.cassette = cassette
+        self.jitter = jitter
+        self.random = random
+
+    async def get(self, path):
+        await self.replay(path)
+
+    async def post(self, path):
+        await self.replay(path)
+
+    async def replay(self, path):
+        entry = self.cassette.get(path, self.request.arguments)
+        if entry is None:
+            self.set_status(404)
+            return self.write({"error": "no recorded response", "key": request_key(path, self.request.arguments)})
+        delay = entry_qtime(entry)
+        if self.jitter > 0:
+            delay *= self.random.lognormvariate(0, self.jitter)
+        await asyncio.sleep(delay)
+        self.set_status(entry["status"])
+        if "response" in entry:
+            self.set_header("Content-Type", "application/json")
+            self.write(json.dumps(entry["response"]))
+        else:
+            self.write(entry["body"])
+
+
+def make_recording_app(solr_url, cassette):
+    """ Returns the tornado application of a proxy recording the traffic to solr_url in cassette """
+    client = AsyncHTTPClient(force_instance=True)
+    return tornado.web.Application([(r"(/.*)", RecordingHandler, {"solr_url": solr_url, "cassette": cassette, "client": client})])
+
+
+def make_replay_app(cassette, jitter=0.0, seed=None):
+    """
+    Returns the tornado application answering the requests recorded in cassette
+
+    :param jitter:
+        sigma of a lognormal factor the recorded QTime is multiplied with. 0 replays the QTime as is
+    """
+    return tornado.web.Application([(r"(/.*)", ReplayHandler, {"cassette": cassette, "jitter": jitter, "random": random.Random(seed)})])
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(description="Records solr traffic in a cassette, or replays a cassette")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record = subparsers.add_parser("record", help="proxy requests to solr and record them")
+    record.add_argument("solr_url", metavar="solr-url", help="url of the solr collection to record")
+    record.add_argument("cassette", help="cassette file the requests are appended to")
+    record.add_argument("-p", "--port", type=int, default=8984)
+    replay = subparsers.add_parser("replay", help="answer requests from a cassette")
+    replay.add_argument("cassette", help="cassette file")
+    replay.add_argument("-p", "--port", type=int, default=8984)
+    replay.add_argument("--jitter", type=float, default=0.0, help="sigma of the lognormal jitter applied to the recorded QTime")
+    replay.add_argument("--seed", type=int, help="seed of the jitter")
+    return parser.parse_args()
+
+
+def main():
+    args = setup_args()
+    logging.basicConfig(format="%(asctime)s : %(levelname)s : %(message)s", level=logging.INFO)
+    if args.command == "record":
+        make_recording_app(args.solr_url, Cassette(args.cassette)).listen(args.port)
+        logger.info(f"Recording requests to {args.solr_url} in {args.cassette}. Point the service at http://localhost:{args.port}")
+    else:
+        make_replay_app(Cassette.load(args.cassette), args.jitter, args.seed).listen(args.port)
+        logger.info(f"Replaying {args.cassette} at http://localhost:{args.port}")
+    IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.solr.client` -- non-blocking solr client
+
+======
+client
+======
+
+Solr client for use from the tornado IOLoop. Requests are sent through
+a pooled http client (keep-alive when pycurl is available) with
+per-request timeouts, so a slow solr round trip does not stall other
+requests in the process.
+
+"""
+import json
+import logging
+import urllib.parse
+
+try:
+    # libcurl keeps connections to solr alive between requests
+    from tornado.curl_httpclient import CurlAsyncHTTPClient as _HTTPClient
+except ImportError:
+    from tornado.simple_httpclient import SimpleAsyncHTTPClient as _HTTPClient
+from tornado.httpclient import HTTPRequest
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSolr():
+    """
+    Asynchronous solr client.
+    The underlying http client is created lazily on first use, so the
+    client can be constructed before the IOLoop is running.
+    """
+    def __init__(self, url, max_clients=50, connect_timeout=1.0, request_timeout=10.0):
+        """
+        Initializes client
+
+        :param url:
+            url of solr collection
+        :param max_clients:
+            max number of concurrent connections to solr
+        :param connect_timeout:
+            timeout in seconds for establishing a connection
+        :param request_timeout:
+            default timeout in seconds for an entire request
+        """
+        self.url = url.rstrip('/')
+        self.max_clients = max_clients
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self._client = None
+        logger.info(f'Async solr client initialized url={self.url}, http_client={_HTTPClient.__name__}, max_clients={self.max_clients}')
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = _HTTPClient(force_instance=True, max_clients=self.max_clients)
+        return self._client
+
+    async def select(self, query, timeout=None, **params):
+        """
+        Performs a query against the select handler and returns the
+        decoded solr response
+
+        :param query:
+            solr query (q)
+        :param timeout:
+            request timeout in seconds. Defaults to the client timeout
+        :param params:
+            additional solr parameters. Lists are sent as repeated parameters
+        """
+        params = dict(params, q=query, wt='json')
+        request = HTTPRequest(self.url + '/select',
+                              method='POST',
+                              body=urllib.parse.urlencode(params, doseq=True),
+                              headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
+                              connect_timeout=self.connect_timeout,
+                              request_timeout=timeout if timeout is not None else self.request_timeout)
+        response = await self.client.fetch(request)
+        return json.loads(response.body)
+
+    async def search(self, query, timeout=None, **params):
+        """ Performs a query and returns the list of matching documents """
+        response = await self.select(query, timeout=timeout, **params)
+        return response['response']['docs']
+
+    async def index_version(self, timeout=None):
+        """ Returns the version of the currently searchable index """
+        request = HTTPRequest(self.url + '/admin/luke?' + urllib.parse.urlencode({'numTerms': 0, 'show': 'index', 'wt': 'json'}),
+                              connect_timeout=self.connect_timeout,
+                              request_timeout=timeout if timeout is not None else self.request_timeout)
+        response = await self.client.fetch(request)
+        return json.loads(response.body)['index']['version']
+
+    async def ping(self, timeout=None):
+        """ Raises an exception unless the solr ping handler reports the collection as OK """
+        request = HTTPRequest(self.url + '/admin/ping?wt=json',
+                              connect_timeout=self.connect_timeout,
+                              request_timeout=timeout if timeout is not None else self.request_timeout)
+        response = await self.client.fetch(request)
+        status = json.loads(response.body).get('status')
+        if status != 'OK':
+            raise RuntimeError(f'solr ping of {self.url} returned status {status}')
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.solr.fake_solr` -- local stand-in for solr
+
+=========
+fake_solr
+=========
+
+Minimal http server answering the solr requests made by the service
+(select, luke and ping) with synthetic documents after a tunable latency,
+so the service can be load tested without solr or network.
+
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+
+import tornado.web
+from tornado.ioloop import IOLoop
+
+logger = logging.getLogger(__name__)
+
+LANGUAGES = ["dan", "eng", "ger", "swe", "nor"]
+TYPES = ["Bog", "Ebog", "Lydbog (net)", "Film (dvd)", "Musik (cd)"]
+
+
+class Latency():
+    """ Lognormal latency with the given median and spread """
+    def __init__(self, median=0.01, jitter=0.0, seed=None):
+        """
+        :param median:
+            median latency in seconds
+        :param jitter:
+            sigma of the lognormal distribution. 0 gives a constant latency
+        """
+        self.median = median
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def sample(self):
+        if self.jitter <= 0:
+            return self.median
+        return self.median * self.random.lognormvariate(0, self.jitter)
+
+
+def synthetic_docs(query, rows, start=0):
+    """ Returns rows deterministic documents for query, shaped like those of the simple-search collection """
+    docs = []
+    for i in range(start, start + rows):
+        digest = hashlib.md5(f"{query}\0{i}".encode("utf8")).hexdigest()
+        pids = [f"870970-basis:{int(digest[j:j + 6], 16) % 100000000:08d}" for j in range(0, 6 * (1 + i % 3), 6)]
+        types = [TYPES[int(digest[-2:], 16) % len(TYPES)] for _ in pids]
+        doc = {"workid": f"work-of:{pids[0]}",
+               "pids": pids,
+               "title": f"{query.strip()} {i}",
+               "creator": [f"creator {digest[:4]}"],
+               "language": [LANGUAGES[int(digest[-1], 16) % len(LANGUAGES)]],
+               "pid_details": [{"pid": p, "type": t} for p, t in zip(pids, types)],
+               "pid_to_type_map": [f"{p}:::870970-basis:::{t}" for p, t in zip(pids, types)],
+               "score": 100.0 / (i + 1)}
+        if i % 5 == 4:
+            # Like documents indexed before pid_details was stored, whose pid details the
+            # service builds from pid_to_type_map
+            del doc["pid_details"]
+        docs.append(doc)
+    return docs
+
+
+def debug_block(debug, response):
+    """ Returns a debug section like the one solr returns for the debug parameter values in debug """
+    qtime = float(response["responseHeader"]["QTime"])
+    block = {}
+    if "timing" in debug:
+        block["timing"] = {"time": qtime,
+                           "prepare": {"time": 0.0, "query": {"time": 0.0}},
+                           "process": {"time": qtime, "query": {"time": qtime}}}
+    if "results" in debug:
+        block["explain"] = {doc["workid"]: f"\n{doc['score']} = synthetic score of document {i}\n"
+                            for i, doc in enumerate(response["response"]["docs"], response["response"]["start"])}
+    return block
+
+
+class FakeSolrHandler(tornado.web.RequestHandler):
+    def initialize(self, latency, num_found):
+        self.latency = latency
+        self.num_found = num_found
+
+    async def respond(self, body):
+        seconds = self.latency.sample()
+        await asyncio.sleep(seconds)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(body))
+
+
+class SelectHandler(FakeSolrHandler):
+    async def get(self):
+        await self.select()
+
+    async def post(self):
+        await self.select()
+
+    async def select(self):
+        rows = int(self.get_argument("rows", "10"))
+        start = int(self.get_argument("start", "0"))
+        cursor_mark = self.get_argument("cursorMark", None)
+        if cursor_mark is not None:
+            if cursor_mark != "*" and not cursor_mark.isdigit():
+                # As solr answers cursor marks it did not issue
+                return self.invalid_cursor(cursor_mark)
+            start = 0 if cursor_mark == "*" else int(cursor_mark)
+        rows = max(0, min(rows, self.num_found - start))
+        response = {"responseHeader": {"status": 0, "QTime": 0},
+                    "response": {"numFound": self.num_found, "start": start,
+                                 "docs": synthetic_docs(self.get_argument("q", ""), rows, start)}}
+        if cursor_mark is not None:
+            response["nextCursorMark"] = str(start + rows)
+        time_allowed = self.get_argument("timeAllowed", None)
+        seconds = self.latency.sample()
+        if time_allowed is not None and seconds * 1000 > int(time_allowed):
+            seconds = int(time_allowed) / 1000
+            response["responseHeader"]["partialResults"] = True
+        response["responseHeader"]["QTime"] = int(seconds * 1000)
+        debug = self.get_arguments("debug")
+        if debug:
+            response["debug"] = debug_block(debug, response)
+        await asyncio.sleep(seconds)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(response))
+
+    def invalid_cursor(self, cursor_mark):
+        message = ("Unable to parse 'cursorMark' after totem: value must either be '*' or the "
+                   f"'nextCursorMark' returned by a previous search: {cursor_mark}")
+        self.set_status(400)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"responseHeader": {"status": 400, "QTime": 0}, "error": {"msg": message, "code": 400}}))
+
+
+class LukeHandler(FakeSolrHandler):
+    async def get(self):
+        await self.respond({"index": {"numDocs": self.num_found, "version": 1}})
+
+
+class PingHandler(FakeSolrHandler):
+    async def get(self):
+        await self.respond({"status": "OK"})
+
+
+def make_app(latency, num_found=1000, path="/solr/simple-search"):
+    """
+    Returns the tornado application of a fake solr collection at path
+
+    :param latency:
+        Latency of the responses
+    :param num_found:
+        number of documents matching any query
+    """
+    settings = {"latency": latency, "num_found": num_found}
+    return tornado.web.Application([(path + "/select", SelectHandler, settings),
+                                    (path + "/admin/luke", LukeHandler, settings),
+                                    (path + "/admin/ping", PingHandler, settings)])
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(description="Serves a fake solr collection with synthetic documents and tunable latency")
+    parser.add_argument("-p", "--port", type=int, default=8983)
+    parser.add_argument("--path", default="/solr/simple-search", help="path of the collection")
+    parser.add_argument("--latency", type=float, default=0.01, help="median latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+        help="sigma of the lognormal latency distribution. 0 gives a constant latency")
+    parser.add_argument("--num-found", dest="num_found", type=int, default=1000, help="number of documents matching any query")
+    return parser.parse_args()
+
+
+def main():
+    args = setup_args()
+    logging.basicConfig(format="%(asctime)s : %(levelname)s : %(message)s", level=logging.INFO)
+    make_app(Latency(args.latency, args.jitter), args.num_found, args.path).listen(args.port)
+    logger.info(f"Fake solr serving http://localhost:{args.port}{args.path} with latency {args.latency}s, jitter {args.jitter}")
+    IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,6 @@ indexer
 Creates document collection.
 
 """
-import requests
-import grequests
-
 import json
 import argparse
 import collections
@@ -30,6 +27,7 @@ import numpy as np
 import pandas as pd
 from functools import partial
 from mobus import lowell_mapping_functions as lmf
+from simple_search.solr.bulk_writer import SolrBulkWriter
 from simple_search.synonym_list import Synonyms
 import dbc_pyutils.cursor
 
@@ -41,58 +39,6 @@ logger = logging.getLogger(__name__)
 tqdm = partial(tqdm, ncols=150, disable=(not sys.stdout.isatty()))
 
 
-class ThreadedSolrIndexer():
-    """
-    Solr indexer.
-    Indexer with batch functionality and parallel indexing from
-    multiple threads
-    """
-    def __init__(self, url, num_threads=1, batch_size=1000):
-        """
-        Initializes indexer
-
-        :param url:
-            url of solr collection
-        :param num_threads:
-            Number of parallel indexer threads
-        :param batch_size:
-            Number of documents in each batch
-        """
-        self.url = url.rstrip('/')
-        self.num_threads = num_threads
-        self.batch_size = batch_size
-        logger.info(f'Solr indexer initialized url={self.url}, num_threads={self.num_threads}, batch_size={self.batch_size}')
-
-    def __call__(self, documents):
-        return self.index(documents)
-
-    def index(self, documents):
-        """
-        indexes docs into solr
-
-        :param docs:
-            list of docs to index
-        """
-        doc_chunks = (chunk for chunk in self.__chunks(documents, self.batch_size))
-        rs = (grequests.post(self.url + '/update', data=json.dumps(docs), headers={'Content-Type': 'application/json'})
-              for docs in doc_chunks)
-        responses = grequests.map(rs, size=self.num_threads)
-        for response in responses:
-            if response is None or not response.ok:
-                response.raise_for_status()
-
-    def commit(self):
-        """ commits changed to solr collection """
-        resp = requests.get(self.url + '/update', params={'commit': 'true'})
-        if not resp.ok:
-            resp.raise_for_status()
-
-    def __chunks(self, l, n):
-        for i in range(0, len(l), n):
-            yield l[i: i+n]
-
-
-
 def map_work_to_metadata(docs, pid2work):
     """
     Collects metadata from all pids in work, and returns
@@ -194,7 +140,18 @@ def make_solr_documents(pid_list, work_to_holdings_map: dict, popularity_map: di
     with Time('Fetching data took', level='info'):
         pid2work, docs = get_data(pids)
     logger.info("size of docs %s", len(docs))
+    yield from build_solr_documents(pid2work, docs, work_to_holdings_map, popularity_map, synonym_container)
 
+
+def build_solr_documents(pid2work, docs, work_to_holdings_map: dict, popularity_map: dict, synonym_container):
+    """
+    Creates solr documents from the metadata of the pids in each work
+
+    :param pid2work:
+        dict mapping pids to their work
+    :param docs:
+        dict mapping pids to their metadata from LOWELL
+    """
     work2metadata = map_work_to_metadata(docs, pid2work)
     logger.info("work2metadata size %s", len(work2metadata))
 
@@ -215,6 +172,9 @@ def make_solr_documents(pid_list, work_to_holdings_map: dict, popularity_map: di
         pid_to_types_map = {p: ("---".join(docs[p]["collection"]),
             "---".join(docs[p].get("type", []))) for p in pids}
         pid_types_list = [f"{p}:::{pid_to_types_map[p][0]}:::{pid_to_types_map[p][1]}" for p in pids]
+        # The pid_details structure of the search response, stored so the service
+        # can serve it without parsing pid_to_type_map for every hit
+        pid_details = json.dumps([{"pid": p, "type": pid_to_types_map[p][1]} for p in pids])
         n_pids = math.log(len(pids) if len(pids) <9 else 9)+1
         metadata = work2metadata[work]
         years_since_publication = get_years_since_publication(metadata["year"]) if "year" in metadata else 99
@@ -225,6 +185,7 @@ def make_solr_documents(pid_list, work_to_holdings_map: dict, popularity_map: di
         document = {"workid": work,
                     "pids": pids,
                     "pid_to_type_map": pid_types_list,
+                    "pid_details": pid_details,
                     "n_pids": n_pids,
                     "holdings": holdings,
                     "popularity": popularity,
@@ -267,20 +228,28 @@ def chunks(l, n):
     for i in range(0, len(l), n):
         yield l[i: i+n]
 
-def create_collection(solr_url, pid_list, work_to_holdings_map, popularity_map: dict, synonym_file, limit=None, batch_size=1000):
+def create_collection(solr_url, pid_list, work_to_holdings_map, popularity_map: dict, synonym_file, limit=None, batch_size=1000,
+                      commit_within=None, compress=False):
     """
     Harvest rows from LOWELL and creates and indexes solr documents
+
+    :param commit_within:
+        milliseconds within which solr should commit posted documents
+    :param compress:
+        gzip the batches posted to solr
     """
     logger.info('Reading subject synonyms')
     synonyms = Synonyms(synonym_file)
-    documents = [d for d in make_solr_documents(pid_list, work_to_holdings_map, popularity_map, synonyms, limit)]
+    # Documents are posted while they are built, without holding them all in memory
+    documents = make_solr_documents(pid_list, work_to_holdings_map, popularity_map, synonyms, limit)
 
-    indexer = ThreadedSolrIndexer(solr_url, num_threads=10, batch_size=batch_size)
-    with Time("Indexing into solr took ", level="info"):
+    indexer = SolrBulkWriter(solr_url, num_threads=10, batch_size=batch_size, commit_within=commit_within, compress=compress)
+    with Time("Building and indexing documents into solr took ", level="info"):
         logger.info(f"Indexing into solr at {solr_url}")
         indexer.index(documents)
     logger.info('Comitting documents')
     indexer.commit()
+    indexer.close()
 
 def setup_args():
     parser = argparse.ArgumentParser()
@@ -293,6 +262,12 @@ def setup_args():
     parser.add_argument("popularity_data", metavar="popularity-data",
         help="path to file containing data (hit counts)")
     parser.add_argument("synonym_file", metavar="synonym-file", help="file with subject synonyms")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1000,
+        help="number of documents in the first batches posted to solr. Adjusted to the time solr takes to index them")
+    parser.add_argument("--commit-within", dest="commit_within", type=int,
+        help="milliseconds within which solr should commit posted documents")
+    parser.add_argument("--compress", action="store_true",
+        help="gzip the batches posted to solr. Solr must accept gzip encoded requests")
     parser.add_argument("-l", "--limit", type=int, dest="limit", help="if set, limits the number of harvested loans")
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="verbose output")
     return parser.parse_args()
@@ -313,7 +288,8 @@ def main():
         logger.info('Loading holdings-map')
         work_to_holdings = joblib.load(fp)
         create_collection(args.solr, args.pid_list, work_to_holdings,
-                          popularity_map, args.synonym_file, args.limit)
+                          popularity_map, args.synonym_file, args.limit, args.batch_size,
+                          args.commit_within, args.compress)
 
 
 def __read_popularity_counts(fp):
@@ -10,9 +10,6 @@ indexer_work_presentation
 Creates document collection.
 
 """
-import requests
-import grequests
-
 import json
 
 import argparse
@@ -27,63 +24,7 @@ import io
 import dbc_pyutils.solr
 import dbc_pyutils.cursor
 from dbc_pyutils import Time
-
-class ThreadedSolrIndexer():
-    """
-    Solr indexer.
-    Indexer with batch functionality and parallel indexing from
-    multiple threads
-    """
-    def __init__(self, url, num_threads=1, batch_size=1000):
-        """
-        Initializes indexer
-
-        :param url:
-            url of solr collection
-        :param num_threads:
-            Number of parallel indexer threads
-        :param batch_size:
-            Number of documents in each batch
-        """
-        self.url = url.rstrip('/')
-        self.num_threads = num_threads
-        self.batch_size = batch_size
-        logger.info(f'Solr indexer initialized url={self.url}, num_threads={self.num_threads}, batch_size={self.batch_size}')
-
-    def __call__(self, documents):
-        return self.index(documents)
-
-    def index(self, documents):
-        """
-        indexes docs into solr
-
-        :param docs:
-            list of docs to index
-        """
-        doc_chunks = (chunk for chunk in self.__chunks(documents, self.batch_size))
-        rs = (grequests.post(self.url + '/update', data=json.dumps(docs), headers={'Content-Type': 'application/json'})
-              for docs in doc_chunks)
-        responses = grequests.map(rs, size=self.num_threads)
-        for response in responses:
-            if response is None:
-                raise Exception
-            elif not response.ok:
-                response.raise_for_status()
-
-    def commit(self):
-        """ commits changed to solr collection """
-        try:
-            resp = requests.get(self.url + '/update', params={'commit': 'true'})
-        except Exception as e:
-            print('Committing to solr failed!')
-            raise
-        if not resp.ok:
-            resp.raise_for_status()
-        return
-
-    def __chunks(self, l, n):
-        for i in range(0, len(l), n):
-            yield l[i: i+n]
+from simple_search.solr.bulk_writer import SolrBulkWriter
 
 logger = logging.getLogger(__name__)
 
@@ -204,14 +145,18 @@ def make_solr_documents(cwork_list, work_to_holdings_map: dict, pop_map: dict, l
         if 'pid2type' in metadata:
             work_pid_types = pid_type_dict(metadata['pid2type'])
             pid_types_list = []
+            pid_details = []
             for p in pids:
                 if p in work_pid_types:
                     s = p + ":::" + "870970-basis---870970-danbib---870970-bibdk" + ":::" + work_pid_types[p]
                     pid_types_list.append(s)
+                    pid_details.append({"pid": p, "type": work_pid_types[p]})
                 else:
                     pid_types_list.append(p)
+                    pid_details.append({"pid": p})
         else:
             pid_types_list = [f"{p}" for p in pids]
+            pid_details = [{"pid": p} for p in pids]
 #        years_since_publication = get_years_since_publication(metadata["year"]) if "year" in metadata else 99
         years_since_publication = 99
 
@@ -225,6 +170,7 @@ def make_solr_documents(cwork_list, work_to_holdings_map: dict, pop_map: dict, l
                     "workid": work,
                     "pids": pids,
                     "pid_to_type_map": pid_types_list,
+                    "pid_details": json.dumps(pid_details),
                     "n_pids": n_pids,
                     "holdings": holdings,
                     "popularity": popularity,
@@ -245,18 +191,26 @@ def add_keys(metadata, keys, is_list=True):
     return document
 
 
-def create_collection(solr_url, cwork_list, work_to_holdings_map, pop_map, limit=None, batch_size=1000):
+def create_collection(solr_url, cwork_list, work_to_holdings_map, pop_map, limit=None, batch_size=1000,
+                      commit_within=None, compress=False):
     """
     Harvest rows from work-presentation and creates and indexes solr documents
+
+    :param commit_within:
+        milliseconds within which solr should commit posted documents
+    :param compress:
+        gzip the batches posted to solr
     """
     logger.info("Retrieving data from db")
-    documents = [d for d in make_solr_documents(cwork_list, work_to_holdings_map, pop_map, limit)]
+    # Documents are posted while they are built, without holding them all in memory
+    documents = make_solr_documents(cwork_list, work_to_holdings_map, pop_map, limit)
     logger.info(f"Indexing into solr at {solr_url}")
-    indexer = ThreadedSolrIndexer(solr_url, num_threads=10, batch_size=batch_size)
-    with Time("Indexing into solr took: ", level="info"):
+    indexer = SolrBulkWriter(solr_url, num_threads=10, batch_size=batch_size, commit_within=commit_within, compress=compress)
+    with Time("Building and indexing documents into solr took: ", level="info"):
         indexer.index(documents)
     logger.info("Committing to solr...")
     indexer.commit()
+    indexer.close()
     logger.info("Commit to solr done!")
     return
 
@@ -281,6 +235,12 @@ def setup_args():
         help="Path to holdings file path, saved in joblib format")
     parser.add_argument("popularity_data", metavar="popularity-data",
         help="path to file containing data (hit counts)")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1000,
+        help="number of documents in the first batches posted to solr. Adjusted to the time solr takes to index them")
+    parser.add_argument("--commit-within", dest="commit_within", type=int,
+        help="milliseconds within which solr should commit posted documents")
+    parser.add_argument("--compress", action="store_true",
+        help="gzip the batches posted to solr. Solr must accept gzip encoded requests")
     parser.add_argument("-l", "--limit", type=int, dest="limit", help="if set, limits the number of harvested loans")
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="verbose output")
     return parser.parse_args()
@@ -296,7 +256,8 @@ def main():
     with open(args.work_to_holdings_map_path, "rb") as w2h_fp, pop_file_opener(args.popularity_data, "rb") as pop_fp:
         pop_map = __read_popularity_counts(pop_fp)
         work_to_holdings = joblib.load(w2h_fp)
-        create_collection(args.solr, args.cwork_list, work_to_holdings, pop_map, args.limit)
+        create_collection(args.solr, args.cwork_list, work_to_holdings, pop_map, args.limit, args.batch_size,
+                          args.commit_within, args.compress)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.solr.replicas` -- routing between solr replicas
+
+========
+replicas
+========
+
+Solr client spreading requests over several replicas of a collection.
+Latency and errors are tracked for each replica, and requests go to the
+healthy replica with the lowest expected latency. Replicas failing
+repeatedly are taken out of rotation until a health check succeeds.
+
+With hedging enabled, a request which has not been answered within the
+p95 latency observed for its replica is also sent to the next best
+replica, and the first answer is used.
+
+"""
+import asyncio
+from collections import deque
+import logging
+import time
+
+from tornado.httpclient import HTTPClientError
+
+from simple_search.metrics import Counter, Gauge, Histogram
+from simple_search.solr.client import AsyncSolr
+
+logger = logging.getLogger(__name__)
+
+REPLICA_SECONDS = Histogram("simple_search_solr_replica_seconds",
+                            "Time of successful solr requests by replica", ["replica"])
+REPLICA_ERRORS = Counter("simple_search_solr_replica_errors_total",
+                         "Failed solr requests by replica", ["replica"])
+REPLICA_HEALTHY = Gauge("simple_search_solr_replica_healthy",
+                        "Whether a replica is in rotation", ["replica"])
+HEDGED_REQUESTS = Counter("simple_search_solr_hedged_requests_total",
+                          "Hedged solr requests sent, and how many of them answered first", ["outcome"])
+FAILOVERS = Counter("simple_search_solr_failovers_total",
+                    "Solr requests retried on another replica after a failure")
+
+
+def is_replica_failure(error):
+    """ Returns whether error is caused by the replica rather than the request """
+    if isinstance(error, HTTPClientError):
+        return error.code >= 500
+    return isinstance(error, (OSError, ValueError))
+
+
+class Replica():
+    """ Solr client of one replica with its latency and error statistics """
+    DECAY = 0.9
+
+    def __init__(self, solr, max_errors=3, window=200):
+        """
+        :param solr:
+            AsyncSolr of the replica
+        :param max_errors:
+            number of consecutive failures taking the replica out of rotation
+        :param window:
+            number of recent latencies the p95 is computed from
+        """
+        self.solr = solr
+        self.url = solr.url
+        self.max_errors = max_errors
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ewma = None
+        self.latencies = deque(maxlen=window)
+        self._p95 = None
+        REPLICA_HEALTHY.set(1, replica=self.url)
+
+    def score(self):
+        """ Expected latency, scaled by the requests already in flight. Unmeasured replicas are tried first """
+        if self.ewma is None:
+            return 0.0
+        return self.ewma * (self.in_flight + 1)
+
+    def record(self, seconds):
+        self.requests += 1
+        self.consecutive_errors = 0
+        self.ewma = seconds if self.ewma is None else self.DECAY * self.ewma + (1 - self.DECAY) * seconds
+        self.latencies.append(seconds)
+        self._p95 = None
+        REPLICA_SECONDS.observe(seconds, replica=self.url)
+
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_errors += 1
+        REPLICA_ERRORS.inc(replica=self.url)
+        if self.healthy and self.consecutive_errors >= self.max_errors:
+            logger.warning(f"Taking solr replica {self.url} out of rotation after {self.consecutive_errors} consecutive errors")
+            self.set_healthy(False)
+
+    def set_healthy(self, healthy):
+        self.healthy = healthy
+        if healthy:
+            self.consecutive_errors = 0
+        REPLICA_HEALTHY.set(int(healthy), replica=self.url)
+
+    def p95(self, min_samples=20):
+        """ Returns the p95 of the recent latencies, or None with fewer than min_samples measurements """
+        if len(self.latencies) < min_samples:
+            return None
+        if self._p95 is None:
+            ordered = sorted(self.latencies)
+            self._p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        return self._p95
+
+    def stats(self):
+        return {"url": self.url,
+                "healthy": self.healthy,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+                "latency_ewma": self.ewma,
+                "latency_p95": self.p95()}
+
+
+class ReplicatedSolr():
+    """
+    Asynchronous solr client for a collection served by several replicas,
+    with the interface of AsyncSolr
+    """
+    def __init__(self, urls, hedge=False, hedge_min_delay=0.005, max_errors=3, health_timeout=2.0,
+                 max_clients=50, connect_timeout=1.0, request_timeout=10.0):
+        """
+        Initializes client
+
+        :param urls:
+            urls of the replicas of the solr collection
+        :param hedge:
+            if set, slow requests are also sent to a second replica
+        :param hedge_min_delay:
+            min time in seconds before a request is hedged
+        :param max_errors:
+            number of consecutive failures taking a replica out of rotation
+        :param health_timeout:
+            timeout in seconds for health checks
+        """
+        if not urls:
+            raise ValueError("at least one solr url is required")
+        self.replicas = [Replica(AsyncSolr(url, max_clients=max_clients, connect_timeout=connect_timeout, request_timeout=request_timeout),
+                                 max_errors=max_errors)
+                         for url in urls]
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.health_timeout = health_timeout
+        self.request_timeout = request_timeout
+        self.hedged = 0
+        self.hedges_won = 0
+        self.failovers = 0
+        logger.info(f"Replicated solr client initialized with {len(self.replicas)} replicas, hedge={self.hedge}")
+
+    def ranked(self):
+        """ Returns the replicas in rotation, best first. All replicas if none are in rotation """
+        healthy = [r for r in self.replicas if r.healthy] or self.replicas
+        return sorted(healthy, key=Replica.score)
+
+    def hedge_delay(self, replica):
+        if not self.hedge:
+            return None
+        p95 = replica.p95()
+        return max(p95, self.hedge_min_delay) if p95 is not None else None
+
+    async def _call(self, replica, method, timeout, args, kwargs):
+        replica.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = await getattr(replica.solr, method)(*args, timeout=timeout, **kwargs)
+        except Exception as e:
+            if is_replica_failure(e):
+                replica.record_error()
+            raise
+        finally:
+            replica.in_flight -= 1
+        replica.record(time.perf_counter() - start)
+        return result
+
+    async def _request(self, method, *args, timeout=None, **kwargs):
+        """
+        Calls method of the best replica. The request is hedged to the next
+        replica if it is slow, and failed over to it if the replica fails,
+        as long as there is time left of the timeout
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.request_timeout)
+        replicas = self.ranked()
+
+        def start(replica):
+            return asyncio.ensure_future(self._call(replica, method, deadline - time.monotonic(), args, kwargs))
+
+        primary = replicas.pop(0)
+        tasks = {start(primary)}
+        hedge_delay = self.hedge_delay(primary) if replicas else None
+        hedge_task = None
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The request is slower than the p95 of the replica
+                    hedge_delay = None
+                    hedge_task = start(replicas.pop(0))
+                    tasks.add(hedge_task)
+                    self.hedged += 1
+                    HEDGED_REQUESTS.inc(outcome="sent")
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.hedges_won += 1
+                            HEDGED_REQUESTS.inc(outcome="won")
+                        return task.result()
+                    error = task.exception()
+                    if not is_replica_failure(error):
+                        raise error
+                if not tasks and replicas and deadline > time.monotonic():
+                    hedge_delay = None
+                    self.failovers += 1
+                    FAILOVERS.inc()
+                    tasks.add(start(replicas.pop(0)))
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def select(self, query, timeout=None, **params):
+        """ Performs a query against the select handler of the best replica, see AsyncSolr.select """
+        return await self._request("select", query, timeout=timeout, **params)
+
+    async def search(self, query, timeout=None, **params):
+        """ Performs a query and returns the list of matching documents """
+        response = await self.select(query, timeout=timeout, **params)
+        return response['response']['docs']
+
+    async def index_version(self, timeout=None):
+        """ Returns the version of the currently searchable index of the best replica """
+        return await self._request("index_version", timeout=timeout)
+
+    async def index_versions(self, timeout=None):
+        """
+        Returns url -> version of the currently searchable index of each
+        replica which answered. Replicas commit independently, so their
+        versions differ, and are only comparable with earlier versions of
+        the same replica
+        """
+        timeout = timeout if timeout is not None else self.health_timeout
+        versions = await asyncio.gather(*[replica.solr.index_version(timeout=timeout) for replica in self.replicas],
+                                        return_exceptions=True)
+        result = {}
+        for replica, version in zip(self.replicas, versions):
+            if isinstance(version, Exception):
+                logger.warning(f"Failed to fetch the index version of solr replica {replica.url}: {version}")
+            else:
+                result[replica.url] = version
+        return result
+
+    async def check_health(self):
+        """ Pings all replicas, and puts them in or out of rotation accordingly """
+        await asyncio.gather(*[self._check_health(replica) for replica in self.replicas])
+
+    async def _check_health(self, replica):
+        try:
+            await replica.solr.ping(timeout=self.health_timeout)
+            healthy = True
+        except Exception as e:
+            healthy = False
+            if replica.healthy:
+                logger.warning(f"Health check of solr replica {replica.url} failed: {e}")
+        if healthy and not replica.healthy:
+            logger.info(f"Solr replica {replica.url} is healthy again")
+        replica.set_healthy(healthy)
+
+    def stats(self):
+        return {"replicas": [replica.stats() for replica in self.replicas],
+                "hedged": self.hedged,
+                "hedges_won": self.hedges_won,
+                "failovers": self.failovers}
+
+    def close(self):
+        for replica in self.replicas:
+            replica.solr.close()
@@ -1,17 +1,64 @@
 #!/usr/bin/env python3
+import asyncio
+import base64
+import binascii
+import json
 from dataclasses import dataclass
 from collections import namedtuple
-import dbc_pyutils.solr
+import os
+import time
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import IOLoop
+from simple_search.admission import AdmissionControl, DeadlineExceeded, DEADLINE_MISSES
+from simple_search.cache import LRUCache
+from simple_search.metrics import Histogram, StageTimer
+from simple_search.querylog import write_lines
+from simple_search.singleflight import SingleFlight
+from simple_search.solr.replicas import ReplicatedSolr
 from simple_search.smartsearch import SmartSearch, CuratedSearch
+from simple_search.suggest import PrefixIndex
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 SmartSearchData = namedtuple('SmartSearch', 'query bf')
+# partial is set when solr stopped searching at the deadline. timing is only set for debug searches
+SearchPage = namedtuple('SearchPage', 'result next_cursor partial timing', defaults=[None])
 
+# Cursor given by clients to get the first page of a cursor paged search
+CURSOR_START = "*"
 
-@dataclass
+# Fields clients can select in the response, and the solr fields they are built from
+RESULT_FIELDS = {
+    "pids": ["pids"],
+    "title": ["title"],
+    "language": ["language"],
+    "pid_details": ["pid_details:[json]", "pid_to_type_map"],
+}
+DEBUG_FIELDS = ["title_alternative", "creator", "workid", "contributor", "work_type"]
+# Number of hits the solr score explanation is returned for
+EXPLAIN_HITS = 10
+
+# Extra time given to the http request to solr beyond the deadline, so solr
+# can return the partial results found within timeAllowed
+DEADLINE_GRACE = 0.25
+
+
+class InvalidSearchParameter(ValueError):
+    """ Raised for search parameters with invalid values """
+
+
+SEARCH_STAGE_SECONDS = Histogram("simple_search_search_stage_seconds",
+                                 "Time spent in each stage of a search", ["stage"])
+SEARCH_SECONDS = Histogram("simple_search_search_seconds",
+                           "Total time of a search by option combination and cache outcome",
+                           ["smartsearch", "curated_search", "synonyms", "phonetic", "cache"])
+SOLR_QTIME_SECONDS = Histogram("simple_search_solr_qtime_seconds",
+                               "Query time reported by solr (QTime)")
+
+
+@dataclass(frozen=True)
 class Option:
     phonetic_creator_contributor: str = ''
     smartsearch: int = 0
@@ -65,22 +112,345 @@ def create_bf(workids):
 
 
 class Searcher(object):
-    def __init__(self, solr_url, smartsearch_model_file=None, curated_search_file=None):
-        self.solr = dbc_pyutils.solr.Solr(solr_url)
+    def __init__(self, solr_url, smartsearch_model_file=None, curated_search_file=None, *, solr_timeout=10.0, solr_max_clients=50,
+                 cache_size=10000, cache_ttl=300, head_snapshot_file=None, solr_max_concurrency=None, solr_queue_size=100,
+                 solr_queue_timeout=0.1, solr_hedge=False, query_log=None):
+        """
+        :param solr_url:
+            url of the solr collection, or list of urls of its replicas
+        :param query_log:
+            QueryLog the searches are logged to
+        """
+        solr_urls = [solr_url] if isinstance(solr_url, str) else solr_url
+        self.solr = ReplicatedSolr(solr_urls, hedge=solr_hedge, max_clients=solr_max_clients, request_timeout=solr_timeout)
+        self.admission = AdmissionControl(max_concurrency=solr_max_concurrency or solr_max_clients,
+                                          max_queue=solr_queue_size, queue_timeout=solr_queue_timeout)
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        # Replicas commit independently, so each has its own index version. Only a change
+        # of the version of the same replica means the index changed
+        self.solr_urls = solr_urls
+        self.index_versions = {}
+        # Version of the first replica, written to head snapshots
+        self.index_version = None
+        # Incremented each time the result cache is cleared for an index change
+        self.index_generation = 0
+        # Precomputed results of head queries, valid for the index version they were built on.
+        # They are used once a replica is found to have that version, until its index changes
+        self.head_results = {}
+        self.head_results_version = None
+        self.head_results_replica = None
+        self.head_hits = 0
+        self.in_flight = SingleFlight()
+        self.query_log = query_log
+        # attribute name -> (file, loader) for the data files which can be reloaded while running
+        self.data_files = {}
+        self.data_versions = {}
+        self._reload_lock = asyncio.Lock()
+        # File shared by the worker processes, with a line for each forced reload. See share_reloads
+        self.reload_file = None
+        self.reload_generation = 0
         self.smartsearch = None
+        # Prefix index of the smartsearch queries, and the smartsearch it was built from. Built
+        # on the first suggest call, as it copies every query out of the memory mapped store
+        self.suggestions = None
+        self.suggestions_source = None
         if smartsearch_model_file:
             logger.info('Searcher initialized with smartsearch')
-            self.smartsearch = SmartSearch.load(smartsearch_model_file, self.solr)
+            self.data_files['smartsearch'] = (smartsearch_model_file, lambda path: SmartSearch.load(path, self.solr))
         self.curated_search = CuratedSearch({})
         if curated_search_file:
             logger.info('Searcher initialized with curated search')
-            self.curated_search = CuratedSearch.load(curated_search_file)
-
-    def search(self, phrase, debug=False, *, options: dict = {}, rows=10, start=0):
-        logger.info(f'Searching for {phrase}')
+            self.data_files['curated_search'] = (curated_search_file, CuratedSearch.load)
+        self._install_data(self._load_data(list(self.data_files)))
+        if head_snapshot_file:
+            self.load_head_snapshot(head_snapshot_file)
+
+    def load_head_snapshot(self, path):
+        """ Loads precomputed head query results written by simple_search.head_snapshot """
+        with open(path) as fp:
+            snapshot = json.load(fp)
+        self.head_results = {search_key(entry["q"], parse_options(entry["options"]), entry["rows"], entry["start"], entry["debug"]): (entry["result"], None, False)
+                             for entry in snapshot["entries"]}
+        self.head_results_version = snapshot["index_version"]
+        self.head_results_replica = None
+        logger.info(f"Loaded {len(self.head_results)} head query results for index version {self.head_results_version}")
+
+    def drop_head_results(self, reason):
+        if self.head_results:
+            logger.info(f"Dropping head query results: {reason}")
+            self.head_results = {}
+
+    def _load_data(self, names):
+        """ Loads the data files of names. Returns name -> (data, version) """
+        loaded = {}
+        for name in names:
+            path, loader = self.data_files[name]
+            start = time.perf_counter()
+            mtime = os.stat(path).st_mtime
+            data = loader(path)
+            loaded[name] = (data, {"file": path,
+                                   "mtime": mtime,
+                                   "loaded_at": time.time(),
+                                   "load_seconds": round(time.perf_counter() - start, 3)})
+        return loaded
+
+    def _install_data(self, loaded):
+        # Each attribute is replaced by a single assignment, so searches see
+        # either the old or the new data
+        for name, (data, version) in loaded.items():
+            setattr(self, name, data)
+            self.data_versions[name] = version
+
+    def changed_data_files(self):
+        """ Returns the names of the data files modified since they were loaded """
+        changed = []
+        for name, (path, _) in self.data_files.items():
+            try:
+                if os.stat(path).st_mtime != self.data_versions[name]["mtime"]:
+                    changed.append(name)
+            except FileNotFoundError:
+                # The file may be in the middle of being replaced
+                pass
+        return changed
+
+    async def reload_data(self, force=False):
+        """
+        Reloads the smartsearch and curated search data files which have changed,
+        or all of them if force is set. Loading happens in a background thread
+        and the new data is swapped in when fully loaded, so searches continue
+        on the old data meanwhile. Returns the names of the reloaded data files
+
+        The thread only keeps searches running if loading releases the GIL.
+        A smartsearch file in the memory mapped store format (see
+        smartsearch_store) loads near-instantly, whereas json.load holds the
+        GIL while parsing, so searches stall while a json file is loaded
+        """
+        async with self._reload_lock:
+            names = list(self.data_files) if force else self.changed_data_files()
+            if not names:
+                return []
+            logger.info(f"Reloading {', '.join(names)}")
+            loaded = await IOLoop.current().run_in_executor(None, self._load_data, names)
+            self._install_data(loaded)
+            self.cache.clear()
+            self.drop_head_results(f"reloaded {', '.join(names)}")
+            return names
+
+    def share_reloads(self, path):
+        """
+        Makes forced reloads reach the other worker processes sharing path.
+        force_reload appends a line to the file, and watch_data_files reloads
+        all data files when the file has grown since the last check
+        """
+        self.reload_file = path
+        self.reload_generation = reload_generation(path)
+
+    async def force_reload(self):
+        """ Reloads all data files, and has the workers sharing the reload file do the same """
+        if self.reload_file is not None:
+            write_lines(self.reload_file, [""])
+            self.reload_generation = reload_generation(self.reload_file)
+        return await self.reload_data(force=True)
+
+    async def watch_data_files(self):
+        """
+        Reloads modified data files, or all of them if another worker forced a
+        reload. Failures are logged and the current data is kept
+        """
+        try:
+            force = False
+            if self.reload_file is not None:
+                generation = reload_generation(self.reload_file)
+                force = generation != self.reload_generation
+                self.reload_generation = generation
+            await self.reload_data(force=force)
+        except Exception:
+            logger.exception("Reloading data files failed")
+
+    async def refresh_index_version(self):
+        """ Clears the result cache if the solr index of a replica has changed since last check """
+        versions = await self.solr.index_versions()
+        if not versions:
+            logger.warning("Failed to fetch the index version of every solr replica")
+            return
+        changed = [url for url, version in versions.items()
+                   if url in self.index_versions and version != self.index_versions[url]]
+        for url in changed:
+            logger.info(f"Solr index version of {url} changed from {self.index_versions[url]} to {versions[url]}")
+        self.index_versions.update(versions)
+        self.index_version = self.index_versions.get(self.solr_urls[0])
+        if changed:
+            logger.info("Clearing result cache")
+            self.cache.clear()
+            self.index_generation += 1
+        if not self.head_results:
+            return
+        if self.head_results_replica is None:
+            matching = [url for url, version in versions.items() if version == self.head_results_version]
+            if matching:
+                self.head_results_replica = matching[0]
+            elif len(versions) == len(self.solr_urls):
+                self.drop_head_results(f"no solr replica has the snapshot index version {self.head_results_version}")
+        elif self.head_results_replica in changed:
+            self.drop_head_results(f"the index of {self.head_results_replica} changed from the snapshot version {self.head_results_version}")
+
+    def status(self):
+        """ Runtime counters reported on /status """
+        return {"cache": dict(self.cache.stats(), index_versions=self.index_versions),
+                "coalescing": self.in_flight.stats(),
+                "admission": self.admission.stats(),
+                "solr": self.solr.stats(),
+                "query_log": self.query_log.stats() if self.query_log is not None else None,
+                "data_versions": self.data_versions,
+                "head_results": {"size": len(self.head_results),
+                                 "index_version": self.head_results_version,
+                                 "replica": self.head_results_replica,
+                                 "hits": self.head_hits}}
+
+    def suggest(self, prefix, k=10):
+        """ Returns up to k searches starting with prefix, ranked by smartsearch click counts """
+        smartsearch = self.smartsearch
+        if smartsearch is None:
+            return []
+        if self.suggestions_source is not smartsearch:
+            # Built from the content SmartSearch loaded, and again once it is reloaded
+            self.suggestions = PrefixIndex.from_smartsearch_content(smartsearch.data)
+            self.suggestions_source = smartsearch
+        return [{"query": query, "count": count} for query, count in self.suggestions.suggest(prefix, k)]
+
+    async def search(self, phrase, debug=False, *, options: dict = {}, rows=10, start=0, fields=None, deadline=None):
+        page = await self.search_page(phrase, debug, options=options, rows=rows, start=start, fields=fields, deadline=deadline)
+        return page.result
+
+    async def search_cursor(self, phrase, debug=False, *, options: dict = {}, rows=10, cursor=CURSOR_START, fields=None, deadline=None,
+                            cache=True):
+        """
+        Searches one page using solr cursor pagination. The cost of a page does
+        not grow with its depth, unlike paging with start.
+
+        Returns the result and the cursor for the next page, which is None when
+        there are no more results
+
+        :param cursor:
+            cursor returned with the previous page, or CURSOR_START for the first page
+        """
+        page = await self.search_page(phrase, debug, options=options, rows=rows, cursor=cursor, fields=fields, deadline=deadline,
+                                      cache=cache)
+        return page.result, page.next_cursor
+
+    async def search_page(self, phrase, debug=False, *, options: dict = {}, rows=10, start=0, cursor=None, fields=None, deadline=None,
+                          explain=False, cache=True):
+        """
+        Searches one page, paged with start, or with cursor pagination when
+        cursor is given. Returns a SearchPage
+
+        Debug searches bypass the caches, and their page has the time spent
+        in each stage of the search, and in each solr search component
+
+        :param deadline:
+            time.monotonic() time the search must be answered by. It is sent
+            to solr as timeAllowed, and the page is marked partial if solr
+            ran out of time. Raises DeadlineExceeded if no answer is possible
+        :param explain:
+            include the solr score explanation of the top hits in the timing of debug searches
+        :param cache:
+            if false, the page is neither looked up in nor added to the result cache, nor coalesced
+        """
+        cursor_mark = None
+        if cursor is not None:
+            cursor_mark = decode_cursor(cursor)
+            start = 0
+        (result, next_cursor_mark, partial), timing = await self._cached_search(phrase, debug, options, rows, fields, start=start,
+                                                                                cursor_mark=cursor_mark, deadline=deadline, explain=explain,
+                                                                                cache=cache)
+        next_cursor = None
+        if cursor_mark is not None and next_cursor_mark != cursor_mark:
+            next_cursor = encode_cursor(next_cursor_mark)
+        return SearchPage(result, next_cursor, partial, timing)
+
+    async def search_stream(self, phrase, debug=False, *, options: dict = {}, rows=10, fields=None, page_size=500):
+        """
+        Yields the results of a search in lists of at most page_size results,
+        fetched from solr one page at a time using cursor pagination, so large
+        results can be written as they arrive. The pages bypass the result
+        cache, which is bounded by the number of results, not their size
+        """
+        cursor = CURSOR_START
+        remaining = rows
+        while remaining > 0 and cursor is not None:
+            docs, cursor = await self.search_cursor(phrase, debug, options=options,
+                                                    rows=min(page_size, remaining), cursor=cursor, fields=fields, cache=False)
+            if not docs:
+                break
+            remaining -= len(docs)
+            yield docs
+
+    async def _cached_search(self, phrase, debug, options, rows, fields, start=0, cursor_mark=None, deadline=None, explain=False,
+                             cache=True):
+        """ Returns the result of a search, and the timing of debug searches """
+        timer = StageTimer(SEARCH_STAGE_SECONDS)
         query = phrase.strip()
+        raw_options = options
         options = parse_options(options)
-        logger.info(f"search options {options}")
+        fields = parse_fields(fields)
+        timer.lap("parse_options")
+
+        cache_key = search_key(query, options, rows, start, debug, cursor_mark, fields)
+        solr_info = None
+        # Debug searches are for seeing what a search costs, so the timing must be of this search
+        if debug or not cache:
+            cache_outcome = "bypass"
+            result, solr_info = await self._search(None, query, options, debug, rows, start, cursor_mark, fields, deadline, explain)
+        else:
+            cache_outcome = "head"
+            # The snapshot is only used once a replica is known to have its index version
+            result = self.head_results.get(cache_key) if self.head_results_replica is not None else None
+            if result is None:
+                cache_outcome = "hit"
+                result = self.cache.get(cache_key)
+            else:
+                self.head_hits += 1
+            timer.lap("cache")
+        if result is None:
+            cache_outcome = "miss"
+            # Identical searches arriving while this one is in flight share its solr call,
+            # and its deadline
+            result, solr_info = await self.in_flight.do(cache_key, self._search, cache_key, query, options, debug, rows, start, cursor_mark, fields, deadline)
+        latency = timer.elapsed()
+        SEARCH_SECONDS.observe(latency,
+                               smartsearch=bool(options.smartsearch),
+                               curated_search=options.curated_search,
+                               synonyms=options.synonyms,
+                               phonetic=bool(options.phonetic_creator_contributor),
+                               cache=cache_outcome)
+        if self.query_log is not None:
+            self.query_log.log({"time": round(time.time(), 3),
+                                "q": query,
+                                "options": raw_options or {},
+                                "rows": rows,
+                                "start": start,
+                                "cursor": encode_cursor(cursor_mark) if cursor_mark is not None else None,
+                                "fields": sorted(fields) if fields is not None else None,
+                                "debug": debug,
+                                "results": len(result[0]),
+                                "partial": result[2],
+                                "latency": round(latency, 6),
+                                "qtime": solr_info["qtime"] if solr_info else None,
+                                "cache": cache_outcome},
+                               solr_info["params"] if solr_info else None)
+        timing = None
+        if debug:
+            timing = dict(solr_info["timing"],
+                          total=latency,
+                          # Time spent in this service and on the network
+                          outside_solr=latency - solr_info["qtime"] / 1000,
+                          stages=dict(timer.laps, **solr_info["stages"]))
+        return result, timing
+
+    async def _search(self, cache_key, query, options, debug, rows, start, cursor_mark, fields, deadline, explain=False):
+        """ Searches solr. The result is added to the cache under cache_key, unless it is None """
+        timer = StageTimer(SEARCH_STAGE_SECONDS)
+        index_generation = self.index_generation
 
         smartsearch = None
         if options.smartsearch:
@@ -88,6 +458,7 @@ class Searcher(object):
             if smartsearch_workids:
                 smartsearch = SmartSearchData("(" + " OR ".join([f'workid:"{w}"' for w in smartsearch_workids]) + ") OR ",
                                               create_bf(smartsearch_workids))
+            timer.lap("smartsearch")
 
         params = {
             "defType": "edismax",
@@ -97,7 +468,10 @@ class Searcher(object):
                 "years_since_publication:[0 TO 10]^5",
                 "language:dan^5",
             ],
-            "fl": "pids,title,creator,contributor,workid,work_type,language,pid_to_type_map,score",
+            # pid_details is stored as ready-to-serve json by the indexers. The [json]
+            # transformer makes solr embed it in the response as is. pid_to_type_map is
+            # the fallback for documents indexed without it
+            "fl": "pids,title,creator,contributor,workid,work_type,language,pid_details:[json],pid_to_type_map,score",
             "sort": "score desc",
             # Submitting multiple values can be achived by specifying lists.
             # "boost": ["holdings", "popularity"] will result in &boost=holdings&boost=popularity
@@ -113,26 +487,181 @@ class Searcher(object):
         if smartsearch:
             params['bf'] = smartsearch.bf
 
-        debug_fields = ["title_alternative", "creator", "workid", "contributor", "work_type"]
+        if fields is not None:
+            # In the order of RESULT_FIELDS, as fields is a set and the solr parameters must be stable
+            solr_fields = [f for field in RESULT_FIELDS if field in fields for f in RESULT_FIELDS[field]]
+            params['fl'] = ",".join(solr_fields + (DEBUG_FIELDS if debug else []))
+
+        if debug:
+            # Makes solr report the time spent in each search component, and with results, explain the scores
+            params['debug'] = ["timing", "results"] if explain else "timing"
+
+        if cursor_mark is not None:
+            # Cursors require a sort with a unique tiebreak and start at 0
+            params['sort'] = "score desc,workid asc"
+            params['start'] = 0
+            params['cursorMark'] = cursor_mark
+
         include_fields = ["pids", "title", "language"]
+        include_pid_details = True
+        if fields is not None:
+            include_fields = [f for f in include_fields if f in fields]
+            include_pid_details = "pid_details" in fields
 
         if options.curated_search:
             retain = {'defType': params['defType'], 'fl': params['fl'], 'sort': params['sort'], 'start': params['start'], 'rows': params['rows']}
-            if 'bf' in params:
-                retain['bf'] = params['bf']
+            for key in ['bf', 'cursorMark', 'debug']:
+                if key in params:
+                    retain[key] = params[key]
             query, params = self.curated_search(query)
 
             params.update(retain)
+            timer.lap("curated_search")
 
         if smartsearch:
             query = smartsearch.query + query
-        for doc in self.solr.search(query, **params):
-            result_doc = {f: doc[f] for f in include_fields if f in doc}
+        timer.lap("build_params")
+        async with self.admission.slot(deadline):
+            timer.lap("admission")
+            try:
+                response = await self._select(query, params, deadline)
+            except HTTPClientError as e:
+                # Solr rejects cursor marks it did not issue, such as forged cursors
+                if cursor_mark is None or not 400 <= e.code < 500:
+                    raise
+                raise InvalidSearchParameter(f"Invalid cursor {encode_cursor(cursor_mark)!r}: solr answered {e.code}") from e
+        timer.lap("solr")
+        SOLR_QTIME_SECONDS.observe(response["responseHeader"]["QTime"] / 1000)
+        partial = bool(response["responseHeader"].get("partialResults", False))
+        if partial:
+            DEADLINE_MISSES.inc(reason="partial")
+        result = build_result(response["response"]["docs"], include_fields, include_pid_details, debug)
+        result = (result, response.get("nextCursorMark"), partial)
+        # Results fetched while the index changed may be stale
+        if cache_key is not None and index_generation == self.index_generation and not partial:
+            self.cache.put(cache_key, result)
+        timer.lap("postprocess")
+        # Not cached, as it describes this solr call only
+        solr_info = {"qtime": response["responseHeader"]["QTime"], "params": dict(params, q=query)}
+        if debug:
+            solr_info["timing"] = solr_timing(response, explain)
+            solr_info["stages"] = timer.laps
+        return result, solr_info
+
+    async def _select(self, query, params, deadline):
+        """ Queries solr, limiting the search time to what is left until deadline """
+        if deadline is None:
+            return await self.solr.select(query, **params)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            DEADLINE_MISSES.inc(reason="expired")
+            raise DeadlineExceeded("deadline expired before the search was sent to solr")
+        try:
+            return await self.solr.select(query, timeout=remaining + DEADLINE_GRACE,
+                                          timeAllowed=max(1, int(remaining * 1000)), **params)
+        except HTTPClientError as e:
+            # 599 is also used for connection errors
+            if e.code != 599 or time.monotonic() < deadline:
+                raise
+            DEADLINE_MISSES.inc(reason="timeout")
+            raise DeadlineExceeded(f"solr did not answer within the deadline: {e}") from e
+
+    async def search_batch(self, requests, max_concurrency=8):
+        """
+        Performs the searches in requests concurrently, with at most
+        max_concurrency searches in flight, and returns a list with a
+        {"result": [...]} or {"error": "..."} entry for each request, in order
+
+        :param requests:
+            list of dicts with the keys q, and optionally debug, options, rows, start and fields
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def search_one(request):
+            if not isinstance(request.get("q"), str):
+                return {"error": "missing parameter 'q'" if "q" not in request else "q must be a string"}
+            async with semaphore:
+                try:
+                    return {"result": await self.search(request["q"], request.get("debug", False),
+                                                        options=request.get("options", {}),
+                                                        rows=request.get("rows", 10),
+                                                        start=request.get("start", 0),
+                                                        fields=request.get("fields"))}
+                except InvalidSearchParameter as e:
+                    return {"error": str(e)}
+                except Exception as e:
+                    logger.exception(f"Batch search failed for {request}")
+                    return {"error": str(e)}
+        return await asyncio.gather(*[search_one(request) for request in requests])
+
+
+def reload_generation(path):
+    """ Returns the number of forced reloads recorded in a reload file """
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def search_key(query, options, rows, start, debug, cursor_mark=None, fields=None):
+    """ Key identifying the results of a search, for caching """
+    return (query.strip(), options, rows, start, debug, cursor_mark, fields)
+
+
+def encode_cursor(cursor_mark):
+    """ Wraps a solr cursorMark in the opaque cursor handed to clients """
+    return base64.urlsafe_b64encode(cursor_mark.encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """ Returns the solr cursorMark of a cursor. Raises InvalidSearchParameter for invalid cursors """
+    if cursor == CURSOR_START:
+        return "*"
+    try:
+        return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf8")
+    except (AttributeError, UnicodeError, binascii.Error):
+        raise InvalidSearchParameter(f"Invalid cursor {cursor!r}")
+
+
+def parse_fields(fields):
+    """
+    Validates the response fields selected by a client. Returns None, meaning
+    all fields, if fields is empty
+    """
+    if not fields:
+        return None
+    if not isinstance(fields, (list, tuple, set, frozenset)) or not all(f in RESULT_FIELDS for f in fields):
+        raise InvalidSearchParameter(f"fields must be a list of fields among {', '.join(RESULT_FIELDS)}")
+    return frozenset(fields)
+
+
+def solr_timing(response, explain=False):
+    """
+    Returns the times solr reports for a debug search, in milliseconds as
+    reported, and optionally the score explanation of the top hits
+    """
+    debug = response.get("debug", {})
+    timing = {"solr": {"qtime": response["responseHeader"]["QTime"],
+                       "components": debug.get("timing")}}
+    if explain:
+        timing["explain"] = dict(list(debug.get("explain", {}).items())[:EXPLAIN_HITS])
+    return timing
+
+
+def build_result(docs, include_fields, include_pid_details, debug):
+    """ Builds the result of a search from the solr documents """
+    result = []
+    for doc in docs:
+        result_doc = {f: doc[f] for f in include_fields if f in doc}
+        if include_pid_details and "pid_details" in doc:
+            result_doc["pid_details"] = doc["pid_details"]
+        elif include_pid_details:
             result_doc["pid_details"] = parse_pid_to_type_map(doc["pid_to_type_map"])
-            if debug:
-                debug_object = {f: doc[f] for f in debug_fields if f in doc}
-                result_doc["debug"] = debug_object
-            yield result_doc
+        if debug:
+            debug_object = {f: doc[f] for f in DEBUG_FIELDS if f in doc}
+            result_doc["debug"] = debug_object
+        result.append(result_doc)
+    return result
 
 
 def parse_pid_to_type_map(content):
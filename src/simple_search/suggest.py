@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+:mod:`simple_search.suggest` -- type-ahead suggestions
+
+=======
+suggest
+=======
+
+In-memory prefix index over the searches users actually make, as found in
+the smartsearch click data, ranked by their click counts.
+
+"""
+from array import array
+from bisect import bisect_left
+import heapq
+from itertools import groupby
+
+from simple_search.cache import LRUCache
+from simple_search.smartsearch_store import SmartSearchStore
+
+# Prefix ranges larger than this have their top suggestions memoized
+MEMO_THRESHOLD = 256
+
+
+def normalize(query):
+    return " ".join(query.lower().split())
+
+
+class PrefixIndex():
+    """
+    Sorted array of normalized queries with click counts. The top
+    suggestions of short prefixes are precomputed, and those of other
+    prefixes matching many queries are memoized, so answers do not scan
+    large ranges
+    """
+    def __init__(self, weighted_queries, max_k=10, precompute_length=2):
+        """
+        Builds index
+
+        :param weighted_queries:
+            iterable of (query, count)
+        :param max_k:
+            max number of suggestions returned
+        :param precompute_length:
+            suggestions are precomputed for all prefixes up to this length
+        """
+        # normalized query -> [total count, most clicked spelling, its count]
+        merged = {}
+        for query, count in weighted_queries:
+            key = normalize(query)
+            if not key:
+                continue
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [count, query.strip(), count]
+            else:
+                entry[0] += count
+                if count > entry[2]:
+                    entry[1:] = [query.strip(), count]
+        self.keys = sorted(merged)
+        self.counts = array("q", (merged[k][0] for k in self.keys))
+        self.display = [merged[k][1] for k in self.keys]
+        self.max_k = max_k
+        self._top = {}
+        for length in range(1, precompute_length + 1):
+            position = 0
+            for prefix, group in groupby(self.keys, key=lambda k: k[:length]):
+                size = sum(1 for _ in group)
+                if len(prefix) == length:
+                    self._top[prefix] = self._top_in_range(position, position + size)
+                position += size
+        self._memo = LRUCache(maxsize=10000, ttl=float("inf"))
+
+    @classmethod
+    def from_smartsearch_content(cls, content, **kwargs):
+        """ Builds index from smartsearch content, mapping queries to lists of [workid, count] """
+        if isinstance(content, SmartSearchStore):
+            return cls(((content.query(i), content.total_count(i)) for i in range(len(content))), **kwargs)
+        return cls(((query, sum(count for _, count in hits)) for query, hits in content.items()), **kwargs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _top_in_range(self, lo, hi):
+        return heapq.nlargest(self.max_k, range(lo, hi), key=self.counts.__getitem__)
+
+    def suggest(self, prefix, k=10):
+        """ Returns up to k (query, count) pairs starting with prefix, most clicked first """
+        prefix = normalize(prefix)
+        if not prefix or k <= 0:
+            return []
+        top = self._top.get(prefix)
+        if top is None:
+            top = self._memo.get(prefix, count=False)
+        if top is None:
+            lo = bisect_left(self.keys, prefix)
+            hi = bisect_left(self.keys, prefix + "\U0010ffff", lo)
+            top = self._top_in_range(lo, hi)
+            if hi - lo > MEMO_THRESHOLD:
+                self._memo.put(prefix, top)
+        return [(self.display[i], self.counts[i]) for i in top[:k]]
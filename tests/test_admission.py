@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+import unittest
+
+from simple_search.admission import AdmissionControl, Overloaded
+
+
+class AdmissionControlTest(unittest.TestCase):
+    def run_calls(self, admission, n, duration=0.05):
+        async def call():
+            async with admission.slot():
+                await asyncio.sleep(duration)
+                return True
+
+        async def run():
+            return await asyncio.gather(*[call() for _ in range(n)], return_exceptions=True)
+        return asyncio.run(run())
+
+    def test_queued_calls_are_admitted(self):
+        admission = AdmissionControl(max_concurrency=2, max_queue=2, queue_timeout=1.0)
+        results = self.run_calls(admission, 4)
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(admission.stats()["admitted"], 4)
+        self.assertEqual(admission.stats()["in_flight"], 0)
+
+    def test_rejects_when_queue_is_full(self):
+        admission = AdmissionControl(max_concurrency=2, max_queue=1, queue_timeout=1.0)
+        results = self.run_calls(admission, 5)
+        self.assertEqual(results[:3], [True] * 3)
+        self.assertTrue(all(isinstance(r, Overloaded) for r in results[3:]))
+        self.assertEqual(admission.stats()["rejected"], 2)
+
+    def test_rejects_after_queue_timeout(self):
+        admission = AdmissionControl(max_concurrency=1, max_queue=10, queue_timeout=0.01)
+        start = time.monotonic()
+        results = self.run_calls(admission, 2, duration=0.2)
+        self.assertIs(results[0], True)
+        self.assertIsInstance(results[1], Overloaded)
+        self.assertEqual(admission.stats()["waiting"], 0)
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_deadline_limits_queue_wait(self):
+        admission = AdmissionControl(max_concurrency=1, max_queue=10, queue_timeout=10.0)
+
+        async def run():
+            async with admission.slot():
+                with self.assertRaises(Overloaded):
+                    await admission.acquire(deadline=time.monotonic() + 0.01)
+        asyncio.run(run())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import gzip
+import http.server
+import json
+import threading
+import time
+import unittest
+import unittest.mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from simple_search.solr import bulk_writer
+from simple_search.solr.bulk_writer import SolrBulkWriter, encode_documents
+
+
+class StandInUpdateHandler():
+    """ Local http server taking solr update requests, failing the first ones with a given status """
+    def __init__(self, failures=0, status=503, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.batches = []
+        self.params = []
+        self.encodings = set()
+        self.commits = 0
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(stand_in.delay)
+                with lock:
+                    failing = stand_in.failures > 0
+                    stand_in.failures -= 1
+                if failing:
+                    return self.answer(status)
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                with lock:
+                    stand_in.encodings.add(self.headers.get("Content-Encoding"))
+                    stand_in.batches.append(json.loads(body))
+                    stand_in.params.append(parse_qs(urlparse(self.path).query))
+                self.answer(200)
+
+            def do_GET(self):
+                stand_in.commits += 1
+                self.answer(200)
+
+            def answer(self, code):
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"responseHeader": {"status": 0}}')
+
+            def log_message(self, *args):
+                pass
+
+        lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/solr/collection/"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def documents(n):
+    return ({"workid": f"work-of:{i}", "pids": [str(i)], "holdings": 1.0} for i in range(n))
+
+
+class EncodeDocumentsTest(unittest.TestCase):
+    def test_encoders_agree(self):
+        docs = list(documents(3)) + [{"title": ["æøå"], "n_pids": 1.5}]
+        encoded = encode_documents(docs)
+        with unittest.mock.patch.object(bulk_writer, "orjson", None):
+            self.assertEqual(json.loads(encode_documents(docs)), json.loads(encoded))
+        self.assertEqual(json.loads(encoded), docs)
+
+
+class SolrBulkWriterTest(unittest.TestCase):
+    def writer(self, stand_in, **kwargs):
+        writer = SolrBulkWriter(stand_in.url, **dict({"num_threads": 3, "batch_size": 100, "backoff": 0.001}, **kwargs))
+        self.addCleanup(writer.close)
+        self.addCleanup(stand_in.stop)
+        return writer
+
+    def test_indexes_all_documents(self):
+        stand_in = StandInUpdateHandler()
+        writer = self.writer(stand_in, commit_within=5000)
+        stats = writer.index(documents(1050))
+        writer.commit()
+        indexed = [doc["workid"] for batch in stand_in.batches for doc in batch]
+        self.assertEqual(sorted(indexed), sorted(doc["workid"] for doc in documents(1050)))
+        self.assertEqual(stats["documents"], 1050)
+        self.assertEqual(stats["batches"], len(stand_in.batches))
+        self.assertEqual({p["commitWithin"][0] for p in stand_in.params}, {"5000"})
+        self.assertEqual(stand_in.commits, 1)
+
+    def test_compressed_batches(self):
+        stand_in = StandInUpdateHandler()
+        self.writer(stand_in, compress=True).index(documents(200))
+        self.assertEqual(stand_in.encodings, {"gzip"})
+        self.assertEqual(sum(len(batch) for batch in stand_in.batches), 200)
+
+    def test_retries_server_errors(self):
+        stand_in = StandInUpdateHandler(failures=2, status=503)
+        stats = self.writer(stand_in, num_threads=1).index(documents(300))
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(sum(len(batch) for batch in stand_in.batches), 300)
+
+    def test_gives_up_after_max_retries(self):
+        stand_in = StandInUpdateHandler(failures=10, status=500)
+        with self.assertRaises(Exception):
+            self.writer(stand_in, num_threads=1, max_retries=2).index(documents(300))
+
+    def test_client_errors_are_not_retried(self):
+        stand_in = StandInUpdateHandler(failures=1, status=400)
+        with self.assertRaises(requests.HTTPError):
+            self.writer(stand_in, num_threads=1).index(documents(300))
+        self.assertEqual(stand_in.batches, [])
+
+    def test_batch_size_follows_latency(self):
+        stand_in = StandInUpdateHandler()
+        fast = self.writer(stand_in, num_threads=1, target_batch_seconds=10.0, max_batch_size=400)
+        fast.index(documents(2000))
+        self.assertEqual(fast.batch_size, 400)
+
+        slow_stand_in = StandInUpdateHandler(delay=0.02)
+        slow = self.writer(slow_stand_in, num_threads=1, target_batch_seconds=0.002, min_batch_size=10)
+        slow.index(documents(600))
+        self.assertLess(slow.batch_size, 100)
+        # Up to four batches are built ahead of the first answer, with the first size
+        self.assertTrue(all(len(batch) < 100 for batch in slow_stand_in.batches[4:]))
+        self.assertGreater(len(slow_stand_in.batches), 6)
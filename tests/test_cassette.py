@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+import tornado.httpserver
+import tornado.testing
+from tornado.httpclient import HTTPClientError
+
+from simple_search.solr.cassette import Cassette, make_recording_app, make_replay_app
+from simple_search.solr.client import AsyncSolr
+from simple_search.solr.fake_solr import Latency, make_app
+
+
+def serve(app):
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets([sock])
+    return server, f"http://127.0.0.1:{port}"
+
+
+class CassetteTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".ndjson")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_record_and_replay(self):
+        async def record():
+            solr_server, solr_url = serve(make_app(Latency(0.02)))
+            proxy_server, proxy_url = serve(make_recording_app(solr_url + "/solr/simple-search", Cassette(self.path)))
+            solr = AsyncSolr(proxy_url)
+            try:
+                return await solr.select("hest", rows=3, timeAllowed=500), await solr.index_version()
+            finally:
+                solr.close()
+                proxy_server.stop()
+                solr_server.stop()
+
+        async def replay():
+            server, url = serve(make_replay_app(Cassette.load(self.path)))
+            solr = AsyncSolr(url)
+            try:
+                replayed = await solr.select("hest", rows=3, timeAllowed=100), await solr.index_version()
+                with self.assertRaises(HTTPClientError) as context:
+                    await solr.select("hest", rows=4)
+                self.assertEqual(context.exception.code, 404)
+                return replayed
+            finally:
+                solr.close()
+                server.stop()
+
+        recorded = asyncio.run(record())
+        self.assertEqual(len(Cassette.load(self.path)), 2)
+        self.assertEqual(asyncio.run(replay()), recorded)
+        self.assertEqual(len(recorded[0]["response"]["docs"]), 3)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+
+from simple_search.covers import CoverLookup
+
+
+class CoverLookupTest(unittest.TestCase):
+    def test_batches_and_caches_lookups(self):
+        requested = []
+
+        def cover_func(pids, fields):
+            requested.append(list(pids))
+            return {"p1": {"coverUrlFull": ["http://covers/p1.jpg"]}}
+
+        async def run():
+            lookup = CoverLookup(cover_func)
+            first = await lookup.urls(["p1", "p2", "p1"])
+            second = await lookup.urls(["p1", "p2"])
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, {"p1": "http://covers/p1.jpg"})
+        self.assertEqual(second, first)
+        self.assertEqual(requested, [["p1", "p2"]])
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+
+import tornado.httpserver
+import tornado.testing
+
+from simple_search.loadtest import percentile, run_load
+from simple_search.solr.fake_solr import Latency, make_app
+
+
+class LoadTestTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 1001))
+        self.assertEqual(percentile(values, 50), 500)
+        self.assertEqual(percentile(values, 99), 990)
+        self.assertEqual(percentile(values, 99.9), 999)
+        self.assertEqual(percentile([7], 99.9), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_run_load_against_fake_solr(self):
+        async def run():
+            sock, port = tornado.testing.bind_unused_port()
+            server = tornado.httpserver.HTTPServer(make_app(Latency(median=0.02)))
+            server.add_sockets([sock])
+            try:
+                return await run_load(f"http://127.0.0.1:{port}/solr/simple-search/select", [{"q": "hest"}, {"q": "ko"}],
+                                      rate=200, num_requests=40)
+            finally:
+                server.stop()
+
+        summary = asyncio.run(run())
+        self.assertEqual(summary["ok"], 40)
+        self.assertEqual(summary["statuses"], {"200": 40})
+        self.assertGreaterEqual(summary["latency"]["p50"], 0.02)
+        # Requests are sent on schedule, not after the previous one is answered
+        self.assertLess(summary["elapsed"], 40 * 0.02)
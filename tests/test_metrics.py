@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import tempfile
+import unittest
+
+from simple_search.metrics import Counter, Gauge, Histogram, MultiProcessCollector, Registry
+
+
+def worker_metrics():
+    """ Returns a registry with the metrics of a worker """
+    registry = Registry()
+    return (registry,
+            Counter("searches_total", "Searches", ["handler"], registry=registry),
+            Gauge("in_flight", "Searches in flight", registry=registry),
+            Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=registry))
+
+
+def run_exited_worker(directory):
+    registry, counter, gauge, histogram = worker_metrics()
+    counter.inc(2, handler="search")
+    gauge.set(5)
+    histogram.observe(0.5)
+    MultiProcessCollector(directory, 1, registry).dump()
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram_render(self):
+        registry = Registry()
+        histogram = Histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0), registry=registry)
+        histogram.observe(0.05, stage="solr")
+        histogram.observe(0.1, stage="solr")
+        histogram.observe(2, stage="solr")
+        self.assertEqual(histogram.count(stage="solr"), 3)
+        self.assertEqual(registry.render().splitlines(), [
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{stage="solr",le="0.1"} 2',
+            'latency_seconds_bucket{stage="solr",le="1.0"} 2',
+            'latency_seconds_bucket{stage="solr",le="+Inf"} 3',
+            'latency_seconds_sum{stage="solr"} 2.15',
+            'latency_seconds_count{stage="solr"} 3',
+        ])
+
+    def test_counter_labels(self):
+        registry = Registry()
+        counter = Counter("searches_total", "Searches", ["smartsearch"], registry=registry)
+        counter.inc(smartsearch=True)
+        counter.inc(2, smartsearch=True)
+        self.assertEqual(counter.get(smartsearch=True), 3)
+        self.assertIn('searches_total{smartsearch="True"} 3.0', registry.render())
+
+
+class MultiProcessCollectorTest(unittest.TestCase):
+    def test_metrics_of_all_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # A worker which dumped its metrics and exited
+            worker = multiprocessing.get_context("fork").Process(target=run_exited_worker, args=(directory,))
+            worker.start()
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+            registry, counter, gauge, histogram = worker_metrics()
+            counter.inc(3, handler="search")
+            counter.inc(handler="batch")
+            gauge.set(2)
+            histogram.observe(0.05)
+            lines = MultiProcessCollector(directory, 0, registry).render().splitlines()
+
+        # Counters and histograms keep the counts of the exited worker
+        self.assertIn('searches_total{handler="search"} 5.0', lines)
+        self.assertIn('searches_total{handler="batch"} 1.0', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_count 2', lines)
+        # Gauges are reported for the live workers only
+        self.assertEqual([line for line in lines if line.startswith("in_flight")], ['in_flight{worker="0"} 2.0'])
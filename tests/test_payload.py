@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import os
+import unittest
+
+import tornado.testing
+import tornado.web
+
+os.environ.setdefault("AUTHKEYMAP", json.dumps({"test": "test-token"}))
+
+from simple_search.payload import Payload, PayloadHandler, StaticPayloadHandler, accepts_encoding
+from simple_search.service import GZipContentEncoding
+
+
+class AcceptsEncodingTest(unittest.TestCase):
+    def test_qvalues(self):
+        self.assertTrue(accepts_encoding("gzip", "gzip"))
+        self.assertTrue(accepts_encoding("deflate, GZIP;q=0.5", "gzip"))
+        self.assertTrue(accepts_encoding("*", "gzip"))
+        self.assertFalse(accepts_encoding("", "gzip"))
+        self.assertFalse(accepts_encoding("gzip;q=0", "gzip"))
+        self.assertFalse(accepts_encoding("gzip; q=0.0, *", "gzip"))
+        self.assertFalse(accepts_encoding("x-gzip", "gzip"))
+
+
+class PayloadHandlerTest(tornado.testing.AsyncHTTPTestCase):
+    # Long enough for the gzip transform of the service to compress it, unless the handler did
+    BODY = "<html>" + "hest " * 500 + "</html>"
+
+    def get_app(self):
+        self.page = Payload(self.BODY, "text/html; charset=UTF-8")
+        self.static = {"css/style.css": Payload("body { color: black }", "text/css")}
+        return tornado.web.Application([
+            ("/", PayloadHandler, {"payload": self.page}),
+            ("/static/(.*)", StaticPayloadHandler, {"payloads": self.static}),
+        ], transforms=[GZipContentEncoding])
+
+    def get(self, path, method="GET", **headers):
+        return self.fetch(path, method=method, headers=headers, decompress_response=False)
+
+    def test_strong_etag_and_not_modified(self):
+        response = self.get("/")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, self.BODY.encode("utf8"))
+        self.assertEqual(response.headers["ETag"], self.page.etag)
+        self.assertFalse(response.headers["ETag"].startswith("W/"))
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+        response = self.get("/", **{"If-None-Match": self.page.etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b"")
+
+    def test_gzip_variant_has_its_own_etag(self):
+        response = self.get("/", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["ETag"], self.page.gzip_etag)
+        self.assertNotEqual(self.page.gzip_etag, self.page.etag)
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.body), self.BODY.encode("utf8"))
+
+        self.assertEqual(self.get("/", **{"Accept-Encoding": "gzip", "If-None-Match": self.page.gzip_etag}).code, 304)
+        # The ETag of the identity variant does not match the gzip variant
+        self.assertEqual(self.get("/", **{"Accept-Encoding": "gzip", "If-None-Match": self.page.etag}).code, 200)
+
+    def test_gzip_with_zero_qvalue_is_not_used(self):
+        response = self.get("/", **{"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers["ETag"], self.page.etag)
+        self.assertEqual(response.body, self.BODY.encode("utf8"))
+
+    def test_head_content_length(self):
+        response = self.get("/", method="HEAD")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b"")
+        self.assertEqual(int(response.headers["Content-Length"]), len(self.page.body))
+
+        response = self.get("/", method="HEAD", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(int(response.headers["Content-Length"]), len(self.page.gzip_body))
+        self.assertEqual(response.headers["ETag"], self.page.gzip_etag)
+
+    def test_static_payloads(self):
+        response = self.get("/static/css/style.css")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Type"], "text/css")
+        self.assertEqual(response.body, b"body { color: black }")
+        self.assertEqual(self.get("/static/css/missing.css").code, 404)
+        self.assertEqual(self.get("/static/css/missing.css", method="HEAD").code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+from simple_search.pipeline import run_pipeline
+
+
+class PipelineTest(unittest.TestCase):
+    def test_consumes_all_items(self):
+        consumed = []
+        lock = threading.Lock()
+
+        def consume(item):
+            with lock:
+                consumed.append(item)
+        stats = run_pipeline(range(100), consume, num_workers=4)
+        self.assertEqual(sorted(consumed), list(range(100)))
+        self.assertEqual(stats.items, 100)
+
+    def test_producer_is_bounded(self):
+        produced = []
+        ahead = []
+
+        def items():
+            for i in range(50):
+                produced.append(i)
+                yield i
+
+        def consume(item):
+            time.sleep(0.001)
+            ahead.append(len(produced) - item)
+        run_pipeline(items(), consume, num_workers=2, max_pending=3)
+        # At most the queued items, those taken by the workers meanwhile, and the one being put
+        self.assertLessEqual(max(ahead), 3 + 2 * 2 + 1)
+
+    def test_stages_overlap(self):
+        def items():
+            for i in range(10):
+                time.sleep(0.02)
+                yield i
+        start = time.perf_counter()
+        run_pipeline(items(), lambda item: time.sleep(0.02), num_workers=1)
+        # Sequential stages would take 0.4s
+        self.assertLess(time.perf_counter() - start, 0.35)
+
+    def test_consumer_error_stops_pipeline(self):
+        produced = []
+
+        def items():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        def consume(item):
+            if item == 5:
+                raise ValueError("solr said no")
+        with self.assertRaisesRegex(ValueError, "solr said no"):
+            run_pipeline(items(), consume, num_workers=2, max_pending=2)
+        self.assertLess(len(produced), 1000)
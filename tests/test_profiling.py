@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import tempfile
+import time
+import unittest
+
+from simple_search.profiling import ProfilerBusy, RequestProfiler, SharedStackSamples, StackSampler
+
+
+def busy_loop(seconds):
+    end = time.process_time() + seconds
+    total = 0
+    while time.process_time() < end:
+        total += sum(range(100))
+    return total
+
+
+def run_other_worker(directory):
+    sampler = StackSampler()
+    sampler.stacks.update({"main;search": 3, "main;suggest": 1})
+    SharedStackSamples(directory, sampler).dump()
+
+
+class ProfilingTest(unittest.TestCase):
+    def test_request_profile_summary(self):
+        profiler = RequestProfiler()
+        profiler.start()
+        with self.assertRaises(ProfilerBusy):
+            profiler.start()
+        busy_loop(0.05)
+        summary = profiler.stop()
+        self.assertTrue(any(f["function"].startswith("busy_loop ") for f in summary["functions"]))
+        self.assertGreater(summary["total"], 0)
+        # The profiler can be used again once stopped
+        profiler.start()
+        profiler.stop()
+
+    def test_stack_sampler_collapses_stacks(self):
+        sampler = StackSampler(interval=0.001)
+        sampler.start()
+        sampler.start()
+        sampler.stop()
+        busy_loop(0.1)
+        sampler.stop()
+        samples = sampler.samples
+        busy_loop(0.05)
+        self.assertEqual(sampler.samples, samples)
+        self.assertGreater(samples, 10)
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(any("busy_loop (" in line for line in lines))
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        sampler.clear()
+        self.assertEqual(sampler.collapsed(), "")
+
+
+class SharedStackSamplesTest(unittest.TestCase):
+    def test_samples_of_all_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker = multiprocessing.get_context("fork").Process(target=run_other_worker, args=(directory,))
+            worker.start()
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+            sampler = StackSampler()
+            sampler.stacks.update({"main;search": 2, "main;batch": 1})
+            samples = SharedStackSamples(directory, sampler)
+            lines = samples.collapsed().splitlines()
+            # Most sampled first, the order of equal counts depends on the order of the worker files
+            self.assertEqual(lines[0], "main;search 5")
+            self.assertEqual(sorted(lines[1:]), ["main;batch 1", "main;suggest 1"])
+
+            # Samples taken before clearing are left out, in every worker
+            samples.clear()
+            self.assertEqual(samples.collapsed(), "")
+            sampler.stacks.update({"main;search": 1})
+            self.assertEqual(samples.collapsed(), "main;search 1\n")
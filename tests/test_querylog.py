@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+
+from simple_search.querylog import QueryLog
+
+
+def read_records(path):
+    with open(path) as fp:
+        return [json.loads(line) for line in fp]
+
+
+class QueryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "queries.ndjson")
+        self.slow_path = os.path.join(self.directory.name, "slow-queries.ndjson")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sampled_and_slow_records(self):
+        log = QueryLog(self.path, 0.5, self.slow_path, slow_threshold=1.0)
+        draws = iter([0.3, 0.7, 0.9])
+        log.random = lambda: next(draws)
+        log.start()
+        log.log({"q": "hest", "latency": 0.1}, {"q": "hest", "rows": 10})
+        log.log({"q": "ko", "latency": 0.1})
+        log.log({"q": "gris", "latency": 1.5}, {"q": "gris", "rows": 10})
+        log.close()
+        self.assertEqual(read_records(self.path), [{"q": "hest", "latency": 0.1}])
+        self.assertEqual(read_records(self.slow_path), [{"q": "gris", "latency": 1.5, "solr_params": {"q": "gris", "rows": 10}}])
+
+    def test_drops_records_when_writer_falls_behind(self):
+        log = QueryLog(self.path, max_pending=2)
+        for q in ["a", "b", "c"]:
+            log.log({"q": q, "latency": 0.1})
+        self.assertEqual(log.stats(), {"pending": 2, "dropped": 1})
+        log.start()
+        log.close()
+        self.assertEqual([r["q"] for r in read_records(self.path)], ["a", "b"])
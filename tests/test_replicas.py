@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+from simple_search.solr.replicas import ReplicatedSolr
+
+
+class StandInSolr():
+    """ Local http server answering solr select, luke and ping requests after an injected delay """
+    def __init__(self, name, delay=0.0, index_version=1):
+        self.name = name
+        self.delay = delay
+        self.index_version = index_version
+        self.down = False
+        self.requests = 0
+        stand_in = self
+
+        class SelectHandler(tornado.web.RequestHandler):
+            async def post(self):
+                stand_in.requests += 1
+                await asyncio.sleep(stand_in.delay)
+                if stand_in.down:
+                    raise tornado.web.HTTPError(503)
+                self.write({"responseHeader": {"QTime": 1}, "response": {"docs": [{"replica": stand_in.name}]}})
+
+        class PingHandler(tornado.web.RequestHandler):
+            def get(self):
+                if stand_in.down:
+                    raise tornado.web.HTTPError(503)
+                self.write({"status": "OK"})
+
+        class LukeHandler(tornado.web.RequestHandler):
+            def get(self):
+                if stand_in.down:
+                    raise tornado.web.HTTPError(503)
+                self.write({"index": {"version": stand_in.index_version}})
+
+        self.app = tornado.web.Application([("/solr/select", SelectHandler), ("/solr/admin/ping", PingHandler),
+                                            ("/solr/admin/luke", LukeHandler)])
+
+    def start(self):
+        sock, port = tornado.testing.bind_unused_port()
+        self.server = tornado.httpserver.HTTPServer(self.app)
+        self.server.add_sockets([sock])
+        return f"http://127.0.0.1:{port}/solr"
+
+
+class ReplicatedSolrTest(unittest.TestCase):
+    def run_with_replicas(self, stand_ins, test, **kwargs):
+        async def run():
+            solr = ReplicatedSolr([stand_in.start() for stand_in in stand_ins], **kwargs)
+            try:
+                return await test(solr)
+            finally:
+                solr.close()
+                for stand_in in stand_ins:
+                    stand_in.server.stop()
+        return asyncio.run(run())
+
+    def test_routes_to_fastest_replica(self):
+        slow, fast = StandInSolr("slow", delay=0.05), StandInSolr("fast")
+
+        async def test(solr):
+            return [(await solr.search("hest"))[0]["replica"] for _ in range(20)]
+        replicas = self.run_with_replicas([slow, fast], test)
+        self.assertEqual(slow.requests, 1)
+        self.assertEqual(replicas[-10:], ["fast"] * 10)
+
+    def test_fails_over_and_takes_failing_replica_out_of_rotation(self):
+        broken, working = StandInSolr("broken"), StandInSolr("working", delay=0.01)
+        broken.down = True
+
+        async def test(solr):
+            replicas = [(await solr.search("hest"))[0]["replica"] for _ in range(10)]
+            healthy_before = [r.healthy for r in solr.replicas]
+            broken.down = False
+            await solr.check_health()
+            return replicas, healthy_before, [r.healthy for r in solr.replicas], solr.stats()["failovers"]
+        replicas, healthy_before, healthy_after, failovers = self.run_with_replicas([broken, working], test, max_errors=3)
+        self.assertEqual(replicas, ["working"] * 10)
+        self.assertEqual(healthy_before, [False, True])
+        self.assertEqual(healthy_after, [True, True])
+        self.assertEqual(broken.requests, 3)
+        self.assertEqual(failovers, 3)
+
+    def test_hedges_requests_slower_than_p95(self):
+        primary, secondary = StandInSolr("primary", delay=0.005), StandInSolr("secondary", delay=0.03)
+
+        async def test(solr):
+            for _ in range(30):
+                await solr.search("hest")
+            primary.delay, secondary.delay = 1.0, 0.0
+            hedged, hedges_won = solr.hedged, solr.hedges_won
+            docs = await solr.search("hest")
+            return docs, solr.hedged - hedged, solr.hedges_won - hedges_won
+        docs, hedged, hedges_won = self.run_with_replicas([primary, secondary], test, hedge=True)
+        self.assertEqual(docs, [{"replica": "secondary"}])
+        self.assertEqual(hedged, 1)
+        self.assertEqual(hedges_won, 1)
+
+    def test_no_hedging_unless_enabled(self):
+        primary, secondary = StandInSolr("primary", delay=0.005), StandInSolr("secondary", delay=0.03)
+
+        async def test(solr):
+            for _ in range(30):
+                await solr.search("hest")
+            primary.delay = 0.1
+            return await solr.search("hest"), solr.stats()
+        docs, stats = self.run_with_replicas([primary, secondary], test)
+        self.assertEqual(docs, [{"replica": "primary"}])
+        self.assertEqual(stats["hedged"], 0)
+
+    def test_index_versions_of_each_replica(self):
+        first, second, down = StandInSolr("first", index_version=7), StandInSolr("second", index_version=9), StandInSolr("down")
+        down.down = True
+
+        async def test(solr):
+            return await solr.index_versions()
+        versions = self.run_with_replicas([first, second, down], test)
+        self.assertEqual(sorted(versions.values()), [7, 9])
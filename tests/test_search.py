@@ -1,8 +1,465 @@
 #!/usr/bin/env python3
 
+import asyncio
+import json
+import os
+import tempfile
+import time
 import unittest
-from unittest import mock
+import unittest.mock
 
-class Test(unittest.TestCase):
-    def test(self):
-        self.assertEqual(True, True)
+import tornado.httpserver
+import tornado.testing
+from tornado.httpclient import HTTPClientError
+
+from simple_search import smartsearch
+from simple_search.admission import DEADLINE_MISSES, DeadlineExceeded
+from simple_search.head_snapshot import build_snapshot
+from simple_search.querylog import QueryLog
+from simple_search.solr.cassette import Cassette, entry_qtime, make_replay_app
+from simple_search.solr.fake_solr import Latency, make_app as make_fake_solr
+from simple_search.solr.search import DEADLINE_GRACE, Searcher
+from test_replicas import StandInSolr
+
+CASSETTE = os.path.join(os.path.dirname(__file__), "data", "solr-cassette.ndjson")
+
+
+class RecordingQueryLog(QueryLog):
+    """ Query log keeping the records in memory """
+    def __init__(self):
+        super().__init__("queries", 1.0, "slow-queries", slow_threshold=0)
+        self.records = []
+
+    def _put(self, item):
+        self.records.append(item)
+
+
+class SearcherReplayTest(unittest.TestCase):
+    """
+    End to end tests of the searcher against solr responses replayed from
+    tests/data/solr-cassette.ndjson. Searches sending other solr parameters
+    than when the cassette was recorded fail, as they are not recorded.
+    Re-record the cassette with solr-cassette record when that is intended
+
+    The cassette is synthetic: it was recorded against fake_solr, not a real
+    solr, so it pins the parameters the searcher sends and how it handles
+    responses shaped like those of the simple-search collection, but not the
+    ranking of the real index
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.cassette = Cassette.load(CASSETTE)
+
+    def run_search(self, search, **kwargs):
+        async def run():
+            sock, port = tornado.testing.bind_unused_port()
+            server = tornado.httpserver.HTTPServer(make_replay_app(self.cassette))
+            server.add_sockets([sock])
+            searcher = Searcher(f"http://127.0.0.1:{port}", **dict({"cache_size": 0}, **kwargs))
+            try:
+                return await search(searcher)
+            finally:
+                searcher.solr.close()
+                server.stop()
+        return asyncio.run(run())
+
+    def recorded_docs(self, q, **params):
+        for entry in self.cassette.entries.values():
+            recorded = dict(entry["params"])
+            if entry["path"] == "/select" and recorded["q"] == [q] and all(recorded.get(k) == [v] for k, v in params.items()):
+                return entry, entry["response"]["response"]["docs"]
+        raise KeyError(q)
+
+    def test_result_keeps_solr_ranking(self):
+        result = self.run_search(lambda searcher: searcher.search("harry potter"))
+        _, docs = self.recorded_docs("harry potter", fl="pids,title,creator,contributor,workid,work_type,language,pid_details:[json],pid_to_type_map,score")
+        self.assertEqual([r["pids"] for r in result], [d["pids"] for d in docs])
+        self.assertEqual(set(result[0]), {"pids", "title", "language", "pid_details"})
+        self.assertEqual(result[0]["pid_details"], docs[0]["pid_details"])
+
+    def test_pid_details_fall_back_to_pid_to_type_map(self):
+        result = self.run_search(lambda searcher: searcher.search("gammel bog", rows=5))
+        _, docs = self.recorded_docs("gammel bog", rows="5")
+        # The last document was recorded without pid_details
+        self.assertNotIn("pid_details", docs[4])
+        self.assertEqual(result[4]["pid_details"], [{"pid": entry.split(":::")[0], "type": entry.split(":::")[2]}
+                                                    for entry in docs[4]["pid_to_type_map"]])
+        self.assertEqual(result[3]["pid_details"], docs[3]["pid_details"])
+
+    def test_debug(self):
+        page = self.run_search(lambda searcher: searcher.search_page("harry potter", True))
+        self.assertEqual(set(page.result[0]["debug"]), {"creator", "workid"})
+        entry, _ = self.recorded_docs("harry potter", debug="timing")
+        self.assertEqual(page.timing["solr"], {"qtime": entry["response"]["responseHeader"]["QTime"],
+                                               "components": entry["response"]["debug"]["timing"]})
+        self.assertLessEqual({"parse_options", "build_params", "admission", "solr", "postprocess"}, set(page.timing["stages"]))
+        self.assertGreaterEqual(page.timing["total"], sum(page.timing["stages"].values()))
+        self.assertNotIn("explain", page.timing)
+
+    def test_debug_explain(self):
+        page = self.run_search(lambda searcher: searcher.search_page("harry potter", True, explain=True))
+        self.assertEqual(list(page.timing["explain"]), [r["debug"]["workid"] for r in page.result])
+
+    def test_debug_bypasses_cache(self):
+        async def search(searcher):
+            await searcher.search("harry potter")
+            return await searcher.search_page("harry potter", True)
+        page = self.run_search(search, cache_size=10)
+        self.assertIsNotNone(page.timing)
+        self.assertNotIn("cache", page.timing["stages"])
+
+    def test_options_and_fields(self):
+        async def search(searcher):
+            return (await searcher.search("hest", options={"include-synonyms": True}, rows=5),
+                    await searcher.search("hest", fields=["pids", "title"]))
+        with_synonyms, projected = self.run_search(search)
+        self.assertEqual(len(with_synonyms), 5)
+        self.assertEqual(set(projected[0]), {"pids", "title"})
+
+    def test_cursor_paging(self):
+        async def search(searcher):
+            first, cursor = await searcher.search_cursor("ko", rows=3)
+            second, _ = await searcher.search_cursor("ko", rows=3, cursor=cursor)
+            return first, second
+        first, second = self.run_search(search)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 3)
+        self.assertFalse({json.dumps(r["pids"]) for r in first} & {json.dumps(r["pids"]) for r in second})
+
+    def test_latency_follows_recorded_qtime(self):
+        entry, _ = self.recorded_docs("harry potter", rows="10", start="0")
+
+        async def search(searcher):
+            start = time.perf_counter()
+            await searcher.search("harry potter")
+            return time.perf_counter() - start
+        self.assertGreaterEqual(self.run_search(search), entry_qtime(entry))
+
+    def test_index_version(self):
+        async def refresh(searcher):
+            await searcher.refresh_index_version()
+            return searcher.index_version
+        self.assertEqual(self.run_search(refresh), 1)
+
+    def test_unrecorded_search_fails(self):
+        with self.assertRaises(HTTPClientError) as context:
+            self.run_search(lambda searcher: searcher.search("not recorded"))
+        self.assertEqual(context.exception.code, 404)
+
+    def test_query_log(self):
+        async def search(searcher):
+            await searcher.search("hest", fields=["pids", "title"])
+            await searcher.search("hest", fields=["pids", "title"])
+        query_log = RecordingQueryLog()
+        self.run_search(search, cache_size=10, query_log=query_log)
+        slow = [record for path, record in query_log.records if path == "slow-queries"]
+        sampled = [record for path, record in query_log.records if path == "queries"]
+        self.assertEqual([r["cache"] for r in sampled], ["miss", "hit"])
+        self.assertEqual(sampled[0]["results"], 10)
+        self.assertIsInstance(sampled[0]["qtime"], int)
+        self.assertIsNone(sampled[1]["qtime"])
+        self.assertEqual(slow[0]["solr_params"]["q"], "hest")
+        self.assertEqual(slow[0]["solr_params"]["fl"], "pids,title")
+        self.assertIsNone(slow[1]["solr_params"])
+
+    def test_unverified_head_snapshot_is_not_used(self):
+        snapshot = self.run_search(lambda searcher: build_snapshot(searcher, [("harry potter", {})]))
+        # A stale result, which must not be served until a replica is known to have the snapshot version
+        snapshot["entries"][0]["result"] = []
+        query_log = RecordingQueryLog()
+
+        async def search(searcher):
+            async def no_versions(timeout=None):
+                return {}
+            results = [await searcher.search("harry potter")]
+            # No replica answered the index version check
+            searcher.solr.index_versions = no_versions
+            await searcher.refresh_index_version()
+            results.append(await searcher.search("harry potter"))
+            return results
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "head-snapshot.json")
+            with open(path, "w") as fp:
+                json.dump(snapshot, fp)
+            results = self.run_search(search, head_snapshot_file=path, query_log=query_log)
+        self.assertTrue(all(results))
+        self.assertEqual([record["cache"] for path, record in query_log.records if path == "queries"], ["miss", "miss"])
+
+    def test_head_snapshot(self):
+        snapshot = self.run_search(lambda searcher: build_snapshot(searcher, [("harry potter", {})]))
+        self.assertEqual(snapshot["index_version"], 1)
+        self.assertEqual(len(snapshot["entries"]), 1)
+        expected = self.run_search(lambda searcher: searcher.search("harry potter"))
+        # Solr stand-in with the index version of the cassette, counting the searches it gets
+        stand_in = StandInSolr("solr", index_version=1)
+        query_log = RecordingQueryLog()
+
+        async def run(path):
+            searcher = Searcher(stand_in.start(), head_snapshot_file=path, cache_size=0, query_log=query_log)
+            try:
+                await searcher.refresh_index_version()
+                result = await searcher.search("harry potter")
+                kept = bool(searcher.head_results)
+                stand_in.index_version = 2
+                await searcher.refresh_index_version()
+                return result, kept, searcher.head_results
+            finally:
+                searcher.solr.close()
+                stand_in.server.stop()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "head-snapshot.json")
+            with open(path, "w") as fp:
+                json.dump(snapshot, fp)
+            result, kept, head_results = asyncio.run(run(path))
+        self.assertEqual(result, expected)
+        self.assertEqual([record["cache"] for path, record in query_log.records if path == "queries"], ["head"])
+        self.assertEqual(stand_in.requests, 0)
+        self.assertTrue(kept)
+        # Dropped when the index version changed
+        self.assertEqual(head_results, {})
+
+
+class SearcherIndexVersionTest(unittest.TestCase):
+    """ Index versions of searchers on replicas which report different versions """
+    def run_refreshes(self, stand_ins, refreshes, head_results_version=None):
+        async def run():
+            searcher = Searcher([stand_in.start() for stand_in in stand_ins], cache_size=10)
+            if head_results_version is not None:
+                searcher.head_results = {"key": ([], None, False)}
+                searcher.head_results_version = head_results_version
+            cleared = []
+            try:
+                for change in refreshes:
+                    change()
+                    searcher.cache.put("key", ([], None, False))
+                    await searcher.refresh_index_version()
+                    cleared.append(searcher.cache.get("key") is None)
+                return searcher, cleared
+            finally:
+                searcher.solr.close()
+                for stand_in in stand_ins:
+                    stand_in.server.stop()
+        return asyncio.run(run())
+
+    def test_different_versions_of_replicas_do_not_clear_the_cache(self):
+        first, second = StandInSolr("first", index_version=7), StandInSolr("second", index_version=9)
+
+        def reindex_second():
+            second.index_version = 10
+        searcher, cleared = self.run_refreshes([first, second], [lambda: None] * 5 + [reindex_second], head_results_version=7)
+        self.assertEqual(cleared, [False] * 5 + [True])
+        self.assertEqual(searcher.index_generation, 1)
+        # The snapshot matched the first replica, whose index did not change
+        self.assertTrue(searcher.head_results)
+        self.assertEqual(searcher.head_results_replica, searcher.solr_urls[0])
+
+    def test_snapshot_is_dropped_when_its_replica_changes(self):
+        first, second = StandInSolr("first", index_version=7), StandInSolr("second", index_version=9)
+
+        def reindex_first():
+            first.index_version = 8
+        searcher, _ = self.run_refreshes([first, second], [lambda: None, reindex_first], head_results_version=7)
+        self.assertEqual(searcher.head_results, {})
+
+    def test_snapshot_of_unknown_version_is_dropped(self):
+        searcher, _ = self.run_refreshes([StandInSolr("first", index_version=7), StandInSolr("second", index_version=9)],
+                                         [lambda: None], head_results_version=3)
+        self.assertEqual(searcher.head_results, {})
+
+
+class SearcherReloadTest(unittest.TestCase):
+    """ Reloading of the smartsearch and curated search files while running """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.smartsearch_file = os.path.join(self.directory.name, "search2works.json")
+        self.curated_search_file = os.path.join(self.directory.name, "curated.json")
+        self.write(self.smartsearch_file, {"hest": [["work:1", 10]]})
+        self.write(self.curated_search_file, [{"search": ["hest"], "override": {"q": "heste"}}])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, path, content, text=None):
+        with open(path, "w") as fp:
+            fp.write(text if text is not None else json.dumps(content))
+        # Makes the modification visible, also on file systems with coarse mtimes
+        mtime = os.stat(path).st_mtime
+        os.utime(path, (mtime + 10, mtime + 10))
+
+    def run_searcher(self, test):
+        async def run():
+            searcher = Searcher("http://127.0.0.1:1/solr", self.smartsearch_file, self.curated_search_file, cache_size=10)
+            try:
+                return await test(searcher)
+            finally:
+                searcher.solr.close()
+        return asyncio.run(run())
+
+    def test_reload_swaps_changed_files(self):
+        async def test(searcher):
+            smartsearch = searcher.smartsearch
+            versions = dict(searcher.status()["data_versions"])
+            searcher.cache.put("key", ([], None, False))
+            searcher.head_results = {"key": ([], None, False)}
+            self.write(self.curated_search_file, [{"search": ["ko"], "override": {"q": "køer"}}])
+            seen_while_loading = []
+            path, loader = searcher.data_files["curated_search"]
+
+            def load(path):
+                # Runs in the executor, while searches still see the current data
+                seen_while_loading.append(searcher.curated_search("ko"))
+                return loader(path)
+            searcher.data_files["curated_search"] = (path, load)
+
+            self.assertEqual(await searcher.reload_data(), ["curated_search"])
+            self.assertEqual(seen_while_loading, [("ko", {})])
+            self.assertEqual(searcher.curated_search("ko"), ("køer", {}))
+            self.assertIs(searcher.smartsearch, smartsearch)
+            self.assertEqual(len(searcher.cache), 0)
+            self.assertEqual(searcher.head_results, {})
+            data_versions = searcher.status()["data_versions"]
+            self.assertEqual(data_versions["smartsearch"], versions["smartsearch"])
+            self.assertGreater(data_versions["curated_search"]["mtime"], versions["curated_search"]["mtime"])
+            # Nothing changed since
+            self.assertEqual(await searcher.reload_data(), [])
+        self.run_searcher(test)
+
+    def test_suggestions_are_built_lazily_from_the_smartsearch_content(self):
+        async def test(searcher):
+            # Not built until suggestions are asked for
+            self.assertIsNone(searcher.suggestions)
+            suggestions = [searcher.suggest("he")]
+            index = searcher.suggestions
+            searcher.suggest("hes")
+            self.assertIs(searcher.suggestions, index)
+            self.write(self.smartsearch_file, {"hestehoved": [["work:2", 3]]})
+            await searcher.reload_data()
+            suggestions.append(searcher.suggest("he"))
+            return suggestions
+        with unittest.mock.patch.object(smartsearch, "load_content", wraps=smartsearch.load_content) as load_content:
+            suggestions = self.run_searcher(test)
+        # Once at startup and once on reload, shared with SmartSearch
+        self.assertEqual(load_content.call_count, 2)
+        self.assertEqual(suggestions, [[{"query": "hest", "count": 10}], [{"query": "hestehoved", "count": 3}]])
+
+    def test_forced_reload_reaches_other_workers(self):
+        reload_file = os.path.join(self.directory.name, "reloads")
+
+        async def test(searcher):
+            # Another worker, forked from the same process
+            worker = Searcher("http://127.0.0.1:1/solr", self.smartsearch_file, self.curated_search_file, cache_size=10)
+            try:
+                searcher.share_reloads(reload_file)
+                worker.share_reloads(reload_file)
+                worker.cache.put("key", ([], None, False))
+                curated_search = worker.curated_search
+                await worker.watch_data_files()
+                self.assertIs(worker.curated_search, curated_search)
+
+                self.assertEqual(await searcher.force_reload(), ["smartsearch", "curated_search"])
+                # The files did not change, so only the forced reload makes the worker reload
+                await worker.watch_data_files()
+                self.assertIsNot(worker.curated_search, curated_search)
+                self.assertEqual(len(worker.cache), 0)
+                curated_search = worker.curated_search
+                await worker.watch_data_files()
+                self.assertIs(worker.curated_search, curated_search)
+            finally:
+                worker.solr.close()
+        self.run_searcher(test)
+
+    def test_failed_reload_keeps_current_data(self):
+        async def test(searcher):
+            smartsearch, curated_search = searcher.smartsearch, searcher.curated_search
+            versions = dict(searcher.data_versions)
+            searcher.cache.put("key", ([], None, False))
+            self.write(self.smartsearch_file, None, text='{"hest": [["work:2"')
+            with self.assertLogs("simple_search.solr.search", "ERROR"):
+                await searcher.watch_data_files()
+            self.assertIs(searcher.smartsearch, smartsearch)
+            self.assertIs(searcher.curated_search, curated_search)
+            self.assertEqual(searcher.data_versions, versions)
+            self.assertIsNotNone(searcher.cache.get("key"))
+            self.assertEqual(searcher.smartsearch.get("hest"), ["work:1"])
+        self.run_searcher(test)
+
+
+class SearcherBatchTest(unittest.TestCase):
+    def test_internal_errors_are_logged(self):
+        # The documents of the stand-in have neither pid_details nor pid_to_type_map
+        stand_in = StandInSolr("solr")
+
+        async def run():
+            searcher = Searcher(stand_in.start(), cache_size=0)
+            try:
+                return await searcher.search_batch([{"q": "hest"}])
+            finally:
+                searcher.solr.close()
+                stand_in.server.stop()
+        with self.assertLogs("simple_search.solr.search", "ERROR"):
+            results = asyncio.run(run())
+        self.assertEqual(results, [{"error": "'pid_to_type_map'"}])
+
+
+class SearcherDeadlineTest(unittest.TestCase):
+    """ Deadlines against fake_solr, which answers with partial results when timeAllowed runs out """
+    def run_search(self, search, solr_app=None, stand_in=None, **kwargs):
+        async def run():
+            if stand_in is not None:
+                url = stand_in.start()
+                server = stand_in.server
+            else:
+                sock, port = tornado.testing.bind_unused_port()
+                server = tornado.httpserver.HTTPServer(solr_app)
+                server.add_sockets([sock])
+                url = f"http://127.0.0.1:{port}/solr/simple-search"
+            searcher = Searcher(url, **dict({"cache_size": 10}, **kwargs))
+            try:
+                return await search(searcher), searcher
+            finally:
+                searcher.solr.close()
+                server.stop()
+        return asyncio.run(run())
+
+    def test_partial_page_is_not_cached(self):
+        misses = DEADLINE_MISSES.get(reason="partial")
+
+        async def search(searcher):
+            return await searcher.search_page("hest", deadline=time.monotonic() + 0.05)
+        # Solr needs more time than the deadline leaves, so it stops at timeAllowed
+        page, searcher = self.run_search(search, make_fake_solr(Latency(0.5)))
+        self.assertTrue(page.partial)
+        self.assertEqual(len(page.result), 10)
+        self.assertEqual(len(searcher.cache), 0)
+        self.assertEqual(DEADLINE_MISSES.get(reason="partial"), misses + 1)
+
+    def test_complete_page_is_cached(self):
+        async def search(searcher):
+            return await searcher.search_page("hest", deadline=time.monotonic() + 2)
+        page, searcher = self.run_search(search, make_fake_solr(Latency(0.001)))
+        self.assertFalse(page.partial)
+        self.assertEqual(len(searcher.cache), 1)
+
+    def test_expired_deadline_is_not_sent_to_solr(self):
+        stand_in = StandInSolr("solr")
+
+        async def search(searcher):
+            with self.assertRaises(DeadlineExceeded):
+                await searcher.search("hest", deadline=time.monotonic() - 1)
+        self.run_search(search, stand_in=stand_in)
+        self.assertEqual(stand_in.requests, 0)
+
+    def test_solr_not_answering_within_the_deadline(self):
+        # Unlike solr, the stand-in ignores timeAllowed
+        stand_in = StandInSolr("solr", delay=DEADLINE_GRACE + 0.5)
+        misses = DEADLINE_MISSES.get(reason="timeout")
+
+        async def search(searcher):
+            start = time.monotonic()
+            with self.assertRaises(DeadlineExceeded):
+                await searcher.search("hest", deadline=start + 0.05)
+            return time.monotonic() - start
+        elapsed, _ = self.run_search(search, stand_in=stand_in)
+        # Given up after the deadline and the grace for solr to return partial results
+        self.assertLess(elapsed, DEADLINE_GRACE + 0.5)
+        self.assertEqual(DEADLINE_MISSES.get(reason="timeout"), misses + 1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+os.environ.setdefault("AUTHKEYMAP", json.dumps({"test": "test-token"}))
+
+from simple_search.profiling import RequestProfiler
+from simple_search.service import AUTHKEYMAP, BatchSearchHandler, ReloadHandler, SearchHandler, SuggestHandler
+from simple_search.solr.cassette import Cassette, make_replay_app
+from simple_search.solr.fake_solr import Latency, make_app as make_fake_solr
+from simple_search.solr.search import DEADLINE_GRACE, Searcher, encode_cursor
+from test_replicas import StandInSolr
+
+CASSETTE = os.path.join(os.path.dirname(__file__), "data", "solr-cassette.ndjson")
+
+
+class SearchServiceTest(tornado.testing.AsyncHTTPTestCase):
+    """ Tests of the search handlers against solr responses replayed from tests/data/solr-cassette.ndjson """
+    STREAM_PAGE_SIZE = 3
+
+    def get_app(self):
+        sock, port = tornado.testing.bind_unused_port()
+        self.solr_server = tornado.httpserver.HTTPServer(make_replay_app(Cassette.load(CASSETTE)))
+        self.solr_server.add_sockets([sock])
+        self.searcher = Searcher(f"http://127.0.0.1:{port}", cache_size=100)
+        return tornado.web.Application([
+            ("/search", SearchHandler, {"searcher": self.searcher, "deadline": 0, "profiler": RequestProfiler(),
+                                        "stream_page_size": self.STREAM_PAGE_SIZE}),
+            ("/search/batch", BatchSearchHandler, {"searcher": self.searcher, "max_concurrency": 4}),
+            ("/suggest", SuggestHandler, {"searcher": self.searcher}),
+            # As with several workers and no data watching
+            ("/admin/reload", ReloadHandler, {"searcher": self.searcher, "propagated": False}),
+        ])
+
+    def tearDown(self):
+        self.searcher.solr.close()
+        self.solr_server.stop()
+        super().tearDown()
+
+    def post_json(self, path, body):
+        return self.fetch(path, method="POST", body=json.dumps(body))
+
+    def test_stream_bypasses_cache(self):
+        response = self.post_json("/search", {"q": "ko", "rows": 7, "stream": True})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        lines = response.body.decode("utf8").splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual([json.loads(line)["title"] for line in lines], [f"ko {i}" for i in range(7)])
+        self.assertEqual(len(self.searcher.cache), 0)
+
+    def test_forged_cursor_is_a_bad_request(self):
+        response = self.post_json("/search", {"q": "ko", "rows": 3, "cursor": encode_cursor("forged")})
+        self.assertEqual(response.code, 400)
+        self.assertIn("Invalid cursor", json.loads(response.body)["error"])
+
+    def test_batch_search(self):
+        queries = [{"q": "hest", "options": {"include-synonyms": True}, "rows": 5},
+                   {"rows": 3},
+                   {"q": "harry potter"},
+                   {"q": "hest", "fields": ["pids", "bogus"]},
+                   {"q": "hest", "fields": ["pids", "title"]},
+                   {"q": 5}]
+        response = self.post_json("/search/batch", {"queries": queries})
+        self.assertEqual(response.code, 200)
+        results = json.loads(response.body)["results"]
+        self.assertEqual(len(results), len(queries))
+        # In the order of the queries
+        self.assertEqual(results[0]["result"], self.io_loop.run_sync(
+            lambda: self.searcher.search("hest", options={"include-synonyms": True}, rows=5)))
+        self.assertEqual(results[2]["result"], self.io_loop.run_sync(lambda: self.searcher.search("harry potter")))
+        self.assertEqual({tuple(r) for r in results[4]["result"]}, {("pids", "title")})
+        self.assertEqual(results[1], {"error": "missing parameter 'q'"})
+        self.assertIn("fields must be a list", results[3]["error"])
+        self.assertEqual(results[5], {"error": "q must be a string"})
+
+    def test_batch_search_rejects_invalid_batches(self):
+        too_many = [{"q": "hest"}] * (BatchSearchHandler.MAX_BATCH_SIZE + 1)
+        for body in [{"queries": too_many}, {"queries": {"q": "hest"}}, {"queries": ["hest"]}, {}]:
+            response = self.post_json("/search/batch", body)
+            self.assertEqual(response.code, 400)
+            self.assertIn("error", json.loads(response.body))
+
+    def test_suggest_rejects_non_integer_k(self):
+        self.assertEqual(json.loads(self.fetch("/suggest?prefix=he&k=5").body), {"suggestions": []})
+        response = self.fetch("/suggest?prefix=he&k=five")
+        self.assertEqual(response.code, 400)
+        self.assertEqual(json.loads(response.body), {"error": "k must be an integer"})
+
+    def test_reload_rejected_unless_it_reaches_all_workers(self):
+        access_token = next(iter(AUTHKEYMAP.values()))
+        response = self.post_json("/admin/reload", {"access-token": access_token, "force": True})
+        self.assertEqual(response.code, 409)
+        self.assertIn("--data-watch-interval", json.loads(response.body)["error"])
+
+
+class DeadlineServiceTest(tornado.testing.AsyncHTTPTestCase):
+    """ Searches running out of time or capacity, against fake_solr and a solr stand-in ignoring timeAllowed """
+    DEADLINE = 0.05
+
+    def get_app(self):
+        sock, port = tornado.testing.bind_unused_port()
+        # Slower than the deadline, so it answers with the results found within timeAllowed
+        self.fake_solr = tornado.httpserver.HTTPServer(make_fake_solr(Latency(0.5)))
+        self.fake_solr.add_sockets([sock])
+        self.searcher = Searcher(f"http://127.0.0.1:{port}/solr/simple-search", cache_size=100,
+                                 solr_max_concurrency=1, solr_queue_size=0)
+        self.stand_in = StandInSolr("solr", delay=DEADLINE_GRACE + 0.5)
+        self.slow_searcher = Searcher(self.stand_in.start(), cache_size=100)
+        return tornado.web.Application([
+            ("/search", SearchHandler, {"searcher": self.searcher, "deadline": self.DEADLINE, "profiler": RequestProfiler()}),
+            ("/slow/search", SearchHandler, {"searcher": self.slow_searcher, "deadline": self.DEADLINE,
+                                             "profiler": RequestProfiler()}),
+        ])
+
+    def tearDown(self):
+        self.searcher.solr.close()
+        self.slow_searcher.solr.close()
+        self.fake_solr.stop()
+        self.stand_in.server.stop()
+        super().tearDown()
+
+    def test_partial_results(self):
+        response = self.fetch("/search", method="POST", body=json.dumps({"q": "hest"}))
+        self.assertEqual(response.code, 200)
+        body = json.loads(response.body)
+        self.assertTrue(body["partial"])
+        self.assertEqual(len(body["result"]), 10)
+        self.assertEqual(len(self.searcher.cache), 0)
+
+    @tornado.testing.gen_test
+    async def test_overloaded(self):
+        # One search at a time and no queue, so the second concurrent search is rejected
+        responses = await asyncio.gather(*[self.http_client.fetch(self.get_url(f"/search?q=hest{i}"), raise_error=False)
+                                           for i in range(2)])
+        self.assertEqual(sorted(r.code for r in responses), [200, 503])
+        rejected = next(r for r in responses if r.code == 503)
+        self.assertEqual(rejected.headers["Retry-After"], "1")
+        self.assertIn("capacity", json.loads(rejected.body)["error"])
+
+    def test_deadline_exceeded(self):
+        response = self.fetch("/slow/search?q=hest")
+        self.assertEqual(response.code, 504)
+        self.assertIn("deadline", json.loads(response.body)["error"])
+
+
+if __name__ == '__main__':
+    tornado.testing.main()
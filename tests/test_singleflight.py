@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+
+from simple_search.singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_coalesces_concurrent_calls(self):
+        calls = []
+
+        async def fetch(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        async def run():
+            single_flight = SingleFlight()
+            results = await asyncio.gather(*[single_flight.do("key", fetch, 21) for _ in range(5)])
+            again = await single_flight.do("key", fetch, 1)
+            return results, again, single_flight.stats()
+
+        results, again, stats = asyncio.run(run())
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(again, 2)
+        self.assertEqual(calls, [21, 1])
+        self.assertEqual(stats, {"in_flight": 0, "calls": 2, "coalesced": 4})
+
+    def test_shares_exceptions(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("solr down")
+
+        async def run():
+            single_flight = SingleFlight()
+            return await asyncio.gather(*[single_flight.do("key", fail) for _ in range(3)], return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
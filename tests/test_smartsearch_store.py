@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from simple_search.smartsearch_store import SmartSearchStore, is_store, write_store
+
+
+class SmartSearchStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.search2works = {
+            "harry potter": [["work:1", 50], ["work:2", 20], ["work:3", 5], ["work:4", 1]],
+            "harry": [["work:1", 7]],
+            "hest": [["work:5", 3], ["work:1", 2]],
+            "æbler": [["work:6", 1]],
+        }
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        write_store(self.search2works, self.path, top_n=3)
+        self.store = SmartSearchStore(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_lookup(self):
+        self.assertTrue(is_store(self.path))
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(self.store["harry potter"], [["work:1", 50], ["work:2", 20], ["work:3", 5]])
+        self.assertEqual(self.store.get("æbler"), [["work:6", 1]])
+        self.assertEqual(self.store.get("harr", []), [])
+        self.assertNotIn("zebra", self.store)
+        self.assertEqual(sorted(self.store), sorted(self.search2works))
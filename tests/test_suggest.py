@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from simple_search.suggest import PrefixIndex
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def setUp(self):
+        content = {
+            "harry potter": [["work:1", 50], ["work:2", 20]],
+            "Harry  Potter": [["work:1", 100]],
+            "harry": [["work:1", 7]],
+            "hest": [["work:5", 3]],
+            "hestehoved": [["work:6", 30]],
+        }
+        self.index = PrefixIndex.from_smartsearch_content(content, precompute_length=1)
+
+    def test_ranks_by_clicks(self):
+        self.assertEqual(self.index.suggest("h"), [("Harry  Potter", 170), ("hestehoved", 30), ("harry", 7), ("hest", 3)])
+        self.assertEqual(self.index.suggest("HES", k=1), [("hestehoved", 30)])
+
+    def test_no_match(self):
+        self.assertEqual(self.index.suggest("x"), [])
+        self.assertEqual(self.index.suggest("  "), [])
+        self.assertEqual(len(self.index), 4)